@@ -1,27 +1,93 @@
 import openai
 import json
 import os
-import random
+import hashlib
+import asyncio
+from bisect import bisect_right
+from itertools import accumulate
 from tqdm.auto import tqdm
-from collections import defaultdict
+from collections import defaultdict, Counter
 from utils import *
+from paper import Paper, as_paper
 
-from config import TRUNCATE
+from early_stopping import StoppingRule
+from config import TRUNCATE, CONTESTANT_MODE, BAD_PAPERS_PER_REQUEST, EARLY_STOPPING, EARLY_STOPPING_CONFIDENCE, EARLY_STOPPING_MIN_COMPARISONS, FLIP_SEED, DEBIAS_BOTH_ORDERS
+
+# Maximum number of tokens of a comparison prompt
+COMPARISON_TOKEN_BUDGET = 8_000
+
+# Details of each criterion, as given to the model with the comparison template
+CRITERIA_DETAILS = {
+    'relevance': "Relevance (Correctness): Does the answer address the prompt?",
+    'clarity': {
+        'correctlanguage': "Clarity (Correct language): Is the paper written in good English, with correct grammar, and precise vocabulary?",
+        'organization': "Clarity (Organization): Is the paper well organized in meaningful sections and subsections?",
+        'explanations': "Clarity (Explanation): Are the concepts clearly explained, with short sentences?",
+    },
+    'contribution': {
+        'coverage': "Contributions (Coverage): Does the answer provide a comprehensive overview, comparing and contrasting a plurality of viewpoints?",
+        'title': "Contributions (Title): Does the title of the paper accurately address the prompt?",
+        'abstract': "Contributions (Abstract): Does the abstract of the paper accurately reflect the content of the paper?",
+        'introduction': "Contributions (Introduction): Does the introduction of the paper accurately reflect the content of the paper?",
+        'conclusion': "Contributions (Conclusion): Does the conclusion of the paper highlight the main findings of the paper?",
+    },
+    'soundness': "Soundness (Factuality/ Attribution): Does the answer present accurate facts, supported by citations of authoritative references?",
+    'responsibility': "Responsibility: Does the paper address potential risks or ethical issues and is respectful of human moral values, including fairness, and privacy, and is free of libelous or unlawful statements, does not infringe upon the rights of others, or contain material or instructions that might cause harm or injury?",
+}
+
+# Soundness sub-criteria, evaluated on the generated paper alone
+SOUNDNESS_CRITERIA = {
+    'c1': "whether the references are legitimate",
+    'c2': "whether the references employed by the paper align well with the content it generates",
+    'c3': "whether the paper does not randomly cite unrelated papers, maintaining a coherent academic narrative",
+}
+
+def criterion_details(super_category, sub_category=None):
+    """ Details of a criterion; every detail of the super-category when the sub-criterion is unknown """
+    details = CRITERIA_DETAILS.get(super_category)
+    if details is None:
+        return "\n".join(detail for value in CRITERIA_DETAILS.values() for detail in ([value] if isinstance(value, str) else value.values()))
+    if isinstance(details, str):
+        return details
+    if sub_category in details:
+        return details[sub_category]
+    return "\n".join(details.values())
+
+def is_flipped(*comparison):
+    """ Whether the papers of a comparison are shown in swapped order, against the position bias of the model.
+    The flip is drawn from a hash of the comparison (paper digests, criterion) and FLIP_SEED rather than at
+    random, so that the same comparison always gives the same prompt, and hits the LLM cache, across runs """
+    key = json.dumps([FLIP_SEED, *comparison])
+    return hashlib.sha256(key.encode("utf-8")).digest()[0] & 1 == 1
+
+def average_verdicts(first, second):
+    """ Average of the verdicts of two comparison results with the same template. The model does not always
+    answer with the same keys in both orders: a verdict found in only one of the results is kept as is """
+    if isinstance(first, dict) and isinstance(second, dict):
+        averages = {key: average_verdicts(value, second[key]) if key in second else value for key, value in first.items()}
+        for key, value in second.items():
+            if key not in averages:
+                averages[key] = value
+        return averages
+    if isinstance(first, dict) or isinstance(second, dict):
+        return first
+    return (float(first) + float(second)) / 2
 
 class BaselineReviewer:
     def __init__(self):
-        current_real_dir = os.path.dirname(os.path.realpath(__file__))
-        with open(os.path.join(current_real_dir, 'scoring_program_chatgpt_api_key.json'), 'rb') as f:
-            self.api_key = json.load(f)['key']
+        # API keys are attached to each request by the key pool, not to the openai module
+        self.key_pool = get_key_pool()
 
-        openai.api_key = self.api_key
+        # With EARLY_STOPPING, the remaining references of a criterion are skipped once its verdicts are conclusive
+        self.stopping_rule = StoppingRule(EARLY_STOPPING_CONFIDENCE, EARLY_STOPPING_MIN_COMPARISONS)
+        self.comparison_stats = {"comparisons": 0, "skipped": 0}
 
-    def compare_papers(self, good_papers, bad_papers, prediction_paper, prediction_prompt, criteria):
+    def compare_papers(self, good_papers, bad_papers, prediction_paper, prediction_prompt, criteria, timeout=None):
         ''' Function to compare the solution and prediction papers
         Args:
-            good_papers: list of good papers
-            bad_papers: json file of bad papers
-            prediction_paper: prediction paper
+            good_papers: list of good papers (Paper, or JSON text)
+            bad_papers: json file of bad papers (Paper, or JSON text)
+            prediction_paper: prediction paper (Paper, or JSON text)
             prediction_prompt: prediction prompt
             criteria: criteria for comparison in json format 
                 (for example: {'Clarity': 
@@ -36,7 +102,9 @@ class BaselineReviewer:
                                 ...
                                 }
                 )
+            timeout: seconds after which the pending requests are cancelled and asyncio.TimeoutError is raised, None for no limit
         Returns:
+            [comparison_result, comments]
             comparison_result: comparison result in json format
                 (for example: {'Clarity':
                                     {'Correct grammar': 0.0},
@@ -50,85 +118,112 @@ class BaselineReviewer:
                                 ...
                                 }
                 )
+            comments: None, the comments being written once every paper is scored (see get_html_comments),
+                except for the default comparison result of an empty paper
             '''
         # If the prediction paper is {"Title: '', "Abstract": '', "Citations": '', "Introduction": '', "Related work": '', "Method": '', "Experiments": '', "Results": '', "Conclusion": ''}, or similar. Basically no values for the keys. 
         # Then we return the default values for the comparison result. which is 0 for all the criteria. and no comments.
-        empty_string = True
-        for pred in custom_json_loads(prediction_paper):
-            if pred['text'] != '':
-                empty_string = False
-                break
+        good_papers = [as_paper(good_paper) for good_paper in good_papers]
+        bad_papers = {super_category: [as_paper(bad_paper) for bad_paper in super_value] if isinstance(super_value, list) else {sub_category: [as_paper(bad_paper) for bad_paper in sub_value] for sub_category, sub_value in super_value.items()} for super_category, super_value in bad_papers.items()}
+        prediction_paper = as_paper(prediction_paper)
+
+        if prediction_paper.is_empty:
+            return self.default_comparison(criteria, "This is a test response. Please ignore.")
+
+        return run_sync(asyncio.wait_for(self.acompare_papers(good_papers, bad_papers, prediction_paper, prediction_prompt, criteria), timeout))
+
+    def default_comparison(self, criteria, comment):
+        ''' Default comparison result, 0 for all the criteria, with the same comment for each of them '''
+        comparison_result = {}
+        comparison_comment = {}
+        for category, sub_criteria in criteria.items():
+            if isinstance(sub_criteria, str):
+                comparison_result[category] = 0.0
+                comparison_comment[category] = comment
+            else:
+                comparison_result[category] = {}
+                comparison_comment[category] = {}
+                for sub_criterion, value in sub_criteria.items():
+                    comparison_result[category][sub_criterion] = 0.0
+                    comparison_comment[category][sub_criterion] = comment
+
+        # add soundness
+        comparison_result['soundness'] = {'c1': 0.0, 'c2': 0.0, 'c3': 0.0}
+        comparison_comment['soundness'] = {'c1': comment, 'c2': comment, 'c3': comment}
+
+        # add relevance
+        comparison_result['relevance'] = {'title': 0.0, 'abstract': 0.0, 'citations': 0.0}
+        comparison_comment['relevance'] = {'title': comment, 'abstract': comment, 'citations': comment}
+        return [comparison_result, comparison_comment]
+
+    async def acompare_papers(self, good_papers, bad_papers, prediction_paper, prediction_prompt, criteria):
+        ''' Coroutine version of compare_papers (called with a non-empty prediction paper).
+        Every comparison and soundness request is independent: they are all sent at once, bounded by
+        the in-flight limit of the LLM client, and aggregated once they have all returned.
+        '''
+        # (super_category, sub_category or None, bad paper) of each bad comparison
+        bad_comparisons = []
+        for super_category, super_value in bad_papers.items():
+            if isinstance(super_value, list):
+                bad_comparisons += [(super_category, None, bad_paper) for bad_paper in super_value]
+            else:
+                bad_comparisons += [(super_category, sub_category, bad_paper) for sub_category, sub_value in super_value.items() for bad_paper in sub_value]
+
+        print(f"\nComparing the prediction paper with {len(good_papers)} good and {len(bad_comparisons)} bad papers, and calculating soundness...")
+        # Stopping decisions need the real verdicts, so batch planning passes compare with every reference
+        if EARLY_STOPPING and get_batch_session() is None:
+            good_results, bad_verdicts, soundness_result = await asyncio.gather(
+                self.acompare_good_papers_adaptively(good_papers, prediction_paper, prediction_prompt, criteria),
+                self.acompare_bad_papers_adaptively(bad_comparisons, prediction_paper, prediction_prompt),
+                self.acompare_soundness(prediction_paper))
+        else:
+            good_jobs = [self.acompare_two_paper(good_paper, prediction_paper, prediction_prompt, json.dumps(criteria)) for good_paper in good_papers]
+            bad_packs = self.pack_bad_comparisons(bad_comparisons)
+            bad_jobs = [self.acompare_bad_papers(pack, prediction_paper, prediction_prompt) for pack in bad_packs]
+            results = await asyncio.gather(*good_jobs, *bad_jobs, self.acompare_soundness(prediction_paper))
+            good_results = results[:len(good_jobs)]
+            bad_verdicts = [(super_category, sub_category, verdict) for pack, verdicts in zip(bad_packs, results[len(good_jobs):-1]) for (super_category, sub_category, _), verdict in zip(pack, verdicts)]
+            soundness_result = results[-1]
 
-        if empty_string:
-            comparison_result = {}
-            comparison_comment = {}
-            for category, sub_criteria in criteria.items():
-                if isinstance(sub_criteria, str):
-                    comparison_result[category] = 0.0
-                    comparison_comment[category] = "This is a test response. Please ignore."
-                else:
-                    comparison_result[category] = {}
-                    comparison_comment[category] = {}
-                    for sub_criterion, value in sub_criteria.items():
-                        comparison_result[category][sub_criterion] = 0.0
-                        comparison_comment[category][sub_criterion] = "This is a test response. Please ignore."
-
-            # add soundness
-            comparison_result['soundness'] = {'c1': 0.0, 'c2': 0.0, 'c3': 0.0}
-            comparison_comment['soundness'] = {'c1': "This is a test response. Please ignore.", 'c2': "This is a test response. Please ignore.", 'c3': "This is a test response. Please ignore."}
-
-            # add relevance
-            comparison_result['relevance'] = {'title': 0.0, 'abstract': 0.0, 'citations': 0.0}
-            comparison_comment['relevance'] = {'title': "This is a test response. Please ignore.", 'abstract': "This is a test response. Please ignore.", 'citations': "This is a test response. Please ignore."}
-            return [comparison_result, comparison_comment]
-            
-        print("\nComparing good papers with prediction paper...")
-        good_results = []
-        for good_paper in tqdm(good_papers):
-            good_result = self.compare_two_paper(good_paper, prediction_paper, prediction_prompt, json.dumps(criteria))
-            good_results.append(good_result)
         # Combine good results
         combined_good_result = defaultdict(dict)
         for super_category, super_value in good_results[0].items():
             if isinstance(super_value, str) or isinstance(super_value, float) or isinstance(super_value, int):
                 for good_result in good_results:
                     if super_category in combined_good_result:
-                        combined_good_result[super_category] += int(good_result[super_category]) / len(good_results)
+                        combined_good_result[super_category] += float(good_result[super_category]) / len(good_results)
                     else:
-                        combined_good_result[super_category] = int(good_result[super_category]) / len(good_results)  
+                        combined_good_result[super_category] = float(good_result[super_category]) / len(good_results)  
             else:
                 for sub_category, sub_value in super_value.items():
                     for good_result in good_results:
                         try:
                             if super_category in combined_good_result and sub_category in combined_good_result[super_category]:
-                                combined_good_result[super_category][sub_category] += int(good_result[super_category][sub_category]) / len(good_results)
+                                combined_good_result[super_category][sub_category] += float(good_result[super_category][sub_category]) / len(good_results)
                             else:
-                                combined_good_result[super_category][sub_category] = int(good_result[super_category][sub_category]) / len(good_results)
+                                combined_good_result[super_category][sub_category] = float(good_result[super_category][sub_category]) / len(good_results)
                         except:
                             print("Error: ", good_result)
                             print("super_category: ", super_category)
                             print("sub_category: ", sub_category)
                             print("good_results: ", good_results)
                             raise Exception
-        
-        print("\nComparing bad papers with prediction paper...")
+
+        # Combine bad results
         combined_bad_result = defaultdict(dict)
-        for super_category, super_value in tqdm(bad_papers.items()):
-            if isinstance(super_value, list):
-                for bad_paper in super_value:
-                    result = self.compare_two_paper(bad_paper, prediction_paper, prediction_prompt, json.dumps({super_category: "0 if paper 1 is better, 1 if paper 2 is better"}))
-                    if super_category in combined_bad_result:
-                        combined_bad_result[super_category] += int(result[super_category]) / len(super_value)
-                    else:
-                        combined_bad_result[super_category] = int(result[super_category]) / len(super_value)
+        num_bad_verdicts = Counter((super_category, sub_category) for super_category, sub_category, _ in bad_verdicts)
+        for super_category, sub_category, verdict in bad_verdicts:
+            num_papers = num_bad_verdicts[(super_category, sub_category)]
+            if sub_category is None:
+                if super_category in combined_bad_result:
+                    combined_bad_result[super_category] += verdict / num_papers
+                else:
+                    combined_bad_result[super_category] = verdict / num_papers
             else:
-                for sub_category, sub_value in super_value.items():
-                    for bad_paper in sub_value:
-                        result = self.compare_two_paper(bad_paper, prediction_paper, prediction_prompt, json.dumps({super_category: {sub_category: "0 if paper 1 is better, 1 if paper 2 is better"}}))
-                        if super_category in combined_bad_result and sub_category in combined_bad_result[super_category]:
-                            combined_bad_result[super_category][sub_category] += int(result[super_category][sub_category]) / len(sub_value)
-                        else:
-                            combined_bad_result[super_category][sub_category] = int(result[super_category][sub_category]) / len(sub_value)
+                if super_category in combined_bad_result and sub_category in combined_bad_result[super_category]:
+                    combined_bad_result[super_category][sub_category] += verdict / num_papers
+                else:
+                    combined_bad_result[super_category][sub_category] = verdict / num_papers
 
         # Combine good and bad results
         combined_result = defaultdict(dict)
@@ -140,114 +235,264 @@ class BaselineReviewer:
                 for sub_category, sub_value in super_value.items():
                     combined_result[super_category][sub_category] = 0.5*sub_value + 0.5*combined_bad_result[super_category][sub_category]
 
-        print("\nCalculate soundness")
-        combined_result['soundness']['c1'] = self.compare_one_paper(prediction_paper,'Evaluate the soundness of the paper (whether the references are legitimate)','[float number between [0,1] where 0.0 is the lowest and 1.0 is the highest]')
-        combined_result['soundness']['c2'] = self.compare_one_paper(prediction_paper,'Evaluate the soundness of the paper (whether the references employed by the paper align well with the content it generates)','[float number between [0,1] where 0.0 is the lowest and 1.0 is the highest]')
-        combined_result['soundness']['c3'] = self.compare_one_paper(prediction_paper,'Evaluate the soundness of the paper (whether the paper does not randomly cite unrelated papers, maintaining a coherent academic narrative)','[float number between [0,1] where 0.0 is the lowest and 1.0 is the highest]')
-        print("Done calculating soundness")
+        combined_result['soundness'] = soundness_result
+        print("Done comparing papers and calculating soundness")
 
-        combined_comments = self.get_html_comments(combined_result, prediction_paper)
-
-        return [combined_result, combined_comments]
+        # The comments are written afterwards, for all the papers at once (see get_html_comments)
+        return [combined_result, None]
      
-    def get_html_comments(self, generator_score, prediction_paper):
-        combined_html = defaultdict(dict)
+    def get_html_comments(self, generator_scores, prediction_papers):
+        ''' Function to write the reasons of the scores of several papers, shown in the HTML
+        The reasons are written once the scores are known, in one request per paper covering every criterion,
+        and the requests of all the papers are sent at once.
+        Args:
+            generator_scores: scores of each paper, as returned by compare_papers
+            prediction_papers: prediction papers (Paper, or JSON text)
+        Returns:
+            html comments of each paper: {super_category: reason} in CONTESTANT_MODE,
+            {super_category: reason or {sub_category: reason}} otherwise
+        '''
+        async def get_all_html_comments():
+            return await asyncio.gather(*[self.aget_html_comments(generator_score, as_paper(prediction_paper)) for generator_score, prediction_paper in zip(generator_scores, prediction_papers)])
+        return run_sync(get_all_html_comments())
 
-        print("Get html comments for each criterion...")
-        for super_category, super_value in tqdm(generator_score.items()):
-            if isinstance(super_value, float) or isinstance(super_value, int):
-                    combined_html[super_category] = self.ask_chat_gpt_reason(prediction_paper, super_category, super_value)
+    async def aget_html_comments(self, generator_score, prediction_paper):
+        # Contestants only see the reason of each super-category
+        template = {}
+        scores = {}
+        for super_category, super_value in generator_score.items():
+            if isinstance(super_value, dict):
+                template[super_category] = "short reason" if CONTESTANT_MODE else {sub_category: "short reason" for sub_category in super_value}
+                scores[super_category] = {sub_category: round(float(sub_value), 2) for sub_category, sub_value in super_value.items()}
             else:
-                sub_criteria_gpt = self.ask_chat_gpt_reason(prediction_paper, str(super_value), None, "multiple")
-                for sub_value in sub_criteria_gpt:
-                    combined_html[super_category][sub_value['criterion']] = sub_value['reason']
-        return dict(combined_html)
-    
-    def ask_chat_gpt_reason(self, prediction_paper, criterion, score, types="single"):
-        conversation = [{"role": "system", "content": "You are a helpful assistant who will help me evaluate a paper. You have given a score and now you need to provide a reason for the score."}]
-        if types == "multiple":
-            temp = '[{"criterion":..., "reason":...}, {"criterion":..., "reason":...}, ...]'
+                template[super_category] = "short reason"
+                scores[super_category] = round(float(super_value), 2)
 
-            conversation.append({"role": "user", "content":
-            f"Please provide a short reason for each score where 0.0 is the lowest and 1.0 is the highest score for each criterion: {criterion}.\n\n" + \
-            "Paper :\n" + prediction_paper[:(1000 if TRUNCATE else len(prediction_paper))] + \
-            f"\n\nOutput the result in this JSON format {temp}"})
-
-            success = False
-            num_trials = 0
-            while not success and num_trials < 5:
-                try:
-                    result = ask_chat_gpt(conversation)["choices"][0]["message"]["content"]
-                    return custom_json_loads(result)
-
-                except Exception as e:
-                    print("Error: ", e)
-                    print("Retrying...")
-                    num_trials += 1
-                    success = False
-        else:
-            conversation.append({"role": "user", "content":
-            f"Please provide a short reason for the score {score:.2f} for the criterion: {criterion}:\n" + \
-            "Paper :\n" + prediction_paper[:(1000 if TRUNCATE else len(prediction_paper))]})
-
-            result = ask_chat_gpt(conversation)["choices"][0]["message"]["content"]
-            return str(result)
-    
-    def compare_one_paper(self, prediction_paper, description, criterion):
-        conversation = [{"role": "system", "content": "You are a helpful assistant who will help me evaluate a paper."}]
+        conversation = [{"role": "system", "content": "You are a helpful assistant who will help me evaluate a paper. You have given a score and now you need to provide a reason for the score."}]
         conversation.append({"role": "user", "content":
-        f"{description} the output of the template must be a single float value, no explanation:\nThe template:\n" + \
-        criterion + \
-        "Paper :\n" + prediction_paper[:(1000 if TRUNCATE else len(prediction_paper))]})
+        f"Please provide a short reason for each score where 0.0 is the lowest and 1.0 is the highest score for each criterion: {json.dumps(scores)}.\n\n" + \
+        "Paper :\n" + prediction_paper.truncated_text + \
+        "\n\nOutput the reasons in this JSON format, no other text:\n" + json.dumps(template)})
+
+        def fill_reasons(template, result):
+            if isinstance(template, dict):
+                return {key: fill_reasons(value, result.get(key) if isinstance(result, dict) else None) for key, value in template.items()}
+            return result if isinstance(result, str) else ""
 
-        success = False
         num_trials = 0
-        while not success and num_trials < 5:
+        while num_trials < 5:
             try:
-                result = ask_chat_gpt(conversation)["choices"][0]["message"]["content"]
-                return float(result)
-                success = True
+                result = (await aask_chat_gpt(conversation, temperature=0.2*num_trials, placeholder=json.dumps(fill_reasons(template, None))))["choices"][0]["message"]["content"]
+                return fill_reasons(template, custom_json_loads(result))
             except Exception as e:
                 print("Error: ", e)
                 print("Retrying...")
                 num_trials += 1
-                success = False
+        print("WARNING: no valid reasons for the scores, leaving them empty")
+        return fill_reasons(template, None)
 
-    def compare_two_paper(self, paraphrased_paper, prediction_paper, prediction_prompt, criterion):
-        """ Function to compare two papers
+    def pack_bad_comparisons(self, comparisons):
+        """ Pack the bad comparisons of each super-category in groups of at most BAD_PAPERS_PER_REQUEST,
+        each group being sent as one multi-reference request (see acompare_bad_papers) """
+        groups = defaultdict(list)
+        for comparison in comparisons:
+            groups[comparison[0]].append(comparison)
+        return [group[start:start + BAD_PAPERS_PER_REQUEST] for group in groups.values() for start in range(0, len(group), BAD_PAPERS_PER_REQUEST)]
+
+    def record_comparisons(self, num_compared, num_references):
+        self.comparison_stats["comparisons"] += num_compared
+        self.comparison_stats["skipped"] += num_references - num_compared
+
+    async def acompare_good_papers_adaptively(self, good_papers, prediction_paper, prediction_prompt, criteria):
+        """ Compare the prediction paper with the good papers, in a fixed order, until the verdicts of every
+        criterion are conclusive (see StoppingRule). Returns the results of the comparisons made """
+        good_papers = sorted(good_papers, key=lambda paper: paper.digest)
+        results = []
+        num_papers = self.stopping_rule.min_comparisons
+        while len(results) < len(good_papers):
+            results += await asyncio.gather(*[self.acompare_two_paper(good_paper, prediction_paper, prediction_prompt, json.dumps(criteria)) for good_paper in good_papers[len(results):len(results) + num_papers]])
+            num_papers = 1
+
+            verdicts = defaultdict(list)
+            for result in results:
+                for super_category, super_value in result.items():
+                    if isinstance(super_value, dict):
+                        for sub_category, sub_value in super_value.items():
+                            verdicts[(super_category, sub_category)].append(float(sub_value))
+                    else:
+                        verdicts[(super_category, None)].append(float(super_value))
+            if all(self.stopping_rule.is_decided(criterion_verdicts) for criterion_verdicts in verdicts.values()):
+                break
+        self.record_comparisons(len(results), len(good_papers))
+        return results
+
+    async def acompare_bad_papers_adaptively(self, comparisons, prediction_paper, prediction_prompt):
+        """ Compare the prediction paper with the bad papers of each criterion, in a fixed order, until the
+        verdicts of the criterion are conclusive (see StoppingRule). The next comparison of every undecided
+        criterion is packed as usual in multi-reference requests.
+        Returns:
+            list of (super_category, sub_category or None, verdict) of the comparisons made
+        """
+        remaining = defaultdict(list)
+        for super_category, sub_category, bad_paper in comparisons:
+            remaining[(super_category, sub_category)].append(bad_paper)
+        for bad_papers in remaining.values():
+            bad_papers.sort(key=lambda paper: paper.digest)
+
+        verdicts = defaultdict(list)
+        num_papers = self.stopping_rule.min_comparisons
+        while True:
+            wave = []
+            for (super_category, sub_category), bad_papers in remaining.items():
+                if bad_papers and not self.stopping_rule.is_decided(verdicts[(super_category, sub_category)]):
+                    wave += [(super_category, sub_category, bad_paper) for bad_paper in bad_papers[:num_papers]]
+                    del bad_papers[:num_papers]
+            if not wave:
+                break
+            num_papers = 1
+
+            packs = self.pack_bad_comparisons(wave)
+            for pack, pack_verdicts in zip(packs, await asyncio.gather(*[self.acompare_bad_papers(pack, prediction_paper, prediction_prompt) for pack in packs])):
+                for (super_category, sub_category, _), verdict in zip(pack, pack_verdicts):
+                    verdicts[(super_category, sub_category)].append(verdict)
+
+        bad_verdicts = [(super_category, sub_category, verdict) for (super_category, sub_category), criterion_verdicts in verdicts.items() for verdict in criterion_verdicts]
+        self.record_comparisons(len(bad_verdicts), len(comparisons))
+        return bad_verdicts
+
+    async def acompare_bad_papers(self, comparisons, prediction_paper, prediction_prompt):
+        """ Compare the prediction paper with several bad papers in a single request
         Args:
-            paraphrased_paper: paraphrased paper
+            comparisons: list of (super_category, sub_category or None, bad paper), each bad paper being
+                         compared on its own criterion
             prediction_paper: prediction paper
-            criterion: criterion for comparison in json format
-                (for example: {'Clarity':
-                                    {'Correct grammar': '[0 if paper 1 is better, 1 if paper 2 is better]',
-                                    ...
-                                    }
-                                'Contributions':
-                                    {'Coverage': '[0 if paper 1 is better, 1 if paper 2 is better]',
-                                    ...
-                                    }
-                                ...
-                                }
-                )
+            prediction_prompt: prediction prompt
         Returns:
-            comparison_result: comparison result in json format
+            list of verdicts (0 if the bad paper is better, 1 if the prediction paper is better), in the order of comparisons
         """
-        # 50% chance to swap the order of the papers
-        if random.random() < 0.5:
-            flipped = True
-            paraphrased_paper, prediction_paper = prediction_paper, paraphrased_paper
-        else:
-            flipped = False
+        pack = json.dumps([[super_category, sub_category, bad_paper.digest] for super_category, sub_category, bad_paper in comparisons])
+        if DEBIAS_BOTH_ORDERS:
+            first_verdicts, second_verdicts = await asyncio.gather(
+                self.acompare_bad_papers_in_order(comparisons, prediction_paper, prediction_prompt, False),
+                self.acompare_bad_papers_in_order(comparisons, prediction_paper, prediction_prompt, True))
+            return [average_verdicts(first, second) for first, second in zip(first_verdicts, second_verdicts)]
+        return await self.acompare_bad_papers_in_order(comparisons, prediction_paper, prediction_prompt, is_flipped(pack, prediction_paper.digest))
+
+    async def acompare_bad_papers_in_order(self, comparisons, prediction_paper, prediction_prompt, flipped):
+        """ acompare_bad_papers with the references shown before the prediction paper, and the meaning of the
+        verdicts swapped in the template, if flipped """
+        first, second = ("the Paper", "Reference {}") if flipped else ("Reference {}", "the Paper")
+
+        template = {}
+        for i, (super_category, sub_category, _) in enumerate(comparisons):
+            verdict = f"0 if {first} is better, 1 if {second} is better".format(i + 1)
+            template[f"Reference {i + 1}"] = {super_category: verdict} if sub_category is None else {super_category: {sub_category: verdict}}
+        template = json.dumps(template)
 
-        paraphrased_paper_without_references = custom_json_loads(paraphrased_paper)
-        paraphrased_paper_without_references = [x for x in paraphrased_paper_without_references if x['heading'] != 'References']
-        paraphrased_paper_without_references = json.dumps(paraphrased_paper_without_references)
+        details = []
+        for super_category, sub_category, _ in comparisons:
+            detail = criterion_details(super_category, sub_category)
+            if detail not in details:
+                details.append(detail)
 
-        prediction_paper_without_references = custom_json_loads(prediction_paper)
-        prediction_paper_without_references = [x for x in prediction_paper_without_references if x['heading'] != 'References']
-        prediction_paper_without_references = json.dumps(prediction_paper_without_references)
+        references = [f"'Reference {i + 1}':\n" + bad_paper.truncated_text_without_references for i, (_, _, bad_paper) in enumerate(comparisons)]
+        prediction = "'Paper':\n" + prediction_paper.truncated_text_without_references
+        papers = ",\n".join(references + [prediction] if flipped else [prediction] + references)
 
+        conversation = [{"role": "system", "content": "You are a helpful assistant who will help me compare papers."}]
+        conversation.append({"role": "user", "content": "Compare the paper below with each reference paper, on the criterion given for that reference, and return the result using the template, no explanation:\nThe template:\n" + \
+        template + \
+        "\nBelow are the details of the subcriteria:\n" + "\n".join(details) + "\n" + \
+        f"These papers below are generated using this prompt: {prediction_prompt}. \n" + \
+        "The papers:\n" + papers + '\nRemember to return the result in JSON format'})
+
+        # Too long for a single request: split the references in two halves
+        if num_tokens_from_messages(conversation) > COMPARISON_TOKEN_BUDGET:
+            if len(comparisons) == 1:
+                return [await self.acompare_bad_paper_alone(comparisons[0], prediction_paper, prediction_prompt)]
+            half = len(comparisons) // 2
+            first_verdicts, second_verdicts = await asyncio.gather(self.acompare_bad_papers_in_order(comparisons[:half], prediction_paper, prediction_prompt, flipped), self.acompare_bad_papers_in_order(comparisons[half:], prediction_paper, prediction_prompt, flipped))
+            return first_verdicts + second_verdicts
+
+        verdicts = [None] * len(comparisons)
+        num_trials = 0
+        while num_trials < 5:
+            try:
+                result = (await aask_chat_gpt(conversation, temperature=0.2*num_trials, placeholder=self.placeholder_verdicts(template)))["choices"][0]["message"]["content"]
+                json_result = custom_json_loads(result)
+                for i, (super_category, sub_category, _) in enumerate(comparisons):
+                    try:
+                        verdict = json_result[f"Reference {i + 1}"][super_category]
+                        verdict = int(verdict if sub_category is None else verdict[sub_category])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    if verdict in (0, 1):
+                        verdicts[i] = 1 - verdict if flipped else verdict
+                break
+            except Exception as e:
+                print("Error: ", e)
+                print("Retrying...")
+                num_trials += 1
+
+        # Fields the model left out are asked again, one comparison per request
+        missing = [i for i, verdict in enumerate(verdicts) if verdict is None]
+        if missing:
+            print(f"{len(missing)} of {len(comparisons)} comparisons missing from the answer, asking for them separately")
+            for i, verdict in zip(missing, await asyncio.gather(*[self.acompare_bad_paper_alone(comparisons[i], prediction_paper, prediction_prompt) for i in missing])):
+                verdicts[i] = verdict
+        return verdicts
+
+    async def acompare_bad_paper_alone(self, comparison, prediction_paper, prediction_prompt):
+        """ Compare the prediction paper with one bad paper on its criterion, in its own request. Returns the verdict """
+        super_category, sub_category, bad_paper = comparison
+        if sub_category is None:
+            result = await self.acompare_two_paper(bad_paper, prediction_paper, prediction_prompt, json.dumps({super_category: "0 if paper 1 is better, 1 if paper 2 is better"}))
+            return float(result[super_category])
+        result = await self.acompare_two_paper(bad_paper, prediction_paper, prediction_prompt, json.dumps({super_category: {sub_category: "0 if paper 1 is better, 1 if paper 2 is better"}}))
+        return float(result[super_category][sub_category])
+
+    async def acompare_soundness(self, prediction_paper):
+        """ Evaluate the soundness sub-criteria (c1, c2, c3) of a paper in a single request
+        Returns:
+            {'c1': float, 'c2': float, 'c3': float}, each score in [0, 1]
+        """
+        scores = {}
+        num_trials = 0
+        # Ask again only for the criteria missing from (or invalid in) the previous answers
+        while len(scores) < len(SOUNDNESS_CRITERIA) and num_trials < 5:
+            missing = [key for key in SOUNDNESS_CRITERIA if key not in scores]
+            conversation = [{"role": "system", "content": "You are a helpful assistant who will help me evaluate a paper."}]
+            conversation.append({"role": "user", "content":
+            "Evaluate the soundness of the paper on each criterion below, the output of the template must be a float value for each key, no explanation:\n" + \
+            "\n".join(f"{key}: {SOUNDNESS_CRITERIA[key]}" for key in missing) + \
+            "\nThe template:\n" + \
+            json.dumps({key: "[float number between [0,1] where 0.0 is the lowest and 1.0 is the highest]" for key in missing}) + \
+            "\nPaper :\n" + prediction_paper.truncated_text})
+
+            try:
+                result = (await aask_chat_gpt(conversation, temperature=0.2*num_trials, placeholder=json.dumps({key: 0.0 for key in missing})))["choices"][0]["message"]["content"]
+                json_result = custom_json_loads(result)
+                for key in missing:
+                    try:
+                        score = float(json_result[key])
+                    except (KeyError, TypeError, ValueError):
+                        continue
+                    if score == score: # not NaN
+                        scores[key] = min(max(score, 0.0), 1.0)
+            except Exception as e:
+                print("Error: ", e)
+            if len(scores) < len(SOUNDNESS_CRITERIA):
+                print("Retrying...")
+                num_trials += 1
+
+        for key in SOUNDNESS_CRITERIA:
+            if key not in scores:
+                print(f"WARNING: no valid soundness score for {key}, using 0.0")
+                scores[key] = 0.0
+        return scores
+
+    def comparison_conversation(self, criterion, prediction_prompt, paper_1_text, paper_2_text):
+        """ Conversation asking to compare two papers (given as text) on the criteria of the template """
         conversation = [{"role": "system", "content": "You are a helpful assistant who will help me compare papers."}]
         conversation.append({"role": "user", "content": "Compare these 2 papers below and return the result using the template, no explanation:\nThe template:\n" + \
         criterion + \
@@ -265,43 +510,89 @@ class BaselineReviewer:
         Responsibility: Does the paper address potential risks or ethical issues and is respectful of human moral values, including fairness, and privacy, and is free of libelous or unlawful statements, does not infringe upon the rights of others, or contain material or instructions that might cause harm or injury?
         """ + \
         f"These 2 papers below are generated using this prompt: {prediction_prompt}. \n" + \
-        "The papers:\n'Paper 1':\n" + paraphrased_paper_without_references[:(1000 if TRUNCATE else len(paraphrased_paper))] + ",\n'Paper 2':\n" + prediction_paper_without_references[:(1000 if TRUNCATE else len(prediction_paper))] + '\nRemember to return the result in JSON format'})
+        "The papers:\n'Paper 1':\n" + paper_1_text + ",\n'Paper 2':\n" + paper_2_text + '\nRemember to return the result in JSON format'})
+
+        return conversation
 
-        # In case when the length of the prompt is too long, we will create a shorter prompt
-        while num_tokens_from_messages(conversation) > 8_000:
-            shorter_paraphrased_paper = custom_json_loads(paraphrased_paper_without_references)
-            shorter_paraphrased_paper = shorter_paraphrased_paper[:-1]
-            shorter_paraphrased_paper = json.dumps(shorter_paraphrased_paper)
+    def fit_comparison_conversation(self, criterion, prediction_prompt, paper_1, paper_2, budget=COMPARISON_TOKEN_BUDGET):
+        """ Conversation comparing paper_1 and paper_2 (Paper) within a token budget.
+        When the papers do not fit, the tokens left by the rest of the prompt are split between them: each
+        paper gets up to half, and the share a shorter paper does not use goes to the other one. Each paper
+        then keeps its first sections that fit in its share, from the token count of each section.
+        """
+        conversation = self.comparison_conversation(criterion, prediction_prompt, paper_1.truncated_text_without_references, paper_2.truncated_text_without_references)
+        if num_tokens_from_messages(conversation) <= budget:
+            return conversation
 
-            shorter_prediction_paper = custom_json_loads(prediction_paper_without_references)
-            shorter_prediction_paper = shorter_prediction_paper[:-1]
-            shorter_prediction_paper = json.dumps(shorter_prediction_paper)
+        # Tokens of the first n sections of each paper, with the JSON brackets and separators. Tokens merge
+        # across the boundaries of the parts, so the assembled prompt is counted at or below this estimate
+        fixed_tokens = num_tokens_from_messages(self.comparison_conversation(criterion, prediction_prompt, "", ""))
+        prefix_tokens_1 = [2] + [count + 2 for count in accumulate(count + 1 for count in paper_1.token_counts)]
+        prefix_tokens_2 = [2] + [count + 2 for count in accumulate(count + 1 for count in paper_2.token_counts)]
 
-            conversation = [{"role": "system", "content": "You are a helpful assistant who will help me compare papers."}]
-            conversation.append({"role": "user", "content":
-            "Compare these 2 papers below and return the result using the template, no explanation:\nThe template:\n" + \
-            criterion + \
-            """Below are the details of the subcriteria:
-            Relevance (Correctness): Does the answer address the prompt?
-            Clarity (Correct language): Is the paper written in good English, with correct grammar, and precise vocabulary?
-            Clarity (Organization): Is the paper well organized in meaningful sections and subsections?
-            Clarity (Explanation): Are the concepts clearly explained, with short sentences?
-            Contributions (Coverage): Does the answer provide a comprehensive overview, comparing and contrasting a plurality of viewpoints?
-            Contributions (Title): Does the title of the paper accurately address the prompt?
-            Contributions (Abstract): Does the abstract of the paper accurately reflect the content of the paper?
-            Contributions (Introduction): Does the introduction of the paper accurately reflect the content of the paper?
-            Contributions (Conclusion): Does the conclusion of the paper highlight the main findings of the paper?
-            Soundness (Factuality/ Attribution): Does the answer present accurate facts, supported by citations of authoritative references?
-            Responsibility: Does the paper address potential risks or ethical issues and is respectful of human moral values, including fairness, and privacy, and is free of libelous or unlawful statements, does not infringe upon the rights of others, or contain material or instructions that might cause harm or injury?
-            """ + \
-            f"These 2 papers below are generated using this prompt: {prediction_prompt}. \n" + \
-            "The papers:\n{'Paper 1':\n" + shorter_paraphrased_paper + ",\n'Paper 2':\n" + shorter_prediction_paper+ '\n}Remember to return the result in JSON format'})
+        available = budget - fixed_tokens
+        share_1 = share_2 = available // 2
+        if prefix_tokens_1[-1] <= share_1:
+            share_2 = available - prefix_tokens_1[-1]
+        elif prefix_tokens_2[-1] <= share_2:
+            share_1 = available - prefix_tokens_2[-1]
+
+        def papers_text(paper, prefix_tokens, share):
+            # Largest number of first sections within the share
+            num_sections = max(bisect_right(prefix_tokens, share) - 1, 0)
+            text = json.dumps(paper.without_references[:num_sections])
+            return text[:1000] if TRUNCATE else text
+
+        return self.comparison_conversation(criterion, prediction_prompt, papers_text(paper_1, prefix_tokens_1, share_1), papers_text(paper_2, prefix_tokens_2, share_2))
+
+    def placeholder_verdicts(self, criterion):
+        """ Answer of the comparison template with every verdict set to 0, used while planning batches """
+        def set_verdicts(template):
+            if isinstance(template, dict):
+                return {key: set_verdicts(value) for key, value in template.items()}
+            return "0"
+        return json.dumps(set_verdicts(json.loads(criterion)))
+
+    async def acompare_two_paper(self, paraphrased_paper, prediction_paper, prediction_prompt, criterion):
+        """ Function to compare two papers
+        Args:
+            paraphrased_paper: paraphrased paper
+            prediction_paper: prediction paper
+            criterion: criterion for comparison in json format
+                (for example: {'Clarity':
+                                    {'Correct grammar': '[0 if paper 1 is better, 1 if paper 2 is better]',
+                                    ...
+                                    }
+                                'Contributions':
+                                    {'Coverage': '[0 if paper 1 is better, 1 if paper 2 is better]',
+                                    ...
+                                    }
+                                ...
+                                }
+                )
+        Returns:
+            comparison_result: comparison result in json format
+        """
+        if DEBIAS_BOTH_ORDERS:
+            # Both orders, averaged: a verdict is 0.5 when the model only prefers the paper shown first (or second)
+            first_result, second_result = await asyncio.gather(
+                self.acompare_two_paper_in_order(paraphrased_paper, prediction_paper, prediction_prompt, criterion, False),
+                self.acompare_two_paper_in_order(paraphrased_paper, prediction_paper, prediction_prompt, criterion, True))
+            return average_verdicts(first_result, second_result)
+        return await self.acompare_two_paper_in_order(paraphrased_paper, prediction_paper, prediction_prompt, criterion, is_flipped(paraphrased_paper.digest, prediction_paper.digest, criterion))
+
+    async def acompare_two_paper_in_order(self, paraphrased_paper, prediction_paper, prediction_prompt, criterion, flipped):
+        """ acompare_two_paper with the order of the papers swapped in the prompt if flipped """
+        if flipped:
+            paraphrased_paper, prediction_paper = prediction_paper, paraphrased_paper
+
+        conversation = self.fit_comparison_conversation(criterion, prediction_prompt, paraphrased_paper, prediction_paper)
 
         success = False
         num_trials = 0
         while not success and num_trials < 5:
             try:
-                result = ask_chat_gpt(conversation, temperature=0.2*num_trials)["choices"][0]["message"]["content"]
+                result = (await aask_chat_gpt(conversation, temperature=0.2*num_trials, placeholder=self.placeholder_verdicts(criterion)))["choices"][0]["message"]["content"]
                 json_result = custom_json_loads(result)
 
                 # If the order of the papers is swapped, flip the result
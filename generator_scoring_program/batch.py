@@ -0,0 +1,193 @@
+import os
+import json
+import time
+import asyncio
+import contextvars
+from abc import ABC, abstractmethod
+
+from llm_cache import READ_WRITE
+
+# Batch backends
+LOCAL = "local"                 # file-based stand-in, answers written next to the batch file
+INTERACTIVE = "interactive"     # executes the batch through the regular asyncio client
+BATCH_BACKENDS = (LOCAL, INTERACTIVE)
+
+_active_session = contextvars.ContextVar("batch_session", default=None)
+
+
+def get_batch_session():
+    """Returns the batch session of the current planning pass, or None when running interactively."""
+    return _active_session.get()
+
+
+def placeholder_response(content):
+    """ChatCompletion-shaped response returned for requests deferred to the batch."""
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}], "placeholder": True}
+
+
+class PendingRequest:
+    def __init__(self, custom_id, body, stage):
+        self.custom_id = custom_id
+        self.body = body
+        self.stage = stage
+
+    def to_json(self):
+        return {"custom_id": self.custom_id, "method": "POST", "url": "/v1/chat/completions", "body": self.body}
+
+
+class BatchSession:
+    """Plans the judge requests of a scoring run as JSONL batches.
+
+    During a planning pass every cache miss is recorded instead of being sent,
+    and the caller gets a placeholder answer so that the pass can go on. The
+    batch is then executed by a backend, the answers are stored in the LLM
+    cache, and the pass is run again until it needs no new request.
+
+    Requests have a stage (e.g. 0 for comparisons, 1 for the reasons built on
+    their scores): a request is only recorded when no request of an earlier
+    stage is pending, since its prompt would be built from placeholders.
+    """
+
+    def __init__(self, batch_dir, backend, cache, max_rounds=10):
+        if cache.mode != READ_WRITE:
+            raise ValueError("Batch mode stores the answers in the LLM cache, LLM_CACHE_MODE must be 'read_write'.")
+        self.batch_dir = batch_dir
+        self.backend = backend
+        self.cache = cache
+        self.max_rounds = max_rounds
+        self.pending = {}
+        self.earliest_pending_stage = None
+        self.round = 0
+        self.num_requests = 0
+        self.run_id = f"{time.strftime('%Y%m%d%H%M%S')}_{id(self):x}"
+
+    def defer(self, custom_id, body, placeholder="", stage=0):
+        """Record a request for the batch and return a placeholder response."""
+        if custom_id not in self.pending and (self.earliest_pending_stage is None or stage <= self.earliest_pending_stage):
+            self.pending[custom_id] = PendingRequest(custom_id, body, stage)
+            self.earliest_pending_stage = stage
+        return placeholder_response(placeholder)
+
+    def write_batch(self, name):
+        if not os.path.exists(self.batch_dir):
+            os.makedirs(self.batch_dir)
+        batch_file = os.path.join(self.batch_dir, f"{name}_{self.run_id}_round_{self.round}.jsonl")
+        with open(batch_file, 'w') as f:
+            for request in self.pending.values():
+                f.write(json.dumps(request.to_json()) + "\n")
+        return batch_file
+
+    def ingest(self, output_file):
+        """Store the answers of an executed batch in the LLM cache. Returns the number of answers stored."""
+        num_answers = 0
+        with open(output_file, 'r') as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                output = json.loads(line)
+                response = output.get("response")
+                if output["custom_id"] not in self.pending or response is None or response.get("status_code") != 200:
+                    print("Batch request failed:", output["custom_id"], output.get("error"))
+                    continue
+                self.cache.put(output["custom_id"], response["body"])
+                num_answers += 1
+        return num_answers
+
+    def run(self, compute, name="scoring"):
+        """Run compute() as planning passes until every judge request it makes is answered.
+        Args:
+            compute: function running the scoring, calling ask_chat_gpt as usual
+            name: prefix of the batch files
+        Returns:
+            the return value of the last (fully answered) pass
+        """
+        token = _active_session.set(self)
+        try:
+            for self.round in range(self.max_rounds):
+                self.pending = {}
+                self.earliest_pending_stage = None
+                start = time.time()
+                result = compute()
+                if not self.pending:
+                    print(f"Batch mode: all judge requests answered after {self.round} round(s), {self.num_requests} request(s) in total.")
+                    return result
+                print(f"Batch mode: round {self.round} planned {len(self.pending)} request(s) in {time.time() - start:.1f} seconds.")
+                batch_file = self.write_batch(name)
+                output_file = self.backend.execute(batch_file)
+                num_answers = self.ingest(output_file)
+                self.num_requests += len(self.pending)
+                if num_answers == 0:
+                    raise RuntimeError(f"Batch {batch_file} returned no answer.")
+            raise RuntimeError(f"Judge requests still pending after {self.max_rounds} batch rounds.")
+        finally:
+            _active_session.reset(token)
+
+
+class BatchBackend(ABC):
+    """Executes a JSONL batch file and returns the path of the JSONL output file."""
+
+    @abstractmethod
+    def execute(self, batch_file):
+        pass
+
+
+def output_file_of(batch_file):
+    return batch_file[:-len(".jsonl")] + ".output.jsonl"
+
+
+class LocalFileBackend(BatchBackend):
+    """File-based stand-in for a batch endpoint.
+
+    With a responder (a function from request body to response body) the
+    batch is answered locally; otherwise it waits for `<batch>.output.jsonl`
+    to be dropped next to the batch file by an external process.
+    """
+
+    def __init__(self, responder=None, poll_interval=5, timeout=24 * 3600):
+        self.responder = responder
+        self.poll_interval = poll_interval
+        self.timeout = timeout
+
+    def execute(self, batch_file):
+        output_file = output_file_of(batch_file)
+        if self.responder is not None:
+            with open(batch_file, 'r') as f_in, open(output_file, 'w') as f_out:
+                for line in f_in:
+                    request = json.loads(line)
+                    body = self.responder(request["body"])
+                    f_out.write(json.dumps({"custom_id": request["custom_id"], "response": {"status_code": 200, "body": body}, "error": None}) + "\n")
+            return output_file
+
+        print(f"Waiting for the answers of {batch_file} in {output_file}...")
+        start = time.time()
+        while not os.path.isfile(output_file):
+            if time.time() - start > self.timeout:
+                raise TimeoutError(f"No answer for batch {batch_file} after {self.timeout} seconds.")
+            time.sleep(self.poll_interval)
+        return output_file
+
+
+class InteractiveBackend(BatchBackend):
+    """Executes the batch with the asyncio client (bounded concurrency, rate limits and key pool apply)."""
+
+    def __init__(self, client, run_sync):
+        self.client = client
+        self.run_sync = run_sync
+
+    def execute(self, batch_file):
+        with open(batch_file, 'r') as f:
+            requests = [json.loads(line) for line in f]
+
+        async def execute_all():
+            return await asyncio.gather(*[self.client.create(**request["body"]) for request in requests], return_exceptions=True)
+
+        responses = self.run_sync(execute_all())
+        output_file = output_file_of(batch_file)
+        with open(output_file, 'w') as f:
+            for request, response in zip(requests, responses):
+                if isinstance(response, Exception):
+                    output = {"custom_id": request["custom_id"], "response": None, "error": {"message": str(response)}}
+                else:
+                    output = {"custom_id": request["custom_id"], "response": {"status_code": 200, "body": response}, "error": None}
+                f.write(json.dumps(output) + "\n")
+        return output_file
@@ -0,0 +1,85 @@
+#!/usr/bin/env python
+
+# Usage: python bench_truncate.py [papers_dir] [--max-length 2000 1500 1000]
+#
+# Compares truncate_sections with the previous truncation loop (drop the last sentence of
+# every section, re-count the words of the whole paper, repeat) on the reference papers:
+# the outputs must be identical, and the time of both is reported.
+
+import os
+import json
+import time
+import argparse
+from nltk import sent_tokenize, word_tokenize
+
+from paper import truncate_sections
+
+
+def legacy_word_count(paper_json):
+    word_count = 0
+    for section in paper_json:
+        if section['heading'] != 'References':
+            word_count += len(word_tokenize(section['heading'])) + len(word_tokenize(section['text']))
+    return word_count
+
+
+def legacy_truncate_paper(paper_json, max_length=2000):
+    """ Evaluator.truncate_paper before truncate_sections """
+    word_count = legacy_word_count(paper_json)
+    while word_count > max_length:
+        truncated_paper_json = []
+        for section in paper_json:
+            if section['heading'] == 'References':
+                truncated_paper_json.append(section)
+            else:
+                truncated_paper_json.append({'heading': section['heading'], 'text': ' '.join(sent_tokenize(section['text'])[:-1])})
+        paper_json = truncated_paper_json
+        word_count = legacy_word_count(paper_json)
+    return paper_json
+
+
+def load_papers(papers_dir):
+    """ Every paper of papers_dir/<id>/ given as a list of sections """
+    papers = {}
+    for paper_id in sorted(os.listdir(papers_dir)):
+        if not os.path.isdir(os.path.join(papers_dir, paper_id)):
+            continue
+        for filename in sorted(os.listdir(os.path.join(papers_dir, paper_id))):
+            if not filename.endswith(".json"):
+                continue
+            with open(os.path.join(papers_dir, paper_id, filename), 'r') as f:
+                paper = json.load(f)
+            if isinstance(paper, list):
+                papers[f"{paper_id}/{filename}"] = paper
+    return papers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark truncate_sections against the previous truncation loop.")
+    parser.add_argument("papers_dir", nargs="?", default=os.path.join("..", "sample_data", "generator", "papers"))
+    parser.add_argument("--max-length", type=int, nargs="+", default=[2000, 1500, 1000])
+    args = parser.parse_args()
+
+    papers = load_papers(args.papers_dir)
+    print(f"{len(papers)} papers from {args.papers_dir}")
+    num_mismatches = 0
+    for max_length in args.max_length:
+        start = time.perf_counter()
+        legacy_results = {name: legacy_truncate_paper(paper, max_length) for name, paper in papers.items()}
+        legacy_time = time.perf_counter() - start
+
+        start = time.perf_counter()
+        results = {name: truncate_sections(paper, max_length)[0] for name, paper in papers.items()}
+        new_time = time.perf_counter() - start
+
+        mismatches = [name for name in papers if json.dumps(results[name]) != json.dumps(legacy_results[name])]
+        num_mismatches += len(mismatches)
+        print(f"max_length={max_length}: legacy {legacy_time:.2f}s, truncate_sections {new_time:.2f}s ({legacy_time / max(new_time, 1e-9):.1f}x), {len(mismatches)} mismatch(es)")
+        for name in mismatches:
+            print(f"    output differs for {name}")
+    if num_mismatches:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
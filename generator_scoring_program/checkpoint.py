@@ -0,0 +1,66 @@
+import os
+import json
+import hashlib
+
+CHECKPOINT_VERSION = 1
+
+
+def checkpoint_key(prediction_prompt, prediction_paper, solution_papers):
+    """ Key of the checkpoint of one prompt: a hash of the prompt, the prediction and the reference papers
+    Args:
+        prediction_prompt: prompt of the generated paper
+        prediction_paper: generated paper (Paper)
+        solution_papers: {'good': [Paper], 'bad': {super_category: [Paper] or {sub_category: [Paper]}}, ...}
+    """
+    def digests(papers):
+        if isinstance(papers, dict):
+            return {name: digests(value) for name, value in papers.items()}
+        return [paper.digest for paper in papers]
+
+    key = json.dumps({
+        "version": CHECKPOINT_VERSION,
+        "prompt": str(prediction_prompt),
+        "prediction": prediction_paper.digest,
+        "references": digests(solution_papers),
+    }, sort_keys=True)
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class CheckpointStore:
+    """Scores and HTML comments of each scored prompt, one JSON file per prompt.
+
+    Checkpoints are always written, so that a run that dies can be resumed;
+    they are only read back with resume=True. A checkpoint is found by the
+    hash of its inputs, so a changed prediction or reference set never
+    reuses a stale one.
+    """
+
+    def __init__(self, checkpoint_dir, resume=False):
+        self.checkpoint_dir = checkpoint_dir
+        self.resume = resume
+        self.num_resumed = 0
+
+    def _path(self, key):
+        return os.path.join(self.checkpoint_dir, f"{key}.json")
+
+    def load(self, key):
+        """Returns (generator_score, html_comment) of a finished prompt, or None"""
+        if not self.resume or not os.path.isfile(self._path(key)):
+            return None
+        try:
+            with open(self._path(key), 'r') as f:
+                checkpoint = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"WARNING: could not read checkpoint {self._path(key)} ({e}), scoring the prompt again.")
+            return None
+        self.num_resumed += 1
+        return checkpoint["generator_score"], checkpoint["html_comment"]
+
+    def save(self, key, generator_score, html_comment):
+        if not os.path.exists(self.checkpoint_dir):
+            os.makedirs(self.checkpoint_dir, exist_ok=True)
+        # Written next to the checkpoint and renamed, so that a killed run never leaves a partial checkpoint
+        temporary_file = self._path(key) + f".{os.getpid()}.tmp"
+        with open(temporary_file, 'w') as f:
+            json.dump({"generator_score": generator_score, "html_comment": html_comment}, f)
+        os.replace(temporary_file, self._path(key))
@@ -1,7 +1,51 @@
+import os
+
 DEBUG = False
 CLARITY_FULL_SCORE = True
 CONTESTANT_MODE = True
 TRUNCATE = True
 USE_OUR_BASELINE_REVIEWER= False
 SEPARATE_HTML_EACH_PAPER = False
-REASONS = True # if True, the generator will return the reasons for the score
\ No newline at end of file
+REASONS = True # if True, the reasons of the scores are written in the HTML (once the scores are written)
+REFERENCE_CORPUS_FILE = "papers_corpus.bin" # reference papers compiled by corpus.py, in the generator directory. None to always read the paper files
+
+# LLM response cache
+LLM_CACHE_MODE = "read_write" # "read_write", "read_only" or "bypass"
+LLM_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ai_paper_challenge", "llm_cache.sqlite")
+LLM_CACHE_MAX_SIZE_MB = 512 # None for no size limit
+LLM_CACHE_MAX_AGE_DAYS = 30 # None for no age limit
+
+# LLM client
+LLM_MAX_IN_FLIGHT = 8 # maximum number of concurrent requests to the API
+LLM_REQUEST_TIMEOUT = 120 # seconds before a request is cancelled and retried
+LLM_MAX_ATTEMPTS = 5 # attempts of a request failing with an unexpected error (e.g. a server or authentication error) before it is raised
+RATE_LIMIT_RPM = 3500 # requests per minute allowed for each API key, None for no limit
+RATE_LIMIT_TPM = 90000 # tokens per minute allowed for each API key, None for no limit
+
+# Generated papers scored concurrently
+GENERATOR_NUM_WORKERS = 4 # number of prompts evaluated at the same time, 1 to evaluate them one by one
+GENERATOR_PROMPT_TIMEOUT = None # seconds after which a prompt gets the default scores (0), None for no limit
+
+# Comparisons with the bad papers of a criterion packed in one request
+BAD_PAPERS_PER_REQUEST = 8 # 1 for one request per bad paper
+
+# Order of the papers in the comparison prompts
+FLIP_SEED = 0 # seed of the (deterministic) choice of which paper is shown first, change it to draw other orders
+DEBIAS_BOTH_ORDERS = False # if True, every comparison is asked in both orders and the verdicts averaged (twice the requests)
+
+# Early stopping of the comparisons with the good and bad papers
+EARLY_STOPPING = False # if True, the remaining references of a criterion are skipped once its verdicts are conclusive
+EARLY_STOPPING_CONFIDENCE = 0.95 # posterior probability that the paper wins (or loses) more often than not, needed to stop
+EARLY_STOPPING_MIN_COMPARISONS = 2 # comparisons made for each criterion before stopping
+
+# Batch mode
+BATCH_MODE = None # None to send judge requests one by one, "local" or "interactive" to plan them as JSONL batches first
+BATCH_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_paper_challenge", "batches")
+
+# Record / replay of LLM requests (set LLM_CACHE_MODE to "bypass" so that every request reaches the transport)
+LLM_TRANSPORT_MODE = "passthrough" # "passthrough", "record" or "replay"
+LLM_TRACE_FILE = "llm_trace.jsonl" # trace of requests, responses and latencies
+LLM_REPLAY_LATENCY = False # if True, replayed answers wait for the recorded latency
+
+# Base URL of the API, e.g. "http://localhost:8000/v1" to load-test against mock_server.py. None for the OpenAI API
+OPENAI_API_BASE = None
@@ -0,0 +1,150 @@
+#!/usr/bin/env python
+
+# Usage: python corpus.py generator_dir [--output corpus_file]
+#
+# Compiles the reference papers of generator_dir/papers/<id>/ (parsed, truncated, labelled,
+# with their word and token counts) into a single file, read with mmap by the scoring program.
+# The scoring program reads the raw files again as soon as the content of a paper file or a
+# setting changes.
+
+import os
+import json
+import mmap
+import hashlib
+import struct
+import argparse
+
+from paper import Paper
+
+CORPUS_VERSION = 2
+MAGIC = b"APCORPUS"
+HEADER_LENGTH = struct.Struct("<Q")
+
+
+def source_signature(papers_dir):
+    """{"<paper id>/<file name>": SHA-256 of the file} of every paper file under papers_dir
+    The content is hashed rather than stat'ed: copying, unzipping or cloning the data changes the
+    modification times, but must not make a corpus shipped with it stale.
+    """
+    signature = {}
+    for paper_id in sorted(os.listdir(papers_dir)):
+        paper_dir = os.path.join(papers_dir, paper_id)
+        if not os.path.isdir(paper_dir):
+            continue
+        for filename in sorted(os.listdir(paper_dir)):
+            if filename == ".DS_Store":
+                continue
+            with open(os.path.join(paper_dir, filename), 'rb') as f:
+                signature[f"{paper_id}/{filename}"] = hashlib.sha256(f.read()).hexdigest()
+    return signature
+
+
+def write_corpus(corpus_file, papers, sources, settings):
+    """ Write the compiled corpus: magic, header length, JSON header, then the parsed sections of every
+    paper, as plain JSON. This is also the text of the paper, as Evaluator.make_paper serializes it
+    Args:
+        corpus_file: path of the corpus
+        papers: dict of {paper id: list of (file name, label, Paper)}, label being (role, super_category, sub_category)
+        sources: source_signature() of the paper files the corpus is built from
+        settings: settings the papers were prepared with (e.g. truncation length)
+    """
+    header_papers = {}
+    payload = []
+    offset = 0
+    for paper_id, entries in papers.items():
+        header_papers[str(paper_id)] = []
+        for filename, label, paper in entries:
+            data = json.dumps(paper.sections).encode("utf-8")
+            header_papers[str(paper_id)].append({
+                "file": filename,
+                "label": list(label),
+                "offset": offset,
+                "length": len(data),
+                "word_counts": paper.word_counts,
+                "token_counts": paper.token_counts,
+            })
+            payload.append(data)
+            offset += len(data)
+    header = json.dumps({"version": CORPUS_VERSION, "settings": settings, "sources": sources, "papers": header_papers}).encode("utf-8")
+
+    # Written next to the corpus and renamed, so that a scoring run never reads a partial corpus
+    temporary_file = corpus_file + ".tmp"
+    with open(temporary_file, 'wb') as f:
+        f.write(MAGIC)
+        f.write(HEADER_LENGTH.pack(len(header)))
+        f.write(header)
+        for data in payload:
+            f.write(data)
+    os.replace(temporary_file, corpus_file)
+
+
+class ReferenceCorpus:
+    """Memory-mapped corpus written by write_corpus.
+
+    Only the header is parsed when the corpus is opened; the sections of a
+    paper are read from the mapping when its paper id is requested. They are
+    plain JSON, loaded with json rather than the lenient (and much slower)
+    json5 parser used for the raw paper files.
+    """
+
+    def __init__(self, corpus_file):
+        with open(corpus_file, 'rb') as f:
+            self._mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mmap[:len(MAGIC)] != MAGIC:
+            self._mmap.close()
+            raise ValueError(f"{corpus_file} is not a reference corpus.")
+        header_length, = HEADER_LENGTH.unpack_from(self._mmap, len(MAGIC))
+        header_start = len(MAGIC) + HEADER_LENGTH.size
+        self.header = json.loads(self._mmap[header_start:header_start + header_length])
+        self._payload_start = header_start + header_length
+
+    def is_fresh(self, papers_dir, settings):
+        """True if the corpus was built from the current paper files with the same settings"""
+        return self.header["version"] == CORPUS_VERSION and self.header["settings"] == settings and self.header["sources"] == source_signature(papers_dir)
+
+    def __contains__(self, paper_id):
+        return str(paper_id) in self.header["papers"]
+
+    def papers(self, paper_id):
+        """ List of (file name, label, Paper) of a paper id, in the order of the corpus """
+        papers = []
+        for entry in self.header["papers"][str(paper_id)]:
+            start = self._payload_start + entry["offset"]
+            text = self._mmap[start:start + entry["length"]].decode("utf-8")
+            papers.append((entry["file"], tuple(entry["label"]), Paper(text, json.loads(text), word_counts=entry["word_counts"], token_counts=entry["token_counts"])))
+        return papers
+
+    def close(self):
+        self._mmap.close()
+
+
+def open_corpus(corpus_file, papers_dir, settings):
+    """Returns the corpus if it is up to date with the paper files and settings, otherwise None"""
+    if corpus_file is None or not os.path.isfile(corpus_file):
+        return None
+    try:
+        corpus = ReferenceCorpus(corpus_file)
+    except (OSError, ValueError) as e:
+        print(f"WARNING: could not read the reference corpus {corpus_file} ({e}). Reading the paper files.")
+        return None
+    if not corpus.is_fresh(papers_dir, settings):
+        print(f"WARNING: the reference corpus {corpus_file} is stale. Reading the paper files; run corpus.py to rebuild it.")
+        corpus.close()
+        return None
+    return corpus
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compile the reference papers of the generator track into a single memory-mapped file.")
+    parser.add_argument("generator_dir", help="directory holding prompts.csv and papers/<id>/")
+    parser.add_argument("--output", default=None, help="path of the corpus (default: REFERENCE_CORPUS_FILE in generator_dir)")
+    args = parser.parse_args()
+
+    # Imported here: the evaluator itself reads the corpus
+    from evaluator import Evaluator
+    corpus_file = Evaluator().build_reference_corpus(args.generator_dir, args.output)
+    print(f"Reference corpus written to {corpus_file}")
+
+
+if __name__ == "__main__":
+    main()
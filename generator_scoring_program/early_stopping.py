@@ -0,0 +1,36 @@
+from math import comb
+
+
+def probability_below_half(num_wins, num_comparisons):
+    """ Posterior probability that the win rate p of the prediction paper is below 0.5
+    With a uniform prior, p ~ Beta(1 + wins, 1 + losses) after the comparisons, and for
+    integers a, b the Beta CDF is a binomial tail: I_x(a, b) = P(Binomial(a + b - 1, x) >= a).
+    """
+    a = num_wins + 1
+    n = num_comparisons + 1
+    return sum(comb(n, j) for j in range(a, n + 1)) / 2 ** n
+
+
+class StoppingRule:
+    """Decides when the verdicts of a criterion are conclusive enough to skip the remaining references.
+
+    A criterion is decided once at least min_comparisons verdicts are known
+    and the posterior probability that the prediction wins (or loses) against
+    the references of the criterion more often than not reaches confidence.
+    """
+
+    def __init__(self, confidence=0.95, min_comparisons=2):
+        self.confidence = confidence
+        self.min_comparisons = min_comparisons
+
+    def is_decided(self, verdicts):
+        """
+        Args:
+            verdicts: list of 0/1 verdicts, 1 when the prediction paper is better. Split verdicts
+                      (0.5, when both orders of the papers disagree) carry no evidence and are not counted
+        """
+        verdicts = [int(verdict) for verdict in verdicts if verdict in (0, 1)]
+        if len(verdicts) < self.min_comparisons:
+            return False
+        below = probability_below_half(sum(verdicts), len(verdicts))
+        return max(below, 1 - below) >= self.confidence
@@ -1,11 +1,14 @@
 import os
+import asyncio
+import contextvars
 from enum import Enum
+from concurrent.futures import ThreadPoolExecutor
 from collections import defaultdict
 import pandas as pd
 import json5 as json
 from tqdm.auto import tqdm
 from nltk import sent_tokenize, word_tokenize
-from config import DEBUG, CONTESTANT_MODE, USE_OUR_BASELINE_REVIEWER 
+from config import DEBUG, CONTESTANT_MODE, REASONS, USE_OUR_BASELINE_REVIEWER, GENERATOR_NUM_WORKERS, GENERATOR_PROMPT_TIMEOUT, REFERENCE_CORPUS_FILE, EARLY_STOPPING
 
 if USE_OUR_BASELINE_REVIEWER:
     from baseline_reviewer_referee import BaselineReviewer
@@ -14,6 +17,9 @@ else:
 
 import numpy as np
 from utils import *
+from paper import Paper, truncate_sections
+from corpus import open_corpus, write_corpus, source_signature
+from checkpoint import checkpoint_key
 
 class SuperCategories(Enum):
     RELEVANCE = 'relevance'
@@ -42,6 +48,9 @@ class Evaluator:
         # Baseline Reviewer
         self.baseline_reviewer = BaselineReviewer()
 
+        # Per-prompt checkpoints (CheckpointStore), None to disable them
+        self.checkpoints = None
+
     def read_generator_solutions_and_predictions(self, solution_dir, generator_predict_file):
         ''' Function to read the Labels from CSV files'''
 
@@ -104,6 +113,8 @@ class Evaluator:
         self.generator_prompts = generator_df['prompt'].values
 
         print("Loading generator solutions (good and bad papers)")
+        papers_dir = os.path.join(GENERATOR_PATH, "papers")
+        corpus = open_corpus(None if REFERENCE_CORPUS_FILE is None else os.path.join(GENERATOR_PATH, REFERENCE_CORPUS_FILE), papers_dir, self.reference_corpus_settings())
         self.generator_solutions = []
         for paper_id in generator_df['id'].values:
             if USE_OUR_BASELINE_REVIEWER:
@@ -111,51 +122,29 @@ class Evaluator:
             else:
                 paraphrased_papers = {'good': [], 'bad': {}}
 
-            for paper_filename in tqdm([x for x in os.listdir(os.path.join(GENERATOR_PATH, "papers", str(paper_id))) if x!= ".DS_Store"]):
-                if "soundness" in paper_filename:
-                    continue
-                
-                if 'human' in paper_filename and not USE_OUR_BASELINE_REVIEWER:
-                    continue
-
-                paper_text = open(os.path.join(GENERATOR_PATH, "papers", str(paper_id), paper_filename), 'r').read()
-
-                if paper_filename.startswith("human") and USE_OUR_BASELINE_REVIEWER:
-                    paper_text = custom_json_loads(paper_text)
-                    paper_text_reformat = [{'heading': 'Title', 'text': paper_text['title']}]
-                    for section in paper_text['sections']:
-                        paper_text_reformat.append({'heading': section['heading'], 'text': section['text']})
-                    paper_references_reformat = []
-                    for reference in paper_text['references']:
-                        paper_references_reformat.append("@article{article1,\n title={"+reference['title']+"}\n}")
-                    paper_text_reformat.append({'heading': 'References', 'text': "\n\n".join(paper_references_reformat)})
-                    paper_text_reformat = json.dumps(paper_text_reformat)
-                    paper_text_reformat = self.truncate_paper(paper_text_reformat)
-                    paraphrased_papers['human'].append(paper_text_reformat)
-
-                    continue
-
-                paper_text = open(os.path.join(GENERATOR_PATH, "papers", str(paper_id), paper_filename), 'r').read()
-                paper_text = self.truncate_paper(paper_text)
-
-                if paper_filename.startswith("good"):
-                    paraphrased_papers['good'].append(paper_text)
-                elif paper_filename.startswith("bad"):
-                    for super_category in self.super_categories:
-                        if paper_filename.startswith("bad_" + super_category) :
-                            if paper_filename.startswith("bad_" + super_category + "_") or paper_filename[len("bad_" + super_category)].isdigit():
-                                if super_category not in paraphrased_papers['bad']:
-                                    paraphrased_papers['bad'][super_category] = []
-                                paraphrased_papers['bad'][super_category].append(paper_text)
-                                break
-                            else:
-                                if super_category not in paraphrased_papers['bad']:
-                                    paraphrased_papers['bad'][super_category] = defaultdict(list)
-                                sub_category = paper_filename.split("bad_" + super_category, 1)[1].split("_")[0]
-                                paraphrased_papers['bad'][super_category][sub_category].append(paper_text)
-                                break
+            if corpus is not None and paper_id in corpus:
+                solution_papers = corpus.papers(paper_id)
+            else:
+                solution_papers = self.read_solution_papers(papers_dir, paper_id, include_human=USE_OUR_BASELINE_REVIEWER)
+
+            for paper_filename, (role, super_category, sub_category), paper in solution_papers:
+                if role == "human":
+                    if USE_OUR_BASELINE_REVIEWER:
+                        paraphrased_papers['human'].append(paper)
+                elif role == "good":
+                    paraphrased_papers['good'].append(paper)
+                elif role == "bad":
+                    if sub_category is None:
+                        if super_category not in paraphrased_papers['bad']:
+                            paraphrased_papers['bad'][super_category] = []
+                        paraphrased_papers['bad'][super_category].append(paper)
+                    else:
+                        if super_category not in paraphrased_papers['bad']:
+                            paraphrased_papers['bad'][super_category] = defaultdict(list)
+                        paraphrased_papers['bad'][super_category][sub_category].append(paper)
             self.generator_solutions.append(paraphrased_papers)
-        
+        if corpus is not None:
+            corpus.close()
 
         self.truncate_generator_predictions()
         if (len(self.generator_solutions) != len(self.generator_predictions)): 
@@ -167,7 +156,80 @@ class Evaluator:
         print("###-------------------------------------###\n\n")
         
 
+    def classify_solution_paper(self, paper_filename):
+        ''' Function to get the label (role, super_category, sub_category) of a solution paper from its file name.
+        role is 'good', 'bad', 'human', 'soundness' or None for unknown files '''
+        if "soundness" in paper_filename:
+            return ("soundness", None, None)
+        if paper_filename.startswith("human"):
+            return ("human", None, None)
+        if paper_filename.startswith("good"):
+            return ("good", None, None)
+        if paper_filename.startswith("bad"):
+            for super_category in self.super_categories:
+                if paper_filename.startswith("bad_" + super_category) :
+                    if paper_filename.startswith("bad_" + super_category + "_") or paper_filename[len("bad_" + super_category)].isdigit():
+                        return ("bad", super_category, None)
+                    else:
+                        return ("bad", super_category, paper_filename.split("bad_" + super_category, 1)[1].split("_")[0])
+        return (None, None, None)
+
+    def read_solution_paper(self, paper_path, role):
+        ''' Function to read and truncate a solution paper '''
+        with open(paper_path, 'r') as f:
+            paper_text = f.read()
+
+        if role == "human":
+            paper_text = custom_json_loads(paper_text)
+            paper_text_reformat = [{'heading': 'Title', 'text': paper_text['title']}]
+            for section in paper_text['sections']:
+                paper_text_reformat.append({'heading': section['heading'], 'text': section['text']})
+            paper_references_reformat = []
+            for reference in paper_text['references']:
+                paper_references_reformat.append("@article{article1,\n title={"+reference['title']+"}\n}")
+            paper_text_reformat.append({'heading': 'References', 'text': "\n\n".join(paper_references_reformat)})
+            return self.make_paper(*truncate_sections(paper_text_reformat))
+
+        return self.make_paper(*truncate_sections(custom_json_loads(paper_text)))
+
+    def read_solution_papers(self, papers_dir, paper_id, include_human=False):
+        ''' Function to read the solution papers of a prompt from papers_dir/<paper_id>/
+        Returns:
+            list of (file name, label, Paper), label being (role, super_category, sub_category) '''
+        solution_papers = []
+        for paper_filename in tqdm([x for x in os.listdir(os.path.join(papers_dir, str(paper_id))) if x!= ".DS_Store"]):
+            label = self.classify_solution_paper(paper_filename)
+            if label[0] in (None, "soundness") or (label[0] == "human" and not include_human):
+                continue
+            solution_papers.append((paper_filename, label, self.read_solution_paper(os.path.join(papers_dir, str(paper_id), paper_filename), label[0])))
+        return solution_papers
+
+    def reference_corpus_settings(self):
+        ''' Settings the solution papers are prepared with, a corpus built with other settings is stale '''
+        return {"max_length": 2000, "super_categories": self.super_categories}
+
+    def build_reference_corpus(self, generator_path, corpus_file=None):
+        ''' Function to compile the solution papers of generator_path into a reference corpus (see corpus.py)
+        Returns:
+            path of the corpus '''
+        if corpus_file is None:
+            corpus_file = os.path.join(generator_path, REFERENCE_CORPUS_FILE or "papers_corpus.bin")
+        papers_dir = os.path.join(generator_path, "papers")
+        sources = source_signature(papers_dir)
+        papers = {}
+        for paper_id in sorted(os.listdir(papers_dir)):
+            if os.path.isdir(os.path.join(papers_dir, paper_id)):
+                papers[paper_id] = self.read_solution_papers(papers_dir, paper_id, include_human=True)
+        write_corpus(corpus_file, papers, sources, self.reference_corpus_settings())
+        return corpus_file
+
+    def make_paper(self, paper_json, word_counts=None):
+        ''' Function to make a Paper from its sections, serialized as the evaluator always did '''
+        return Paper(json.dumps(paper_json), paper_json, word_counts=word_counts)
+
     def get_word_count(self, prediction):
+        if isinstance(prediction, Paper):
+            return prediction.word_count
         word_count = 0
         if isinstance(prediction, str):
             print("WARNING: prediction is a string. Converting to json.")
@@ -180,21 +242,11 @@ class Evaluator:
         return word_count
 
     def truncate_paper(self, paper, max_length=2000, return_as_json=False):
-        if isinstance(paper, str):
-            paper_json = custom_json_loads(paper)
+        if isinstance(paper, Paper):
+            paper_json = paper.sections
         else:
-            paper_json = paper
-        word_count = self.get_word_count(paper_json)
-        if word_count > max_length:
-            while word_count > max_length:
-                truncated_paper_json = []
-                for section in paper_json:
-                    if section['heading'] == 'References':
-                        truncated_paper_json.append(section)
-                    else:
-                        truncated_paper_json.append({'heading': section['heading'], 'text': ' '.join(sent_tokenize(section['text'])[:-1])})
-                paper_json = truncated_paper_json
-                word_count = self.get_word_count(paper_json)
+            paper_json = custom_json_loads(paper) if isinstance(paper, str) else paper
+        paper_json, _ = truncate_sections(paper_json, max_length=max_length)
         if return_as_json:
             return paper_json
         else:
@@ -251,7 +303,7 @@ class Evaluator:
             
             prediction_json = self.truncate_reference(prediction_json, return_as_json=True)
             
-            truncate_generator_predictions.append(json.dumps(prediction_json))
+            truncate_generator_predictions.append(self.make_paper(prediction_json))
         self.generator_predictions = truncate_generator_predictions
 
 
@@ -263,44 +315,54 @@ class Evaluator:
 
     def compute_generator_scores(self):
         '''Function to compute the score for generator'''
+        batch_session = make_batch_session()
+        if batch_session is None:
+            self.compute_generator_scores_once()
+        else:
+            # Plan the judge requests as batches, then score from the collected answers
+            batch_session.run(self.compute_generator_scores_once, name="generator")
+
+    def compute_generator_comments(self):
+        '''Function to write the reasons of the scores, shown in the HTML only. Called once the scores are written'''
+        missing = [i for i, html_comment in enumerate(self.generator_html_comments) if html_comment is None]
+        if not REASONS:
+            for i in missing:
+                self.generator_html_comments[i] = ""
+        elif missing:
+            batch_session = make_batch_session()
+            if batch_session is None:
+                self.compute_generator_comments_once(missing)
+            else:
+                batch_session.run(lambda: self.compute_generator_comments_once(missing), name="reasons")
+        return self.generator_html_comments
+
+    def compute_generator_comments_once(self, indices):
+        '''Function to write the reasons of the scores of the given papers, calling the LLM once per paper'''
+        print(f"Writing the reasons of the scores of {len(indices)} paper(s)")
+        html_comments = self.baseline_reviewer.get_html_comments([self.generator_scores[i] for i in indices], [self.generator_predictions[i] for i in indices])
+        for i, html_comment in zip(indices, html_comments):
+            self.generator_html_comments[i] = html_comment
+
+    def compute_generator_scores_once(self):
+        '''Function to compute the score for generator, calling the LLM for each request'''
 
         # Compute the score for each criterion
         self.generator_scores = []
+        self.generator_html_comments = []
         print("Start computing scores for each generated paper")
-        for i in tqdm(range(len(self.generator_solutions))):
-            generator_score = {}
-            prediction_prompt = self.generator_prompts[i]
-            prediction_paper = self.generator_predictions[i]
-            solution_papers = self.generator_solutions[i]
-            good_papers = solution_papers['good']
-            bad_papers = solution_papers['bad'] 
-            if USE_OUR_BASELINE_REVIEWER:
-                human_papers = solution_papers['human'] 
-
-            available_criteria = defaultdict(dict)
-            for super_category, super_value in solution_papers['bad'].items():
-                if isinstance(super_value, list):
-                    available_criteria[super_category] = "0 if paper 1 is better, 1 if paper 2 is better"
-                else:
-                    for sub_category in super_value:
-                        available_criteria[super_category][sub_category] = "0 if paper 1 is better, 1 if paper 2 is better"
+        with ThreadPoolExecutor(max_workers=GENERATOR_NUM_WORKERS) as executor:
+            # Each worker runs in a copy of the current context, so that it sees the batch session of the pass
+            futures = [executor.submit(contextvars.copy_context().run, self.compute_generated_paper_score, i) for i in range(len(self.generator_solutions))]
+            # Collect the results in prompt order, so that scores and comments stay aligned with the prompts
+            for i, future in enumerate(tqdm(futures)):
+                generator_score, html_comment = future.result()
+                self.generator_scores.append(generator_score)
+                self.generator_html_comments.append(html_comment)
 
-            # print("\nGenerating comments for each generated paper") 
-            if DEBUG:
-                generator_score = {'relevance': {'title': 0.583, 'abstract': 0.75, 'citations': 0.166}, 'contribution': {'conclusion': 0.583, 'abstract': 0.75, 'coverage': 0.166}, 'responsibility': 0.166, 'clarity': {'explanations': 0.66, 'correctlanguage': 0.16, 'organization': 0.16666666666666666}, 'soundness': {'c1': 0.9, 'c2': 0.8, 'c3': 0.9}}
-                html_comment = {'relevance': {'title': "TEST", 'abstract': "TEST", 'citations': "TEST"}, 'contribution': {'conclusion': "TEST", 'abstract': "TEST", 'coverage': "TEST"}, 'responsibility': "TEST", 'clarity': {'explanations': "TEST", 'correctlanguage': "TEST", 'organization': "TEST"}, 'soundness': {'c1': "TEST", 'c2': "TEST", 'c3': "TEST"}}
-            else:
-                if USE_OUR_BASELINE_REVIEWER:
-                    answer = self.baseline_reviewer.compare_papers(good_papers, bad_papers, prediction_paper, prediction_prompt, available_criteria, human_papers)
-                else:
-                    answer = self.baseline_reviewer.compare_papers(good_papers, bad_papers, prediction_paper, prediction_prompt, available_criteria)
-                generator_score = answer[0]
-                html_comment = answer[1]
-             
-            self.generator_scores.append(generator_score)
-            self.generator_html_comments.append(html_comment)
+                print("\nGenerated score for paper " + str(i))
 
-            print("\nGenerated score for paper " + str(i))
+        if EARLY_STOPPING:
+            print(f"Early stopping skipped {self.baseline_reviewer.comparison_stats['skipped']} of {sum(self.baseline_reviewer.comparison_stats.values())} reference comparisons")
 
         # Combine the scores accross all papers
         self.overall_generator_score = defaultdict(lambda: defaultdict(int))
@@ -315,6 +377,55 @@ class Evaluator:
                         self.overall_generator_score[super_category] = 0
                     self.overall_generator_score[super_category] += float(super_value)/len(self.generator_scores)       
 
+    def compute_generated_paper_score(self, i):
+        '''Function to compute the score and the comments of the i-th generated paper'''
+        generator_score = {}
+        prediction_prompt = self.generator_prompts[i]
+        prediction_paper = self.generator_predictions[i]
+        solution_papers = self.generator_solutions[i]
+        good_papers = solution_papers['good']
+        bad_papers = solution_papers['bad'] 
+        if USE_OUR_BASELINE_REVIEWER:
+            human_papers = solution_papers['human'] 
+
+        available_criteria = defaultdict(dict)
+        for super_category, super_value in solution_papers['bad'].items():
+            if isinstance(super_value, list):
+                available_criteria[super_category] = "0 if paper 1 is better, 1 if paper 2 is better"
+            else:
+                for sub_category in super_value:
+                    available_criteria[super_category][sub_category] = "0 if paper 1 is better, 1 if paper 2 is better"
+
+        # Prompts finished by an earlier run are not scored again (checkpoints are not used while planning batches)
+        checkpoint = None
+        if self.checkpoints is not None and not DEBUG and get_batch_session() is None:
+            checkpoint = checkpoint_key(prediction_prompt, prediction_paper, solution_papers)
+            resumed = self.checkpoints.load(checkpoint)
+            if resumed is not None:
+                print(f"\nResuming the score of paper {i} from its checkpoint")
+                return resumed
+
+        # print("\nGenerating comments for each generated paper") 
+        if DEBUG:
+            generator_score = {'relevance': {'title': 0.583, 'abstract': 0.75, 'citations': 0.166}, 'contribution': {'conclusion': 0.583, 'abstract': 0.75, 'coverage': 0.166}, 'responsibility': 0.166, 'clarity': {'explanations': 0.66, 'correctlanguage': 0.16, 'organization': 0.16666666666666666}, 'soundness': {'c1': 0.9, 'c2': 0.8, 'c3': 0.9}}
+            html_comment = {'relevance': {'title': "TEST", 'abstract': "TEST", 'citations': "TEST"}, 'contribution': {'conclusion': "TEST", 'abstract': "TEST", 'coverage': "TEST"}, 'responsibility': "TEST", 'clarity': {'explanations': "TEST", 'correctlanguage': "TEST", 'organization': "TEST"}, 'soundness': {'c1': "TEST", 'c2': "TEST", 'c3': "TEST"}}
+        else:
+            try:
+                if USE_OUR_BASELINE_REVIEWER:
+                    answer = self.baseline_reviewer.compare_papers(good_papers, bad_papers, prediction_paper, prediction_prompt, available_criteria, human_papers, timeout=GENERATOR_PROMPT_TIMEOUT)
+                else:
+                    answer = self.baseline_reviewer.compare_papers(good_papers, bad_papers, prediction_paper, prediction_prompt, available_criteria, timeout=GENERATOR_PROMPT_TIMEOUT)
+            except asyncio.TimeoutError:
+                # Default scores are not checkpointed, so that a resumed run scores the prompt again
+                print(f"WARNING: comparing paper {i} took more than {GENERATOR_PROMPT_TIMEOUT} seconds. Using the default scores.")
+                answer = self.baseline_reviewer.default_comparison(available_criteria, f"The paper could not be evaluated within {GENERATOR_PROMPT_TIMEOUT} seconds.")
+                checkpoint = None
+            generator_score = answer[0]
+            html_comment = answer[1]
+            if checkpoint is not None:
+                self.checkpoints.save(checkpoint, generator_score, html_comment)
+        return generator_score, html_comment
+
     def get_overall_generator_scores(self):
         """Get the overall scores."""
         if self.overall_generator_score is None:
@@ -363,21 +474,13 @@ class Evaluator:
                 color = 'red' if average < 0.5 else 'black'
 
                 if CONTESTANT_MODE:
-                    reasons = []
                     if types is None:
                         html_file.write(f"<li><b>{super_category}</b>: <span style='color:{color};'>{average:.2f}</span></li>\n")
                     else:
-                        for sub_category, sub_value in super_value.items():
-                            reasons.append(str(html_comments[super_category][sub_category]))
-                        reason = " || ".join(reasons)
-
-                        if not DEBUG:
-                            conversation = [{"role": "system", "content": "You are a helpful assistant who will help me combine all reviews into one. Focus on the text and not the individual score."},
-                                            {"role": "user", "content": reason}]
-                            reason = ask_chat_gpt(conversation)["choices"][0]["message"]["content"]
-
-                            
-                            
+                        # One reason per super-category (see BaselineReviewer.get_html_comments)
+                        reason = "" if html_comments == "" else html_comments[super_category]
+                        if isinstance(reason, dict):
+                            reason = " || ".join(str(sub_reason) for sub_reason in reason.values())
                         html_file.write(f"<li><b>{super_category}</b>: <span style='color:{color};'>{average:.2f}</span><br>&emsp;reason: {reason}</li>\n")
                 else:
                     html_file.write(f"<li><b>{super_category}</b>: <span style='color:{color};'>{average:.2f}</span></li>\n")
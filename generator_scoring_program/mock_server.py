@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+
+# Usage: python mock_server.py [--port 8000] [--latency lognormal:-0.5,0.5] [--rate-limit-rate 0.05] [--server-error-rate 0.01] [--malformed-rate 0.02]
+#
+# Local stand-in for the OpenAI ChatCompletion endpoint used by the scoring programs.
+# Point the programs to it with OPENAI_API_BASE = "http://localhost:8000/v1" in config.py
+# (any non-empty API key is accepted, e.g. OPENAI_API_KEY=mock).
+
+import re
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LOREM = "The review raises relevant points but could be more specific about the evidence supporting its claims."
+META_REASON_KEYS = ["rating_reason", "precision_reason", "correctness_reason", "recommendation_reason", "respectfulness_reason"]
+
+
+def parse_latency(spec):
+    """Parse a latency distribution: 'fixed:s', 'uniform:low,high' or 'lognormal:mu,sigma' (seconds)."""
+    name, _, params = spec.partition(":")
+    values = [float(value) for value in params.split(",")] if params else []
+    if name == "fixed":
+        return lambda rng: values[0]
+    elif name == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    elif name == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+
+def extract_template(content):
+    """Returns the JSON template of a comparison prompt, or None."""
+    match = re.search(r"The template:\n(.*?)Below are the details", content, re.DOTALL)
+    if match is None:
+        return None
+    try:
+        return json.loads(match.group(1).strip())
+    except json.JSONDecodeError:
+        return None
+
+
+def fill_template(template, rng):
+    if isinstance(template, dict):
+        return {key: fill_template(value, rng) for key, value in template.items()}
+    return str(rng.randint(0, 1))
+
+
+def fill_reasons(template):
+    if isinstance(template, dict):
+        return {key: fill_reasons(value) for key, value in template.items()}
+    return LOREM
+
+
+def answer(messages, rng):
+    """Schema-valid answer to the prompts sent by the scoring programs."""
+    content = messages[-1]["content"]
+    if "Compare these 2 papers" in content or "Compare the paper below with each reference paper" in content:
+        template = extract_template(content)
+        if template is not None:
+            return json.dumps(fill_template(template, rng))
+    if "must be a float value for each key" in content:
+        match = re.search(r"The template:\n(\{.*?\})\n", content, re.DOTALL)
+        if match is not None:
+            return json.dumps({key: round(rng.random(), 2) for key in json.loads(match.group(1))})
+    if "Likert scale from 1 to 3" in content:
+        return str(rng.randint(1, 3))
+    if "rating_reason" in content:
+        return json.dumps({key: LOREM for key in META_REASON_KEYS})
+    if "Output the reasons in this JSON format" in content:
+        match = re.search(r"Output the reasons in this JSON format, no other text:\n(\{.*\})\s*$", content, re.DOTALL)
+        if match is not None:
+            return json.dumps(fill_reasons(json.loads(match.group(1))))
+    return LOREM
+
+
+class MockProfile:
+    """Latency and failure profile of the mock server."""
+
+    def __init__(self, latency="fixed:0", rate_limit_rate=0.0, server_error_rate=0.0, malformed_rate=0.0, seed=None):
+        self.sample_latency = parse_latency(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.server_error_rate = server_error_rate
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {"requests": 0, "rate_limited": 0, "server_errors": 0, "malformed": 0}
+
+    def draw(self):
+        """Returns (latency, outcome) for a new request, outcome in 'ok', 'rate_limited', 'server_error', 'malformed'."""
+        with self.lock:
+            self.counts["requests"] += 1
+            latency = max(0.0, self.sample_latency(self.rng))
+            draw = self.rng.random()
+            if draw < self.rate_limit_rate:
+                outcome = "rate_limited"
+            elif draw < self.rate_limit_rate + self.server_error_rate:
+                outcome = "server_errors"
+            elif draw < self.rate_limit_rate + self.server_error_rate + self.malformed_rate:
+                outcome = "malformed"
+            else:
+                return latency, "ok"
+            self.counts[outcome] += 1
+            return latency, outcome
+
+
+def make_handler(profile):
+
+    class ChatCompletionHandler(BaseHTTPRequestHandler):
+
+        def log_message(self, format, *args):
+            pass
+
+        def send_json(self, status, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            if not self.path.rstrip("/").endswith("/chat/completions"):
+                self.send_json(404, {"error": {"message": f"Unknown endpoint {self.path}", "type": "invalid_request_error"}})
+                return
+            request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            latency, outcome = profile.draw()
+            time.sleep(latency)
+
+            if outcome == "rate_limited":
+                self.send_json(429, {"error": {"message": "Rate limit reached (mock server).", "type": "requests", "code": "rate_limit_exceeded"}})
+                return
+            if outcome == "server_errors":
+                self.send_json(503, {"error": {"message": "The server is overloaded (mock server).", "type": "server_error"}})
+                return
+
+            with profile.lock:
+                contents = [answer(request["messages"], profile.rng) for _ in range(request.get("n", 1))]
+            if outcome == "malformed":
+                # Cut the answer in the middle, leaving unbalanced JSON
+                contents = ['{"' + content[:len(content) // 2] for content in contents]
+            prompt_tokens = sum(len(message["content"]) for message in request["messages"]) // 4
+            completion_tokens = sum(len(content) for content in contents) // 4
+            self.send_json(200, {
+                "id": f"chatcmpl-mock-{profile.counts['requests']}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": request.get("model", "gpt-3.5-turbo"),
+                "choices": [{"index": i, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"} for i, content in enumerate(contents)],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens},
+            })
+
+    return ChatCompletionHandler
+
+
+def serve(host="127.0.0.1", port=8000, profile=None):
+    """Start the mock server in a background thread and return it (call .shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), make_handler(profile or MockProfile()))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Mock OpenAI ChatCompletion server for load-testing the scoring programs.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--latency", default="fixed:0", help="'fixed:s', 'uniform:low,high' or 'lognormal:mu,sigma', in seconds")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="fraction of requests answered with a 429")
+    parser.add_argument("--server-error-rate", type=float, default=0.0, help="fraction of requests answered with a 503")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="fraction of answers with malformed JSON content")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    profile = MockProfile(args.latency, args.rate_limit_rate, args.server_error_rate, args.malformed_rate, args.seed)
+    server = ThreadingHTTPServer((args.host, args.port), make_handler(profile))
+    print(f"Mock ChatCompletion server listening on http://{args.host}:{args.port}/v1")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print("Requests served:", profile.counts)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import json
+import hashlib
+from itertools import accumulate
+from nltk import sent_tokenize, word_tokenize
+
+from utils import custom_json_loads, num_tokens_from_string, get_encoding
+from config import TRUNCATE
+
+
+class Paper:
+    """A paper as a list of {'heading': ..., 'text': ...} sections, parsed once.
+
+    Each paper goes into many prompts, so its derived views (sections
+    without the references, truncated text, word and token counts,
+    references) are computed on first use and kept. str(paper) is the JSON
+    text of the paper, as it was before papers were parsed once.
+    """
+
+    __slots__ = ("text", "_sections", "_without_references", "_without_references_text", "_truncated_text",
+                 "_truncated_text_without_references", "_word_counts", "_token_counts", "_references", "_digest")
+
+    def __init__(self, text, sections=None, word_counts=None, token_counts=None):
+        """
+        Args:
+            text: JSON text of the paper
+            sections: parsed sections of the paper, if already known (they must not be modified afterwards)
+            word_counts, token_counts: counts of the sections, if already known (e.g. read from the reference corpus)
+        """
+        self.text = text
+        self._sections = sections
+        self._without_references = None
+        self._without_references_text = None
+        self._truncated_text = None
+        self._truncated_text_without_references = None
+        self._word_counts = word_counts
+        self._token_counts = token_counts
+        self._references = None
+        self._digest = None
+
+    def __str__(self):
+        return self.text
+
+    def __repr__(self):
+        return f"Paper({self.text[:50]!r}...)"
+
+    @property
+    def digest(self):
+        """SHA-256 of the text of the paper, identifying it across runs"""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+        return self._digest
+
+    @property
+    def sections(self):
+        if self._sections is None:
+            self._sections = custom_json_loads(self.text)
+        return self._sections
+
+    @property
+    def is_empty(self):
+        """True if no section has any text"""
+        return all(section['text'] == '' for section in self.sections)
+
+    @property
+    def without_references(self):
+        """Sections of the paper, except the references"""
+        if self._without_references is None:
+            self._without_references = [section for section in self.sections if section['heading'] != 'References']
+        return self._without_references
+
+    @property
+    def without_references_text(self):
+        if self._without_references_text is None:
+            self._without_references_text = json.dumps(self.without_references)
+        return self._without_references_text
+
+    @property
+    def truncated_text(self):
+        """Text of the paper as put in the prompts (first 1000 characters if TRUNCATE)"""
+        if self._truncated_text is None:
+            self._truncated_text = self.text[:1000] if TRUNCATE else self.text
+        return self._truncated_text
+
+    @property
+    def truncated_text_without_references(self):
+        if self._truncated_text_without_references is None:
+            self._truncated_text_without_references = self.without_references_text[:1000] if TRUNCATE else self.without_references_text
+        return self._truncated_text_without_references
+
+    @property
+    def word_counts(self):
+        """Number of words of each section (heading and text), 0 for the references"""
+        if self._word_counts is None:
+            self._word_counts = [0 if section['heading'] == 'References' else len(word_tokenize(section['heading'])) + len(word_tokenize(section['text'])) for section in self.sections]
+        return self._word_counts
+
+    @property
+    def word_count(self):
+        """Number of words of the paper, excluding the references"""
+        return sum(self.word_counts)
+
+    @property
+    def token_counts(self):
+        """Number of tokens of each section of without_references, serialized as JSON"""
+        if self._token_counts is None:
+            encoding_name = get_encoding("gpt-3.5-turbo-0301").name
+            self._token_counts = [num_tokens_from_string(json.dumps(section), encoding_name) for section in self.without_references]
+        return self._token_counts
+
+    @property
+    def references(self):
+        """List of the references of the paper"""
+        if self._references is None:
+            self._references = [reference for section in self.sections if section['heading'] == 'References' for reference in section['text'].split('\n\n') if reference != '']
+        return self._references
+
+
+def truncate_sections(sections, max_length=2000):
+    """ Drop the last sentence of every section (except the references) as many times as needed
+    for the paper to have at most max_length words, excluding the references.
+
+    Each section is split into sentences and tokenized once; the number of sentences to drop is
+    then found by binary search on the word counts, instead of re-tokenizing the whole paper after
+    each dropped sentence.
+    Args:
+        sections: list of {'heading': ..., 'text': ...}
+        max_length: maximum number of words
+    Returns:
+        (truncated sections, number of words of each section). The sections are returned as is
+        if the paper is short enough.
+    """
+    heading_words = []
+    sentences = []
+    # prefix_words[i][m]: number of words of the first m sentences of section i
+    prefix_words = []
+    for section in sections:
+        if section['heading'] == 'References':
+            heading_words.append(0)
+            sentences.append(None)
+            prefix_words.append([0])
+            continue
+        section_sentences = sent_tokenize(section['text'])
+        heading_words.append(len(word_tokenize(section['heading'])))
+        sentences.append(section_sentences)
+        # word_tokenize(text) tokenizes each sentence of sent_tokenize(text) on its own
+        prefix_words.append([0] + list(accumulate(len(word_tokenize(sentence, preserve_line=True)) for sentence in section_sentences)))
+
+    def section_words(i, num_dropped):
+        num_sentences = len(prefix_words[i]) - 1
+        return heading_words[i] + prefix_words[i][max(num_sentences - num_dropped, 0)]
+
+    def num_words(num_dropped):
+        return sum(section_words(i, num_dropped) for i in range(len(sections)))
+
+    max_dropped = max(len(words) - 1 for words in prefix_words) if sections else 0
+    if num_words(max_dropped) > max_length:
+        print(f"WARNING: the headings of the paper alone are longer than {max_length} words. Keeping the headings only.")
+        num_dropped = max_dropped
+    else:
+        # num_words only decreases with the number of dropped sentences: binary search the first one that fits
+        low, high = 0, max_dropped
+        while low < high:
+            middle = (low + high) // 2
+            if num_words(middle) <= max_length:
+                high = middle
+            else:
+                low = middle + 1
+        num_dropped = low
+
+    word_counts = [section_words(i, num_dropped) for i in range(len(sections))]
+    if num_dropped == 0:
+        return sections, word_counts
+
+    truncated_sections = []
+    for section, section_sentences in zip(sections, sentences):
+        if section_sentences is None:
+            truncated_sections.append(section)
+        else:
+            truncated_sections.append({'heading': section['heading'], 'text': ' '.join(section_sentences[:max(len(section_sentences) - num_dropped, 0)])})
+    return truncated_sections, word_counts
+
+
+def as_paper(paper):
+    """Returns paper as a Paper, parsing it if it is a JSON string"""
+    return paper if isinstance(paper, Paper) else Paper(paper)
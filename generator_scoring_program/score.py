@@ -1,6 +1,6 @@
 #!/usr/bin/env python
 
-# Usage: python ingestion.py input_dir output_dir scoring_output_dir
+# Usage: python ingestion.py input_dir output_dir scoring_output_dir [--resume]
 
 import os
 import json
@@ -8,9 +8,10 @@ import time
 from sys import argv
 import libscores
 from evaluator import Evaluator
+from checkpoint import CheckpointStore
 
 from utils import *
-from config import SEPARATE_HTML_EACH_PAPER
+from config import SEPARATE_HTML_EACH_PAPER, EARLY_STOPPING
 
 # Set up default directories and file names:
 ROOT_DIR = "../"
@@ -57,11 +58,19 @@ def compute_scores(evaluator, solution_dir, prediction_dir, data_name):
     evaluator.read_generator_solutions_and_predictions(solution_dir, generator_predict_file)
     return evaluator.get_generator_scores()
 
+def write_score_file(score_dir, evaluator, duration):
+    """ Write the scores to the JSON file, as soon as they are known """
+    score_json = {
+        'score': evaluator.get_overall_generator_scores(),
+        'duration': duration
+    }
+    with open(os.path.join(score_dir, 'scores.json'), 'w') as score_file:
+        score_file.write(json.dumps(score_json))
+
 # HTML Comments
-def write_to_output_files(score_dir, generator_overall_score, generator_score, evaluator, html_comments, duration):
-    """ Write output results to JSON and HTML files """
-    with open(os.path.join(score_dir, 'scores.json'), 'w') as score_file, \
-         open(os.path.join(score_dir, 'scores_ai_author.html'), 'w') as html_file:
+def write_to_output_files(score_dir, generator_overall_score, generator_score, evaluator, html_comments):
+    """ Write output results to HTML files """
+    with open(os.path.join(score_dir, 'scores_ai_author.html'), 'w') as html_file:
 
         html_file.write("<style>body {font-size: 16pt;}</style>\n")
         
@@ -81,14 +90,6 @@ def write_to_output_files(score_dir, generator_overall_score, generator_score, e
                 print_scores_each_paper(data, evaluator, html_file, evaluator.generator_predictions[index], evaluator.generator_prompts[index], html_comments[index])
 
 
-        score_json = {
-            'score': final_generator_overall_score,
-            'duration': duration
-        }
-        
-        score_file.write(json.dumps(score_json))
-
-
     if SEPARATE_HTML_EACH_PAPER:
         # Make directory for full papers
         if not os.path.exists(os.path.join(score_dir, 'ai_author_full_papers')):
@@ -117,8 +118,7 @@ def print_scores_each_paper(data, evaluator, html_file, generated_paper, prompt_
     print(f"======= Prompt : {prompt_name} =======")
     print(f"======= Generated Paper =======")
     print(generated_paper)
-    json_paper = custom_json_loads(generated_paper)
-    write_json_paper_to_html_file(json_paper, html_file)
+    write_json_paper_to_html_file(generated_paper.sections, html_file)
 
 def print_scores_generator(score_title, score, evaluator, overall_generator_score, html_file, num_prompts):
     """ Print and write scores to HTML files """
@@ -208,18 +208,31 @@ def main():
     """ Main function to coordinate scoring """
     start = time.time()
     print("\n============== Scoring program  ==============\n")
-    solution_dir, prediction_dir, score_dir, data_name = process_arguments(argv)
+    # --resume reuses the checkpoints of the prompts scored by an earlier run
+    resume = "--resume" in argv
+    solution_dir, prediction_dir, score_dir, data_name = process_arguments([argument for argument in argv if argument != "--resume"])
     create_score_directory(score_dir)
     evaluator = Evaluator()
+    evaluator.checkpoints = CheckpointStore(os.path.join(score_dir, 'checkpoints'), resume=resume)
 
     generator_overall_score, generator_score, html_comments = compute_scores(evaluator, solution_dir, prediction_dir, data_name)
-    write_to_output_files(score_dir, generator_overall_score, generator_score, evaluator, html_comments, duration=time.time() - start)
+    write_score_file(score_dir, evaluator, duration=time.time() - start)
+    # The reasons of the scores are only shown in the HTML: they are written after the scores
+    html_comments = evaluator.compute_generator_comments()
+    write_to_output_files(score_dir, generator_overall_score, generator_score, evaluator, html_comments)
+    get_llm_cache().write_stats(os.path.join(score_dir, 'llm_cache_stats.json'))
+    get_key_pool().write_stats(os.path.join(score_dir, 'key_pool_stats.json'))
+    if EARLY_STOPPING:
+        with open(os.path.join(score_dir, 'comparison_stats.json'), 'w') as f:
+            json.dump(evaluator.baseline_reviewer.comparison_stats, f)
 
     if DEBUG_MODE > 1:
         libscores.show_platform()
         libscores.show_io(prediction_dir, score_dir)
         libscores.show_version(SCORING_VERSION)
 
+    if evaluator.checkpoints.num_resumed:
+        print(f'{evaluator.checkpoints.num_resumed} prompt(s) resumed from their checkpoints.')
     print(f'Scoring completed in {time.time() - start} seconds.')
 
 
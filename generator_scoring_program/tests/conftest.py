@@ -0,0 +1,77 @@
+# Tests of the generator scoring program. The modules of the program import each other as top-level
+# modules (as when score.py is run), and some share their name with the reviewer scoring program:
+# run the tests of each program on their own, e.g. python -m pytest generator_scoring_program/tests
+
+import json
+import os
+import re
+import sys
+from types import SimpleNamespace
+
+import pytest
+
+PROGRAM_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SAMPLE_DATA_DIR = os.path.join(os.path.dirname(PROGRAM_DIR), "sample_data")
+sys.path.insert(0, PROGRAM_DIR)
+
+
+@pytest.fixture
+def nltk_tokenizers(monkeypatch):
+    """ Yields (sent_tokenize, word_tokenize). Without the punkt data, they are replaced by an untrained
+    Punkt sentence splitter and the treebank word tokenizer, put together as nltk.word_tokenize does """
+    import nltk
+    try:
+        nltk.sent_tokenize("Punkt data is installed. Nothing to replace.")
+        return nltk.sent_tokenize, nltk.word_tokenize
+    except LookupError:
+        pass
+    from nltk.tokenize import PunktSentenceTokenizer, NLTKWordTokenizer
+    sentence_tokenizer = PunktSentenceTokenizer()
+    word_tokenizer = NLTKWordTokenizer()
+
+    def sent_tokenize(text, language="english"):
+        return sentence_tokenizer.tokenize(text)
+
+    def word_tokenize(text, language="english", preserve_line=False):
+        sentences = [text] if preserve_line else sent_tokenize(text)
+        return [token for sentence in sentences for token in word_tokenizer.tokenize(sentence)]
+
+    import paper
+    import bench_truncate
+    for module in (paper, bench_truncate):
+        monkeypatch.setattr(module, "sent_tokenize", sent_tokenize)
+        monkeypatch.setattr(module, "word_tokenize", word_tokenize)
+    return sent_tokenize, word_tokenize
+
+
+@pytest.fixture
+def judge(monkeypatch):
+    """ Stands in for aask_chat_gpt in the comparisons of the baseline reviewer. The judge fills the template of
+    the prompt from the papers shown, whatever their order and the meaning given to 0 and 1: a "strong" paper beats
+    the paper being scored, which beats a "weak" one. Keeps the prompts (judge.prompts), leaves the references of
+    judge.omitted out of its answers, and counts one token per reference paper of a prompt """
+    import baseline_reviewer_chatgpt
+    judge = SimpleNamespace(prompts=[], omitted=set())
+
+    def strength(text):
+        return 2 if "strong" in text else 0 if "weak" in text else 1
+
+    async def aask_chat_gpt(conversation, **kwargs):
+        content = conversation[-1]["content"]
+        judge.prompts.append(content)
+        template = json.loads(re.search(r"The template:\n(.*?)\s*Below are the details", content, re.DOTALL).group(1))
+        papers = content.split("The papers:\n", 1)[1].rsplit("\nRemember to return", 1)[0]
+        parts = re.split(r"(?:^|,\n)'(Paper(?: \d)?|Reference \d+)':\n", papers)
+        texts = {label.lower(): text for label, text in zip(parts[1::2], parts[2::2])}
+
+        def answer(verdict):
+            if isinstance(verdict, dict):
+                return {key: answer(value) for key, value in verdict.items()}
+            first, second = re.fullmatch(r"\[?0 if (?:the )?(.+) is better, 1 if (?:the )?(.+) is better\]?", verdict).groups()
+            return 0 if strength(texts[first.lower()]) > strength(texts[second.lower()]) else 1
+        answers = {key: answer(value) for key, value in template.items() if key not in judge.omitted}
+        return {"choices": [{"message": {"role": "assistant", "content": json.dumps(answers)}}]}
+
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "aask_chat_gpt", aask_chat_gpt)
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "num_tokens_from_messages", lambda conversation: conversation[-1]["content"].count("'Reference "))
+    return judge
@@ -0,0 +1,80 @@
+import glob
+import json
+import os
+
+import pytest
+
+from batch import BatchBackend, BatchSession, LocalFileBackend, get_batch_session, output_file_of
+from llm_cache import LLMCache, READ_ONLY, make_cache_key
+
+
+def answer(body):
+    """ Responder of the local backend: the answer is a function of the prompt """
+    return {"choices": [{"index": 0, "message": {"role": "assistant", "content": f"answer to {body['messages'][-1]['content']}"}}]}
+
+
+def make_ask(cache):
+    """ ask_chat_gpt reduced to what the batch planning relies on: cache, then deferral to the batch session """
+    def ask(content, stage=0):
+        body = {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": content}]}
+        key = make_cache_key(body["model"], body["messages"])
+        response = cache.get(key)
+        if response is None:
+            response = get_batch_session().defer(key, body, placeholder="", stage=stage) if get_batch_session() is not None else answer(body)
+        return response["choices"][0]["message"]["content"]
+    return ask
+
+
+def score(ask):
+    """ Two comparisons, then a reason written from their answers (as the reasons stage of the scoring) """
+    comparisons = [ask("compare 1"), ask("compare 2")]
+    return comparisons + [ask(f"reason of {comparisons}", stage=1)]
+
+
+def test_batch_rounds_give_the_interactive_results(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"))
+    ask = make_ask(cache)
+    session = BatchSession(str(tmp_path / "batches"), LocalFileBackend(responder=answer), cache)
+    expected = score(make_ask(LLMCache(str(tmp_path / "unused.sqlite"), mode="bypass")))
+
+    assert session.run(lambda: score(ask)) == expected
+    # The reason waits for the comparisons it is written from
+    batch_files = sorted(path for path in glob.glob(os.path.join(str(tmp_path / "batches"), "*.jsonl")) if not path.endswith(".output.jsonl"))
+    assert len(batch_files) == 2
+    with open(batch_files[0]) as f:
+        assert [json.loads(line)["body"]["messages"][0]["content"] for line in f] == ["compare 1", "compare 2"]
+    assert session.num_requests == 3
+    assert get_batch_session() is None
+
+    # Everything is answered from the cache by now
+    session = BatchSession(str(tmp_path / "batches"), LocalFileBackend(responder=answer), cache)
+    assert session.run(lambda: score(ask)) == expected
+    assert session.num_requests == 0
+
+
+def test_failed_batch(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"))
+    ask = make_ask(cache)
+
+    class FailingBackend(BatchBackend):
+        def execute(self, batch_file):
+            output_file = output_file_of(batch_file)
+            with open(batch_file) as f_in, open(output_file, 'w') as f_out:
+                for line in f_in:
+                    f_out.write(json.dumps({"custom_id": json.loads(line)["custom_id"], "response": None, "error": {"message": "server error"}}) + "\n")
+            return output_file
+
+    with pytest.raises(RuntimeError, match="returned no answer"):
+        BatchSession(str(tmp_path / "batches"), FailingBackend(), cache).run(lambda: score(ask))
+
+
+def test_batch_mode_needs_a_writable_cache(tmp_path):
+    with pytest.raises(ValueError):
+        BatchSession(str(tmp_path / "batches"), LocalFileBackend(responder=answer), LLMCache(str(tmp_path / "llm_cache.sqlite"), mode=READ_ONLY))
+
+
+def test_backends_must_implement_execute():
+    class IncompleteBackend(BatchBackend):
+        pass
+    with pytest.raises(TypeError):
+        IncompleteBackend()
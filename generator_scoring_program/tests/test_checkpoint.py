@@ -0,0 +1,111 @@
+import asyncio
+import json
+import os
+
+from baseline_reviewer_chatgpt import BaselineReviewer
+from checkpoint import CheckpointStore, checkpoint_key
+from evaluator import Evaluator
+from paper import Paper
+
+
+def make_paper(text):
+    return Paper(json.dumps([{"heading": "Title", "text": text}]))
+
+
+def make_solution_papers(name):
+    return {"good": [make_paper(f"{name} good")], "bad": {"relevance": [make_paper(f"{name} relevance")], "clarity": {"organization": [make_paper(f"{name} organization")]}}}
+
+
+class StubbedReviewer(BaselineReviewer):
+    """ A BaselineReviewer whose comparisons score the prompt, and are counted. With timeout set, they time out """
+
+    def __init__(self, timeout=False):
+        self.timeout = timeout
+        self.compared = []
+
+    def compare_papers(self, good_papers, bad_papers, prediction_paper, prediction_prompt, criteria, timeout=None):
+        self.compared.append(prediction_prompt)
+        if self.timeout:
+            raise asyncio.TimeoutError()
+        return [{"relevance": 1.0, "clarity": {"organization": 0.5}}, {"relevance": f"relevance of {prediction_prompt}", "clarity": {"organization": f"organization of {prediction_prompt}"}}]
+
+
+def make_evaluator(checkpoint_dir, resume, timeout=False):
+    evaluator = Evaluator.__new__(Evaluator)
+    evaluator.generator_prompts = [f"prompt {i}" for i in range(3)]
+    evaluator.generator_predictions = [make_paper(f"prediction {i}") for i in range(3)]
+    evaluator.generator_solutions = [make_solution_papers(f"prompt {i}") for i in range(3)]
+    evaluator.baseline_reviewer = StubbedReviewer(timeout)
+    evaluator.checkpoints = CheckpointStore(str(checkpoint_dir), resume=resume)
+    return evaluator
+
+
+def test_checkpoint_key_changes_with_the_inputs():
+    solution_papers = make_solution_papers("prompt")
+    key = checkpoint_key("prompt", make_paper("prediction"), solution_papers)
+    assert checkpoint_key("prompt", make_paper("prediction"), make_solution_papers("prompt")) == key
+    assert checkpoint_key("another prompt", make_paper("prediction"), solution_papers) != key
+    assert checkpoint_key("prompt", make_paper("another prediction"), solution_papers) != key
+
+    changed = make_solution_papers("prompt")
+    changed["good"] = [make_paper("another good")]
+    assert checkpoint_key("prompt", make_paper("prediction"), changed) != key
+    changed = make_solution_papers("prompt")
+    changed["bad"]["clarity"]["organization"].append(make_paper("another organization"))
+    assert checkpoint_key("prompt", make_paper("prediction"), changed) != key
+
+
+def test_resumed_run_skips_completed_prompts(tmp_path):
+    # A first run scores the first two prompts, then dies
+    evaluator = make_evaluator(tmp_path, resume=False)
+    scores = [evaluator.compute_generated_paper_score(i) for i in range(2)]
+    assert len(os.listdir(tmp_path)) == 2
+
+    evaluator = make_evaluator(tmp_path, resume=True)
+    assert [evaluator.compute_generated_paper_score(i) for i in range(3)][:2] == scores
+    assert evaluator.baseline_reviewer.compared == ["prompt 2"]
+    assert evaluator.checkpoints.num_resumed == 2
+
+    # Without --resume, every prompt is scored again
+    evaluator = make_evaluator(tmp_path, resume=False)
+    for i in range(3):
+        evaluator.compute_generated_paper_score(i)
+    assert evaluator.baseline_reviewer.compared == ["prompt 0", "prompt 1", "prompt 2"]
+
+
+def test_changed_inputs_are_scored_again(tmp_path):
+    evaluator = make_evaluator(tmp_path, resume=False)
+    for i in range(3):
+        evaluator.compute_generated_paper_score(i)
+
+    evaluator = make_evaluator(tmp_path, resume=True)
+    evaluator.generator_prompts[0] = "another prompt"
+    evaluator.generator_solutions[1]["bad"]["relevance"] = [make_paper("another relevance")]
+    for i in range(3):
+        evaluator.compute_generated_paper_score(i)
+    assert evaluator.baseline_reviewer.compared == ["another prompt", "prompt 1"]
+
+
+def test_default_scores_are_not_checkpointed(tmp_path):
+    evaluator = make_evaluator(tmp_path, resume=True, timeout=True)
+    generator_score, _ = evaluator.compute_generated_paper_score(0)
+    assert generator_score["clarity"] == {"organization": 0.0}
+    assert os.listdir(tmp_path) == []
+
+    # The prompt is scored again by the next run
+    evaluator = make_evaluator(tmp_path, resume=True)
+    generator_score, _ = evaluator.compute_generated_paper_score(0)
+    assert generator_score["clarity"] == {"organization": 0.5}
+    assert evaluator.baseline_reviewer.compared == ["prompt 0"]
+
+
+def test_unreadable_checkpoints_are_scored_again(tmp_path):
+    evaluator = make_evaluator(tmp_path, resume=False)
+    evaluator.compute_generated_paper_score(0)
+    [checkpoint_file] = os.listdir(tmp_path)
+    (tmp_path / checkpoint_file).write_text('{"generator_score": ')
+
+    evaluator = make_evaluator(tmp_path, resume=True)
+    evaluator.compute_generated_paper_score(0)
+    assert evaluator.baseline_reviewer.compared == ["prompt 0"]
+    assert evaluator.checkpoints.num_resumed == 0
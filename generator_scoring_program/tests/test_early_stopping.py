@@ -0,0 +1,126 @@
+import asyncio
+import json
+
+import pytest
+from scipy import stats
+
+from early_stopping import StoppingRule, probability_below_half
+
+NUM_REFERENCES = 6
+
+
+@pytest.mark.parametrize("num_comparisons", range(0, 16))
+def test_probability_below_half_is_the_beta_cdf(num_comparisons):
+    for num_wins in range(num_comparisons + 1):
+        expected = stats.beta.cdf(0.5, 1 + num_wins, 1 + num_comparisons - num_wins)
+        assert probability_below_half(num_wins, num_comparisons) == pytest.approx(expected, abs=1e-12)
+
+
+@pytest.mark.parametrize("verdicts, decided", [
+    ([], False),
+    ([1], False),
+    ([1, 1], False),
+    ([1, 1, 1, 1], True),
+    ([0, 0, 0, 0], True),
+    ([1, 0, 1, 0, 1, 0], False),
+    # Split verdicts carry no evidence
+    ([1, 1, 0.5, 0.5, 0.5], False),
+    ([1, 0.5, 1, 0.5, 1, 1], True),
+])
+def test_is_decided(verdicts, decided):
+    assert StoppingRule(confidence=0.95, min_comparisons=2).is_decided(verdicts) is decided
+
+
+def test_is_decided_waits_for_min_comparisons():
+    assert not StoppingRule(confidence=0.5, min_comparisons=3).is_decided([1, 1])
+    assert StoppingRule(confidence=0.5, min_comparisons=3).is_decided([1, 1, 1])
+
+
+class StubbedReviewer:
+    """ A BaselineReviewer whose comparisons return the verdict of each reference paper, and count the requests """
+
+    def __init__(self, monkeypatch, early_stopping, good_verdicts, bad_verdicts):
+        import baseline_reviewer_chatgpt
+        from paper import Paper
+        monkeypatch.setattr(baseline_reviewer_chatgpt, "EARLY_STOPPING", early_stopping)
+
+        def make_papers(name):
+            papers = [Paper(json.dumps([{"heading": "Title", "text": f"{name} {i}"}])) for i in range(NUM_REFERENCES)]
+            # Verdicts are given in the order the references are compared in
+            return sorted(papers, key=lambda paper: paper.digest)
+
+        self.good_papers = make_papers("good")
+        self.bad_papers = {"clarity": make_papers("clarity"), "soundness": {"c1": make_papers("soundness")}}
+        self.prediction_paper = Paper(json.dumps([{"heading": "Title", "text": "prediction"}]))
+        self.criteria = {"clarity": "", "soundness": {"c1": ""}}
+        verdicts = {paper.digest: verdict for paper, verdict in zip(self.good_papers, good_verdicts)}
+        for bad_papers in (self.bad_papers["clarity"], self.bad_papers["soundness"]["c1"]):
+            verdicts.update({paper.digest: verdict for paper, verdict in zip(bad_papers, bad_verdicts)})
+        self.compared = []
+
+        reviewer = baseline_reviewer_chatgpt.BaselineReviewer.__new__(baseline_reviewer_chatgpt.BaselineReviewer)
+        reviewer.stopping_rule = StoppingRule(0.95, 2)
+        reviewer.comparison_stats = {"comparisons": 0, "skipped": 0}
+
+        async def acompare_two_paper(good_paper, prediction_paper, prediction_prompt, criteria):
+            self.compared.append(good_paper.digest)
+            return {"clarity": verdicts[good_paper.digest], "soundness": {"c1": verdicts[good_paper.digest]}}
+
+        async def acompare_bad_papers(comparisons, prediction_paper, prediction_prompt):
+            self.compared += [bad_paper.digest for _, _, bad_paper in comparisons]
+            return [verdicts[bad_paper.digest] for _, _, bad_paper in comparisons]
+
+        async def acompare_soundness(prediction_paper):
+            return {"c1": 0.5}
+
+        reviewer.acompare_two_paper = acompare_two_paper
+        reviewer.acompare_bad_papers = acompare_bad_papers
+        reviewer.acompare_soundness = acompare_soundness
+        self.reviewer = reviewer
+
+    def scores(self):
+        combined_result, _ = asyncio.run(self.reviewer.acompare_papers(self.good_papers, self.bad_papers, self.prediction_paper, "prompt", self.criteria))
+        return combined_result
+
+
+def expected_score(good_verdicts, bad_verdicts):
+    """ Score of a criterion once compared with every reference, as the baseline computes it """
+    return 0.5 * sum(good_verdicts) / len(good_verdicts) + 0.5 * sum(bad_verdicts) / len(bad_verdicts)
+
+
+ALTERNATING = [1, 0, 1, 0, 1, 0]
+MOSTLY_WINS = [1, 1, 1, 0, 1, 1]
+
+
+@pytest.mark.parametrize("early_stopping", [False, True])
+@pytest.mark.parametrize("good_verdicts, bad_verdicts", [(ALTERNATING, ALTERNATING), (ALTERNATING, [0, 1, 1, 0, 0, 1]), ([0, 1, 0, 1, 1, 0], ALTERNATING)])
+def test_undecided_criteria_compare_every_reference(monkeypatch, early_stopping, good_verdicts, bad_verdicts):
+    stubbed = StubbedReviewer(monkeypatch, early_stopping, good_verdicts, bad_verdicts)
+    scores = stubbed.scores()
+    assert sorted(stubbed.compared) == sorted(paper.digest for paper in stubbed.good_papers + stubbed.bad_papers["clarity"] + stubbed.bad_papers["soundness"]["c1"])
+    assert scores["clarity"] == pytest.approx(expected_score(good_verdicts, bad_verdicts))
+    assert stubbed.reviewer.comparison_stats["skipped"] == 0
+
+
+def test_decided_criteria_skip_the_remaining_references(monkeypatch):
+    stubbed = StubbedReviewer(monkeypatch, True, [1] * NUM_REFERENCES, [1] * NUM_REFERENCES)
+    scores = stubbed.scores()
+    # Four straight wins decide a criterion at 0.95
+    assert len(stubbed.compared) == 3 * 4
+    assert stubbed.reviewer.comparison_stats == {"comparisons": 12, "skipped": 6}
+    assert scores["clarity"] == pytest.approx(expected_score([1] * NUM_REFERENCES, [1] * NUM_REFERENCES))
+    assert scores["soundness"] == {"c1": 0.5}
+
+
+def test_early_stopping_averages_the_references_compared(monkeypatch):
+    stubbed = StubbedReviewer(monkeypatch, True, MOSTLY_WINS, MOSTLY_WINS)
+    scores = stubbed.scores()
+    # After the loss, no criterion is decided before its last reference: every reference counts
+    assert len(stubbed.compared) == 3 * NUM_REFERENCES
+    assert scores["clarity"] == pytest.approx(expected_score(MOSTLY_WINS, MOSTLY_WINS))
+
+    # The losses come after the four wins that decide the criterion, and are never compared
+    stubbed = StubbedReviewer(monkeypatch, True, [1, 1, 1, 1, 0, 0], [1, 1, 1, 1, 0, 0])
+    scores = stubbed.scores()
+    assert len(stubbed.compared) == 3 * 4
+    assert scores["clarity"] == pytest.approx(1.0)
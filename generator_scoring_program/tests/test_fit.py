@@ -0,0 +1,81 @@
+import json
+import re
+from types import SimpleNamespace
+
+import pytest
+
+import baseline_reviewer_chatgpt
+import paper
+from baseline_reviewer_chatgpt import BaselineReviewer
+from paper import Paper
+
+CRITERION = json.dumps({"clarity": "0 if paper 1 is better, 1 if paper 2 is better"})
+
+
+def num_tokens(text):
+    """ Stands in for tiktoken: one token per word or punctuation mark, so that the count of a text is the sum
+    of the counts of its parts """
+    return len(re.findall(r"\w+|[^\w\s]", text))
+
+
+@pytest.fixture(autouse=True)
+def tokenizer(monkeypatch):
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "num_tokens_from_messages", lambda messages: sum(num_tokens(message["content"]) for message in messages))
+    monkeypatch.setattr(paper, "num_tokens_from_string", lambda string, encoding_name: num_tokens(string))
+    monkeypatch.setattr(paper, "get_encoding", lambda model: SimpleNamespace(name="words"))
+    # Whole papers, to see the sections kept
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "TRUNCATE", False)
+    monkeypatch.setattr(paper, "TRUNCATE", False)
+
+
+def make_paper(name, num_sections, num_words=50):
+    return Paper(json.dumps([{"heading": f"{name} {i}", "text": " ".join(["word"] * num_words)} for i in range(num_sections)]
+                            + [{"heading": "References", "text": "[1] A reference"}]))
+
+
+def fit(paper_1, paper_2, budget):
+    """ Number of tokens of the fitted conversation, and the sections kept of each paper """
+    conversation = BaselineReviewer.__new__(BaselineReviewer).fit_comparison_conversation(CRITERION, "prompt", paper_1, paper_2, budget=budget)
+    papers = conversation[-1]["content"].split("The papers:\n'Paper 1':\n", 1)[1].rsplit("\nRemember to return", 1)[0]
+    text_1, text_2 = papers.split(",\n'Paper 2':\n")
+    return sum(num_tokens(message["content"]) for message in conversation), json.loads(text_1), json.loads(text_2)
+
+
+def fixed_tokens():
+    """ Tokens of the comparison prompt without the papers """
+    return sum(num_tokens(message["content"]) for message in BaselineReviewer.__new__(BaselineReviewer).comparison_conversation(CRITERION, "prompt", "", ""))
+
+
+def test_papers_within_the_budget_are_whole():
+    paper_1, paper_2 = make_paper("first", 3), make_paper("second", 3)
+    _, sections_1, sections_2 = fit(paper_1, paper_2, fixed_tokens() + 1000)
+    assert sections_1 == paper_1.without_references
+    assert sections_2 == paper_2.without_references
+
+
+def test_long_papers_share_the_budget():
+    paper_1, paper_2 = make_paper("first", 20), make_paper("second", 20)
+    budget = fixed_tokens() + 600
+    tokens, sections_1, sections_2 = fit(paper_1, paper_2, budget)
+    assert tokens <= budget
+    # Each paper keeps its first sections, as many as fit in half of the tokens left
+    section_tokens = paper_1.token_counts[0]
+    assert sections_1 == paper_1.without_references[:len(sections_1)]
+    assert sections_2 == paper_2.without_references[:len(sections_2)]
+    assert len(sections_1) == len(sections_2) == (300 - 2) // (section_tokens + 1)
+
+
+@pytest.mark.parametrize("short_first", [True, False])
+def test_the_share_a_short_paper_leaves_goes_to_the_other(short_first):
+    short_paper, long_paper = make_paper("short", 1), make_paper("long", 20)
+    budget = fixed_tokens() + 600
+    tokens, sections_1, sections_2 = fit(short_paper, long_paper, budget) if short_first else fit(long_paper, short_paper, budget)
+    short_sections, long_sections = (sections_1, sections_2) if short_first else (sections_2, sections_1)
+    assert tokens <= budget
+    assert short_sections == short_paper.without_references
+    _, half_sections, _ = fit(long_paper, make_paper("other", 20), budget)
+    assert long_sections == long_paper.without_references[:len(long_sections)]
+    assert len(long_sections) > len(half_sections)
+    # The long paper keeps every section that fits in what the short one leaves (as estimated from the token counts)
+    short_tokens = 2 + sum(count + 1 for count in short_paper.token_counts)
+    assert len(long_sections) == (600 - short_tokens - 2) // (long_paper.token_counts[0] + 1)
@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import pytest
+
+import baseline_reviewer_chatgpt
+from baseline_reviewer_chatgpt import BaselineReviewer, average_verdicts, is_flipped
+from paper import Paper
+
+PREDICTION = Paper(json.dumps([{"heading": "Title", "text": "prediction"}]))
+CRITERION = json.dumps({"relevance": "0 if paper 1 is better, 1 if paper 2 is better", "clarity": {"organization": "0 if paper 1 is better, 1 if paper 2 is better"}})
+
+
+def make_paper(text):
+    return Paper(json.dumps([{"heading": "Title", "text": text}]))
+
+
+def as_floats(result):
+    return {key: as_floats(value) for key, value in result.items()} if isinstance(result, dict) else float(result)
+
+
+def test_flips_are_deterministic(monkeypatch):
+    comparisons = [(make_paper(f"reference {i}").digest, PREDICTION.digest, CRITERION) for i in range(200)]
+    flips = [is_flipped(*comparison) for comparison in comparisons]
+    assert [is_flipped(*comparison) for comparison in comparisons] == flips
+    # Balanced, and drawn again with another seed
+    assert 70 < sum(flips) < 130
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "FLIP_SEED", 1)
+    assert [is_flipped(*comparison) for comparison in comparisons] != flips
+
+
+def test_average_verdicts():
+    first = {"relevance": "1", "clarity": {"organization": 0, "explanations": "1"}}
+    second = {"relevance": 0, "clarity": {"organization": "0", "explanations": 1.0}}
+    assert average_verdicts(first, second) == {"relevance": 0.5, "clarity": {"organization": 0.0, "explanations": 1.0}}
+
+
+def test_average_verdicts_missing_from_one_order():
+    first = {"relevance": "1", "clarity": {"organization": "0"}}
+    second = {"clarity": {"organization": "1", "explanations": "1"}, "contribution": "0"}
+    assert average_verdicts(first, second) == {"relevance": "1", "clarity": {"organization": 0.5, "explanations": "1"}, "contribution": "0"}
+    # A single verdict where the other order has sub-criteria: the first order is kept
+    assert average_verdicts({"clarity": "1"}, {"clarity": {"organization": "0"}}) == {"clarity": "1"}
+    assert average_verdicts({"clarity": {"organization": "0"}}, {"clarity": "1"}) == {"clarity": {"organization": "0"}}
+
+
+@pytest.mark.parametrize("strength", ["strong", "weak"])
+def test_flipped_pairs_give_the_verdicts_of_the_unflipped(judge, strength):
+    reviewer = BaselineReviewer.__new__(BaselineReviewer)
+    reference = make_paper(f"{strength} reference")
+    results = [asyncio.run(reviewer.acompare_two_paper_in_order(reference, PREDICTION, "prompt", CRITERION, flipped)) for flipped in (False, True)]
+    verdict = 0.0 if strength == "strong" else 1.0
+    assert [as_floats(result) for result in results] == [{"relevance": verdict, "clarity": {"organization": verdict}}] * 2
+    # The prediction paper is shown second, then first
+    assert [prompt.index("prediction") > prompt.index(f"{strength} reference") for prompt in judge.prompts] == [True, False]
+
+
+def test_flipped_packs_give_the_verdicts_of_the_unflipped(judge):
+    reviewer = BaselineReviewer.__new__(BaselineReviewer)
+    comparisons = [("clarity", "organization", make_paper("strong reference 1")), ("relevance", None, make_paper("weak reference 2")), ("clarity", "explanations", make_paper("weak reference 3"))]
+    for flipped in (False, True):
+        assert asyncio.run(reviewer.acompare_bad_papers_in_order(comparisons, PREDICTION, "prompt", flipped)) == [0, 1, 1]
+    # The references are shown before the prediction paper when flipped
+    assert [prompt.index("'Paper'") < prompt.index("'Reference 1'") for prompt in judge.prompts] == [True, False]
@@ -0,0 +1,79 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import key_pool
+import rate_limiter
+from key_pool import KeyPool
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ A clock that only moves when told to (clock.now += seconds), or when a request sleeps """
+    clock = SimpleNamespace(now=1000.0)
+    monotonic = SimpleNamespace(monotonic=lambda: clock.now)
+    monkeypatch.setattr(key_pool, "time", monotonic)
+    monkeypatch.setattr(rate_limiter, "time", monotonic)
+
+    async def sleep(seconds):
+        clock.now += seconds
+    monkeypatch.setattr(key_pool, "asyncio", SimpleNamespace(sleep=sleep))
+    return clock
+
+
+def make_pool(request, num_keys, **budget):
+    # Rate limiters are shared by API key in the process: each test uses keys of its own
+    return KeyPool({f"key{i}": f"{request.node.name} {i}" for i in range(1, num_keys + 1)}, **budget)
+
+
+def test_from_json_file(tmp_path, request):
+    path = tmp_path / "scoring_program_chatgpt_api_key.json"
+    path.write_text(json.dumps({"key": f"{request.node.name} a", "key2": f"{request.node.name} b", "key3": "", "key4": f"{request.node.name} a", "organization": "org"}))
+    pool = KeyPool.from_json_file(str(path))
+    assert [state.name for state in pool.states] == ["key", "key2"]
+    assert [state.name for state in KeyPool.from_json_file(str(tmp_path / "missing.json")).states] == ["default"]
+
+
+def test_requests_go_to_the_least_loaded_key(clock, request):
+    pool = make_pool(request, 3)
+    states = [pool.try_acquire(10)[0] for _ in range(3)]
+    assert sorted(state.name for state in states) == ["key1", "key2", "key3"]
+    pool.release(states[1])
+    assert pool.try_acquire(10)[0] is states[1]
+
+
+def test_exhausted_keys_are_skipped(clock, request):
+    pool = make_pool(request, 2, requests_per_minute=1)
+    first, _ = pool.try_acquire(10)
+    second, _ = pool.try_acquire(10)
+    assert {first.name, second.name} == {"key1", "key2"}
+    state, wait = pool.try_acquire(10)
+    assert state is None and wait == pytest.approx(60.0)
+
+
+def test_throttled_keys_cool_down(clock, request):
+    pool = make_pool(request, 2)
+    first, _ = pool.try_acquire(10)
+    pool.release(first)
+    pool.report_throttled(first, 30)
+    assert all(pool.try_acquire(10)[0] is not first for _ in range(3))
+
+    pool.report_throttled(pool.states[1 - pool.states.index(first)], 20)
+    assert not pool.has_available_key()
+    assert pool.try_acquire(10) == (None, pytest.approx(20.0))
+    clock.now += 30
+    assert pool.has_available_key()
+    assert pool.stats()["keys"][first.name] == {"requests": 1, "throttled": 1, "cooldown_time": 30.0, "in_flight": 0}
+
+
+def test_acquire_waits_for_headroom(clock, request, tmp_path):
+    pool = make_pool(request, 1, requests_per_minute=2)
+    states = [asyncio.run(pool.acquire(10)) for _ in range(3)]
+    assert states[0] is states[2]
+    assert pool.wait_time == pytest.approx(30.0)
+
+    pool.write_stats(str(tmp_path / "key_pool_stats.json"))
+    with open(tmp_path / "key_pool_stats.json") as f:
+        assert json.load(f) == {"wait_time": pytest.approx(30.0), "keys": {"key1": {"requests": 3, "throttled": 0, "cooldown_time": 0.0, "in_flight": 3}}}
@@ -0,0 +1,83 @@
+import itertools
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+import llm_cache
+from llm_cache import LLMCache, make_cache_key, READ_ONLY, BYPASS
+
+MESSAGES = [{"role": "system", "content": "You are a reviewer."}, {"role": "user", "content": "Compare the papers."}]
+RESPONSE = {"choices": [{"message": {"role": "assistant", "content": "{\"clarity\": 1}"}}]}
+
+
+def test_cache_key_ignores_formatting_only():
+    key = make_cache_key("gpt-3.5-turbo", MESSAGES)
+    padded = [{"role": message["role"], "content": f"  {message['content']}\n"} for message in MESSAGES]
+    assert make_cache_key(" GPT-3.5-Turbo ", padded, temperature=0.0) == key
+    assert make_cache_key("gpt-4", MESSAGES) != key
+    assert make_cache_key("gpt-3.5-turbo", MESSAGES, temperature=0.7) != key
+    assert make_cache_key("gpt-3.5-turbo", MESSAGES, n=2) != key
+    assert make_cache_key("gpt-3.5-turbo", MESSAGES[::-1]) != key
+
+
+def test_read_write_round_trip(tmp_path):
+    path = str(tmp_path / "cache" / "llm_cache.sqlite")
+    key = make_cache_key("gpt-3.5-turbo", MESSAGES)
+    cache = LLMCache(path)
+    assert cache.get(key) is None
+    cache.put(key, RESPONSE)
+    assert cache.get(key) == RESPONSE
+    cache.close()
+
+    # The responses outlive the process
+    cache = LLMCache(path)
+    assert cache.get(key) == RESPONSE
+    cache.write_stats(str(tmp_path / "llm_cache_stats.json"))
+    with open(tmp_path / "llm_cache_stats.json") as f:
+        assert json.load(f)["hits"] == 1
+
+
+@pytest.mark.parametrize("mode", [READ_ONLY, BYPASS])
+def test_read_only_and_bypass_never_store(tmp_path, mode):
+    path = str(tmp_path / "llm_cache.sqlite")
+    cache = LLMCache(path, mode=mode)
+    cache.put("key", RESPONSE)
+    assert cache.get("key") is None
+    assert cache.writes == 0
+
+    writer = LLMCache(path)
+    writer.put("key", RESPONSE)
+    writer.close()
+    assert (cache.get("key") == RESPONSE) is (mode == READ_ONLY)
+
+
+def test_unknown_mode():
+    with pytest.raises(ValueError):
+        LLMCache("unused.sqlite", mode="write_only")
+
+
+def test_expired_responses_are_misses(tmp_path):
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"), max_age_days=-1)
+    cache.put("key", RESPONSE)
+    assert cache.get("key") is None
+    assert cache.misses == 1
+
+
+def test_least_recently_used_responses_are_evicted(tmp_path, monkeypatch):
+    # One tick per call, so that no two accesses happen at the same time
+    clock = itertools.count(1_000_000)
+    monkeypatch.setattr(llm_cache, "time", SimpleNamespace(time=lambda: float(next(clock))))
+    response_size = len(json.dumps(RESPONSE))
+    cache = LLMCache(str(tmp_path / "llm_cache.sqlite"), max_size_mb=2.5 * response_size / (1024 * 1024), evict_every=1)
+    cache.put("first", RESPONSE)
+    cache.put("second", RESPONSE)
+    assert cache.get("first") == RESPONSE
+    # Over the size limit: "second" is now the least recently used
+    cache.put("third", RESPONSE)
+    assert cache.evictions == 1
+    assert cache.get("second") is None
+    assert cache.get("first") == RESPONSE
+    assert cache.get("third") == RESPONSE
+    assert os.path.exists(cache.path)
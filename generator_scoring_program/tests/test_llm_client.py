@@ -0,0 +1,85 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from llm_client import AsyncLLMClient, run_sync
+
+
+class FakeClient(AsyncLLMClient):
+    """ Client whose requests take `latency` seconds to answer, keeping track of the requests in flight """
+
+    def __init__(self, latency=0.01, failures=0, **kwargs):
+        super().__init__(initial_delay=0.001, jitter=False, **kwargs)
+        self.latency = latency
+        self.failures = failures
+        self.attempts = 0
+        self.in_flight = 0
+        self.max_seen_in_flight = 0
+
+    async def _send(self, request):
+        self.attempts += 1
+        self.in_flight += 1
+        self.max_seen_in_flight = max(self.max_seen_in_flight, self.in_flight)
+        try:
+            if self.attempts <= self.failures:
+                raise asyncio.TimeoutError()
+            await asyncio.sleep(self.latency)
+            return {"choices": [{"message": {"role": "assistant", "content": request["messages"][-1]["content"]}}]}
+        finally:
+            self.in_flight -= 1
+
+
+def make_request(content):
+    return {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": content}]}
+
+
+def test_requests_in_flight_are_bounded():
+    client = FakeClient(max_in_flight=3)
+    responses = asyncio.run(client.gather([make_request(str(i)) for i in range(20)]))
+    # Answers come back in the order of the requests
+    assert [response["choices"][0]["message"]["content"] for response in responses] == [str(i) for i in range(20)]
+    assert client.max_seen_in_flight == 3
+
+
+def test_retried_errors():
+    client = FakeClient(failures=2, max_retries=2)
+    assert asyncio.run(client.create(**make_request("compare")))["choices"][0]["message"]["content"] == "compare"
+    assert client.attempts == 3
+
+    client = FakeClient(failures=3, max_retries=2)
+    with pytest.raises(Exception, match="Maximum number of retries"):
+        asyncio.run(client.create(**make_request("compare")))
+
+
+def test_requests_time_out():
+    client = FakeClient(latency=1, timeout=0.01, max_retries=1)
+    with pytest.raises(Exception, match="Maximum number of retries"):
+        asyncio.run(client.create(**make_request("compare")))
+    assert client.attempts == 2
+
+
+def test_run_sync_from_a_blocking_call_site():
+    client = FakeClient()
+    assert run_sync(client.create(**make_request("compare")))["choices"][0]["message"]["content"] == "compare"
+
+
+def test_unexpected_errors_are_raised_after_llm_max_attempts(monkeypatch, tmp_path):
+    import utils
+    from config import LLM_MAX_ATTEMPTS
+    from llm_cache import LLMCache, BYPASS
+    attempts = []
+
+    async def create(**request):
+        attempts.append(request)
+        raise ValueError("Incorrect API key provided")
+
+    async def sleep(seconds):
+        pass
+    monkeypatch.setattr(utils, "num_tokens_from_messages", lambda messages: 10)
+    monkeypatch.setattr(utils, "_llm_cache", LLMCache(str(tmp_path / "llm_cache.sqlite"), mode=BYPASS))
+    monkeypatch.setattr(utils, "_llm_client", SimpleNamespace(create=create))
+    monkeypatch.setattr(utils, "asyncio", SimpleNamespace(sleep=sleep))
+    with pytest.raises(ValueError, match="Incorrect API key"):
+        asyncio.run(utils.aask_chat_gpt([{"role": "user", "content": "compare"}]))
+    assert len(attempts) == LLM_MAX_ATTEMPTS
@@ -0,0 +1,85 @@
+import asyncio
+import json
+
+import pytest
+
+import baseline_reviewer_chatgpt
+from baseline_reviewer_chatgpt import BaselineReviewer
+from paper import Paper
+
+PREDICTION = Paper(json.dumps([{"heading": "Title", "text": "prediction"}]))
+
+
+def make_comparisons(*criteria):
+    """ One comparison per (super_category, sub_category, strength) """
+    return [(super_category, sub_category, Paper(json.dumps([{"heading": "Title", "text": f"{strength} reference {i}"}])))
+            for i, (super_category, sub_category, strength) in enumerate(criteria)]
+
+
+def expected_verdicts(comparisons):
+    return [0 if "strong" in bad_paper.text else 1 for _, _, bad_paper in comparisons]
+
+
+@pytest.fixture
+def reviewer():
+    """ A BaselineReviewer whose comparisons with a single bad paper give the expected verdict, and are kept """
+    reviewer = BaselineReviewer.__new__(BaselineReviewer)
+    reviewer.alone = []
+
+    async def acompare_bad_paper_alone(comparison, prediction_paper, prediction_prompt):
+        reviewer.alone.append(comparison)
+        return expected_verdicts([comparison])[0]
+    reviewer.acompare_bad_paper_alone = acompare_bad_paper_alone
+    return reviewer
+
+
+def compare(reviewer, comparisons, flipped):
+    return asyncio.run(reviewer.acompare_bad_papers_in_order(comparisons, PREDICTION, "prompt", flipped))
+
+
+def test_packs_group_a_super_category(monkeypatch, reviewer):
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "BAD_PAPERS_PER_REQUEST", 3)
+    comparisons = make_comparisons(("clarity", "organization", "weak"), ("relevance", None, "weak"), ("clarity", "explanations", "weak"),
+                                   ("clarity", "correctlanguage", "weak"), ("clarity", "organization", "strong"), ("relevance", None, "strong"), ("clarity", "explanations", "strong"))
+    clarity = [comparison for comparison in comparisons if comparison[0] == "clarity"]
+    relevance = [comparison for comparison in comparisons if comparison[0] == "relevance"]
+    assert reviewer.pack_bad_comparisons(comparisons) == [clarity[:3], clarity[3:], relevance]
+
+
+@pytest.mark.parametrize("flipped", [False, True])
+def test_packed_verdicts_map_back_to_their_papers(judge, reviewer, flipped):
+    comparisons = make_comparisons(("clarity", "organization", "strong"), ("clarity", "explanations", "weak"), ("relevance", None, "weak"), ("relevance", None, "strong"))
+    assert compare(reviewer, comparisons, flipped) == expected_verdicts(comparisons)
+    assert len(judge.prompts) == 1
+    assert reviewer.alone == []
+
+
+def test_both_orders_give_the_same_verdicts(monkeypatch, judge, reviewer):
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "DEBIAS_BOTH_ORDERS", True)
+    comparisons = make_comparisons(("clarity", "organization", "weak"), ("clarity", "explanations", "strong"), ("clarity", "correctlanguage", "weak"))
+    assert asyncio.run(reviewer.acompare_bad_papers(comparisons, PREDICTION, "prompt")) == expected_verdicts(comparisons)
+    assert len(judge.prompts) == 2
+
+
+@pytest.mark.parametrize("flipped", [False, True])
+def test_long_packs_are_split(monkeypatch, judge, reviewer, flipped):
+    # The judge counts one token per reference
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "COMPARISON_TOKEN_BUDGET", 2)
+    comparisons = make_comparisons(*[("clarity", "organization", strength) for strength in ["weak", "strong", "strong", "weak", "strong"]])
+    assert compare(reviewer, comparisons, flipped) == expected_verdicts(comparisons)
+    # 5 references split in 2 + 3, then 3 in 1 + 2
+    assert [prompt.count("'Reference ") for prompt in judge.prompts] == [2, 1, 2]
+    assert reviewer.alone == []
+
+    # A single reference over the budget is compared on its own
+    monkeypatch.setattr(baseline_reviewer_chatgpt, "COMPARISON_TOKEN_BUDGET", 0)
+    assert compare(reviewer, comparisons[:2], flipped) == expected_verdicts(comparisons[:2])
+    assert compare(reviewer, comparisons[2:3], flipped) == expected_verdicts(comparisons[2:3])
+    assert reviewer.alone == comparisons[:3]
+
+
+def test_missing_verdicts_are_asked_separately(judge, reviewer):
+    judge.omitted = {"Reference 2"}
+    comparisons = make_comparisons(("clarity", "organization", "weak"), ("clarity", "explanations", "strong"), ("relevance", None, "strong"))
+    assert compare(reviewer, comparisons, False) == expected_verdicts(comparisons)
+    assert reviewer.alone == [comparisons[1]]
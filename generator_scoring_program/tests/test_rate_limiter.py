@@ -0,0 +1,68 @@
+from types import SimpleNamespace
+
+import pytest
+
+import rate_limiter
+from rate_limiter import RateLimiter, get_rate_limiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    """ A clock that only moves when told to: clock.now += seconds """
+    clock = SimpleNamespace(now=1000.0)
+    monkeypatch.setattr(rate_limiter, "time", SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+def test_requests_per_minute(clock):
+    limiter = RateLimiter(requests_per_minute=60)
+    for _ in range(60):
+        assert limiter.try_acquire(0) == 0
+    assert limiter.try_acquire(0) == pytest.approx(1.0)
+    clock.now += 1
+    assert limiter.try_acquire(0) == 0
+    assert limiter.try_acquire(0) > 0
+
+
+def test_tokens_per_minute(clock):
+    limiter = RateLimiter(tokens_per_minute=6000)
+    assert limiter.try_acquire(4000) == 0
+    # 2000 tokens left, 100 more per second
+    assert limiter.try_acquire(3000) == pytest.approx(10.0)
+    clock.now += 10
+    assert limiter.try_acquire(3000) == 0
+
+
+def test_a_request_over_the_budget_waits_for_a_full_bucket(clock):
+    limiter = RateLimiter(tokens_per_minute=600)
+    assert limiter.try_acquire(1000) == 0
+    assert limiter.try_acquire(1000) == pytest.approx(60.0)
+
+
+def test_both_budgets_must_have_headroom(clock):
+    limiter = RateLimiter(requests_per_minute=1, tokens_per_minute=6000)
+    assert limiter.try_acquire(10) == 0
+    # The request budget is empty, and a refused request charges nothing
+    assert limiter.try_acquire(10) == pytest.approx(60.0)
+    assert limiter.tokens.level == 5990
+
+
+def test_adjust_charges_the_real_usage(clock):
+    limiter = RateLimiter(tokens_per_minute=6000)
+    assert limiter.try_acquire(5000) == 0
+    # The request used fewer tokens than estimated
+    limiter.adjust(-4000)
+    assert limiter.try_acquire(5000) == 0
+    limiter.adjust(1000)
+    assert limiter.try_acquire(1) > 0
+
+
+def test_no_limit():
+    limiter = RateLimiter()
+    assert all(limiter.try_acquire(10**6) == 0 for _ in range(1000))
+
+
+def test_rate_limiters_are_shared_by_key():
+    limiter = get_rate_limiter("test_rate_limiters_are_shared_by_key", 10, 1000)
+    assert get_rate_limiter("test_rate_limiters_are_shared_by_key") is limiter
+    assert get_rate_limiter("test_rate_limiters_are_shared_by_key (other key)", 10, 1000) is not limiter
@@ -0,0 +1,59 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import transport
+from transport import Transport, ReplayMissError, RECORD, REPLAY
+
+
+def make_request(content, api_key="sk-test"):
+    return {"model": "gpt-3.5-turbo", "messages": [{"role": "user", "content": content}], "temperature": 0, "n": 1, "presence_penalty": 0, "api_key": api_key}
+
+
+@pytest.fixture
+def api(monkeypatch):
+    """ Stands in for openai.ChatCompletion.acreate: numbers its answers, and keeps the requests it got """
+    requests = []
+
+    async def acreate(**request):
+        requests.append(request)
+        return {"choices": [{"message": {"role": "assistant", "content": f"answer {len(requests)}"}}]}
+    monkeypatch.setattr(transport, "openai", SimpleNamespace(ChatCompletion=SimpleNamespace(acreate=acreate)))
+    return requests
+
+
+def send_all(sender, requests):
+    async def run():
+        return [await sender.send(request) for request in requests]
+    return asyncio.run(run())
+
+
+def test_replay_answers_as_recorded(api, tmp_path):
+    trace_file = str(tmp_path / "traces" / "trace.jsonl")
+    requests = [make_request("compare"), make_request("reason"), make_request("compare")]
+    recorded = send_all(Transport(RECORD, trace_file), requests)
+    assert len(api) == 3
+    with open(trace_file) as f:
+        assert all("api_key" not in json.loads(line)["request"] for line in f)
+
+    # Repeated requests get their answers in order, whatever the API key
+    replayed = send_all(Transport(REPLAY, trace_file), [make_request("compare", api_key="sk-other"), make_request("reason"), make_request("compare")])
+    assert replayed == recorded
+    assert len(api) == 3
+
+
+def test_replay_miss(api, tmp_path):
+    trace_file = str(tmp_path / "trace.jsonl")
+    send_all(Transport(RECORD, trace_file), [make_request("compare")])
+    with pytest.raises(ReplayMissError):
+        send_all(Transport(REPLAY, trace_file), [{**make_request("compare"), "temperature": 0.5}])
+    assert len(api) == 1
+
+
+def test_modes():
+    with pytest.raises(ValueError):
+        Transport("offline")
+    with pytest.raises(ValueError):
+        Transport(REPLAY)
@@ -0,0 +1,38 @@
+import os
+import json
+
+import pytest
+
+from conftest import SAMPLE_DATA_DIR
+from paper import truncate_sections
+from bench_truncate import legacy_truncate_paper, legacy_word_count, load_papers
+
+
+@pytest.fixture(scope="module")
+def sample_papers():
+    return load_papers(os.path.join(SAMPLE_DATA_DIR, "generator", "papers"))
+
+
+# The legacy loop never ends when the headings alone are longer than max_length: the sample papers
+# have at most 71 words of headings
+@pytest.mark.parametrize("max_length", [2000, 1500])
+def test_truncate_sections_matches_the_legacy_loop(nltk_tokenizers, sample_papers, max_length):
+    assert sample_papers
+    for name, paper in sample_papers.items():
+        sections, word_counts = truncate_sections(paper, max_length)
+        assert json.dumps(sections) == json.dumps(legacy_truncate_paper(paper, max_length)), name
+        assert sum(word_counts) == legacy_word_count(sections), name
+
+
+def test_short_paper_is_returned_as_is(nltk_tokenizers):
+    paper = [{"heading": "Title", "text": "A short paper. It has two sentences."}, {"heading": "References", "text": "Some reference."}]
+    sections, word_counts = truncate_sections(paper, 2000)
+    assert sections is paper
+    assert word_counts == [10, 0]
+
+
+def test_headings_longer_than_max_length_are_kept_alone(nltk_tokenizers):
+    paper = [{"heading": "A long title", "text": "First sentence. Second sentence."}, {"heading": "Conclusion", "text": "Last sentence."}]
+    sections, word_counts = truncate_sections(paper, 2)
+    assert sections == [{"heading": "A long title", "text": ""}, {"heading": "Conclusion", "text": ""}]
+    assert word_counts == [3, 1]
@@ -0,0 +1,96 @@
+import os
+import json
+import time
+import asyncio
+import threading
+from collections import defaultdict
+
+import openai
+
+from llm_cache import make_cache_key
+
+# Transport modes
+PASSTHROUGH = "passthrough"     # send requests to the API
+RECORD = "record"               # send requests to the API and append them to the trace file
+REPLAY = "replay"               # answer from the trace file, never touching the network
+TRANSPORT_MODES = (PASSTHROUGH, RECORD, REPLAY)
+
+
+class ReplayMissError(Exception):
+    """Raised in replay mode when the trace has no answer for a request."""
+
+
+def request_key(request):
+    """Key of a ChatCompletion request in a trace (the API key is not part of it)."""
+    params = {key: value for key, value in request.items() if key not in ("model", "messages", "temperature", "n", "api_key")}
+    return make_cache_key(request["model"], request["messages"], request.get("temperature", 1), request.get("n", 1), **params)
+
+
+class Transport:
+    """Sends ChatCompletion requests, recording or replaying them from a JSONL trace.
+
+    Each line of the trace holds one request, its response and the latency
+    observed when it was recorded. In replay mode, requests seen several
+    times are answered with their recorded responses in order, and the
+    recorded latency is slept again when replay_latency is set.
+    """
+
+    def __init__(self, mode=PASSTHROUGH, trace_file=None, replay_latency=False):
+        if mode not in TRANSPORT_MODES:
+            raise ValueError(f"Unknown transport mode: {mode}. Expected one of {TRANSPORT_MODES}")
+        if mode != PASSTHROUGH and trace_file is None:
+            raise ValueError(f"A trace file is needed in {mode} mode.")
+        self.mode = mode
+        self.trace_file = trace_file
+        self.replay_latency = replay_latency
+        self._lock = threading.Lock()
+        self._replay_entries = None
+        self._replay_positions = defaultdict(int)
+
+    def _load_trace(self):
+        entries = defaultdict(list)
+        with open(self.trace_file, 'r') as f:
+            for line in f:
+                if line.strip() == "":
+                    continue
+                entry = json.loads(line)
+                entries[entry["key"]].append(entry)
+        return entries
+
+    def _next_replay_entry(self, key):
+        with self._lock:
+            if self._replay_entries is None:
+                self._replay_entries = self._load_trace()
+            entries = self._replay_entries.get(key)
+            if not entries:
+                raise ReplayMissError(f"No recorded answer for request {key} in {self.trace_file}")
+            entry = entries[self._replay_positions[key] % len(entries)]
+            self._replay_positions[key] += 1
+            return entry
+
+    def _record(self, key, request, response, latency):
+        entry = {
+            "key": key,
+            "request": {name: value for name, value in request.items() if name != "api_key"},
+            "response": response,
+            "latency": latency,
+        }
+        with self._lock:
+            directory = os.path.dirname(os.path.abspath(self.trace_file))
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            with open(self.trace_file, 'a') as f:
+                f.write(json.dumps(entry) + "\n")
+
+    async def send(self, request):
+        if self.mode == REPLAY:
+            entry = self._next_replay_entry(request_key(request))
+            if self.replay_latency:
+                await asyncio.sleep(entry["latency"])
+            return entry["response"]
+
+        start = time.perf_counter()
+        response = await openai.ChatCompletion.acreate(**request)
+        if self.mode == RECORD:
+            self._record(request_key(request), request, response, time.perf_counter() - start)
+        return response
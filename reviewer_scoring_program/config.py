@@ -1,2 +1,32 @@
+import os
+
 DEBUG = False
-SEPARATE_HTML_EACH_PAPER = False
\ No newline at end of file
+SEPARATE_HTML_EACH_PAPER = False
+NUM_BEST_AND_WORST_REVIEWS = 3 # number of best and worst meta-reviews shown in the report
+
+# LLM response cache
+LLM_CACHE_MODE = "read_write" # "read_write", "read_only" or "bypass"
+LLM_CACHE_PATH = os.path.join(os.path.expanduser("~"), ".cache", "ai_paper_challenge", "llm_cache.sqlite")
+LLM_CACHE_MAX_SIZE_MB = 512 # None for no size limit
+LLM_CACHE_MAX_AGE_DAYS = 30 # None for no age limit
+
+# LLM client
+LLM_MAX_IN_FLIGHT = 8 # maximum number of concurrent requests to the API
+LLM_REQUEST_TIMEOUT = 120 # seconds before a request is cancelled and retried
+LLM_MAX_ATTEMPTS = 5 # attempts of a request failing with an unexpected error (e.g. a server or authentication error) before it is raised
+RATE_LIMIT_RPM = 3500 # requests per minute allowed for each API key, None for no limit
+RATE_LIMIT_TPM = 90000 # tokens per minute allowed for each API key, None for no limit
+PERSPECTIVE_MAX_IN_FLIGHT = 1 # maximum number of concurrent requests to the Perspective API (respectfulness)
+PERSPECTIVE_REQUESTS_PER_SECOND = 1 # requests per second allowed by the Perspective API quota
+
+# Batch mode
+BATCH_MODE = None # None to send judge requests one by one, "local" or "interactive" to plan them as JSONL batches first
+BATCH_DIR = os.path.join(os.path.expanduser("~"), ".cache", "ai_paper_challenge", "batches")
+
+# Record / replay of LLM requests (set LLM_CACHE_MODE to "bypass" so that every request reaches the transport)
+LLM_TRANSPORT_MODE = "passthrough" # "passthrough", "record" or "replay"
+LLM_TRACE_FILE = "llm_trace.jsonl" # trace of requests, responses and latencies
+LLM_REPLAY_LATENCY = False # if True, replayed answers wait for the recorded latency
+
+# Base URL of the API, e.g. "http://localhost:8000/v1" to load-test against mock_server.py. None for the OpenAI API
+OPENAI_API_BASE = None
@@ -14,14 +14,43 @@ import re
 from tqdm.auto import tqdm
 
 from collections import defaultdict
+import threading
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
 from libscores import kendall_tau, safe_kendalltau
 
-from metacriteria.utils import custom_json_loads
+from metacriteria.utils import custom_json_loads, make_batch_session
 
 from meta_text_reviewer import MetaTextReviewer
+from top_k import TopK
+from config import NUM_BEST_AND_WORST_REVIEWS
 
 LIMIT_COMMENT_LENGTH = 2000
 
+# good_or_bad labels: "good_1", "human", "bad_soundness_1", "bad_contributionabstract_2", "bad_relevance1", ...
+LABEL_PATTERN = re.compile(r"^(?P<role>[a-z]+)(?:_(?P<token>[a-z]*)(?P<token_replicate>\d*)(?:_(?P<replicate>\d+))?)?$")
+
+def parse_good_or_bad(label, super_categories):
+    """ Parse a good_or_bad label of the reviewer metadata
+    Returns:
+        (role, criterion, sub_criterion, replicate): role is "good", "bad" or "human", criterion the super-category
+        of a bad paper (None otherwise, or if no super-category matches), sub_criterion the rest of its name
+        ("" if none), replicate the index of the paper (None if not given)
+    """
+    match = LABEL_PATTERN.match(label)
+    if match is None:
+        return label, None, None, None
+    role = match.group("role")
+    replicate = match.group("replicate") or match.group("token_replicate")
+    replicate = int(replicate) if replicate else None
+    token = match.group("token")
+    if not token:
+        return role, None, None, replicate
+    for super_category in super_categories:
+        if token.startswith(super_category):
+            return role, super_category, token[len(super_category):], replicate
+    return role, None, None, replicate
+
 class Evaluator:
     def __init__(self):
         self.EVALUATION_MODE = None
@@ -33,6 +62,8 @@ class Evaluator:
         self.reviewer_predictions = None
         self.reviewer_solutions = None
         self.reviewer_metadata = None
+        # {pdf_name: {role: {criterion: [ids]}}}, with the ids of every paper of the role under the criterion None
+        self.reviewer_sets_index = None
         self.numeric_reviewer_ranking_scores = None
         self.overall_numeric_reviewer_scores = None
         self.text_reviewer_scores = None
@@ -43,8 +74,17 @@ class Evaluator:
         self.average_score_of_bad_papers_text_meta_review = None
         self.pairs_of_good_and_bad_scores = None
 
-        self.three_highest_score_paper_details = None
-        self.three_lowest_score_paper_details = None
+        # Ids of the good papers of each set, of the bad papers of each set for each criterion, and of all the bad papers of each set
+        self.good_scores_ids = None
+        self.bad_scores_ids_dict = None
+        self.bad_scores_ids = None
+        # Set once the numeric scores are known, the meta-reviews depending on contrastive_eval_different_than_0
+        self.numeric_scores_ready = None
+        self.contrastive_eval_different_than_0 = None
+
+        # NUM_BEST_AND_WORST_REVIEWS best and worst meta-reviews, from the best (resp. worst) one
+        self.highest_score_paper_details = None
+        self.lowest_score_paper_details = None
 
         self.meta_text_reviewer = MetaTextReviewer()
 
@@ -148,25 +188,36 @@ class Evaluator:
             print("#--ERROR--# Number of lines in solution file (" + str(len(self.reviewer_solutions)) + ") does not match number of lines in prediction file (" + str(len(self.reviewer_predictions)) + ")")
             raise ValueError("Number of lines in solution file (" + str(len(self.reviewer_solutions)) + ") does not match number of lines in prediction file (" + str(len(self.reviewer_predictions)) + ")")
         
+        self.index_reviewer_solutions()
+
         print("###-------------------------------------###")
         print("### Solutions files are ready!")
         print("###-------------------------------------###\n\n")
         
+    def index_reviewer_solutions(self):
+        """Parse the good_or_bad labels once into role, criterion, sub_criterion and replicate columns,
+        and index the ids of the papers by set (pdf_name), role and criterion"""
+        labels = {label: parse_good_or_bad(label, self.super_categories) for label in self.reviewer_solutions['good_or_bad'].unique()}
+        parsed = [labels[label] for label in self.reviewer_solutions['good_or_bad']]
+        self.reviewer_solutions['role'] = pd.Categorical([role for role, _, _, _ in parsed])
+        self.reviewer_solutions['criterion'] = pd.Categorical([criterion for _, criterion, _, _ in parsed])
+        self.reviewer_solutions['sub_criterion'] = [sub_criterion for _, _, sub_criterion, _ in parsed]
+        self.reviewer_solutions['replicate'] = pd.array([replicate for _, _, _, replicate in parsed], dtype="Int64")
+
+        self.reviewer_sets_index = {}
+        for paper_id, pdf_name, (role, criterion, _, _) in zip(self.reviewer_solutions['id'], self.reviewer_solutions['pdf_name'], parsed):
+            roles = self.reviewer_sets_index.setdefault(pdf_name, {})
+            criteria = roles.setdefault(role, {})
+            criteria.setdefault(None, []).append(paper_id)
+            if criterion is not None:
+                criteria.setdefault(criterion, []).append(paper_id)
+
     def get_number_of_papers(self):
         if self.reviewer_solutions is None:
             print("#--ERROR--# Reviewer solutions are not loaded")
             raise ValueError("Reviewer solutions are not loaded")
         return len(self.reviewer_solutions)
 
-    def get_generic_reviewer_scores(self, code):
-        self.meta_text_reviewer.set_api_key(code)
-        if code == "key1":
-            return self.get_numeric_reviewer_scores()
-        elif code == "key2":
-            return self.get_good_paper_text_reviewer_scores()
-        elif code == "key3":
-            return self.get_bad_paper_text_reviewer_scores()
-        
     def get_numeric_reviewer_scores(self):
         """Get the reviewer scores for each criterion"""
         if self.overall_numeric_reviewer_scores is None:
@@ -185,328 +236,62 @@ class Evaluator:
             self.compute_reviewer_scores()
         return self.average_score_of_bad_papers_text_meta_review
 
-    def get_three_highest_score_paper_details(self):
-        """Get the three highest score paper details"""
-        if self.three_highest_score_paper_details is None:
+    def get_highest_score_paper_details(self):
+        """Get the details of the NUM_BEST_AND_WORST_REVIEWS highest score papers"""
+        if self.highest_score_paper_details is None:
             self.compute_reviewer_scores()
-        return self.three_highest_score_paper_details
+        return self.highest_score_paper_details
 
-    def get_three_lowest_score_paper_details(self):
-        """Get the three lowest score paper details"""
-        if self.three_lowest_score_paper_details is None:
+    def get_lowest_score_paper_details(self):
+        """Get the details of the NUM_BEST_AND_WORST_REVIEWS lowest score papers"""
+        if self.lowest_score_paper_details is None:
             self.compute_reviewer_scores()
-        return self.three_lowest_score_paper_details
+        return self.lowest_score_paper_details
 
     def compute_reviewer_scores(self):
         """Compute the reviewer scores."""
-        print("(Contrastive Eval) Evaluating how well you can differentiate good papers from bad papers...")
-        self.numeric_reviewer_ranking_scores = {}
-        
-        for solution_type in self.reviewer_solutions['good_or_bad'].unique():
-            if 'good' in solution_type or 'human' in solution_type:
-                continue
-            criterion = solution_type.split("_")[1]
-            for super_category in self.super_categories:
-                if criterion.startswith(super_category):
-                    self.numeric_reviewer_ranking_scores[super_category] = []
-                    break
-
-        # loop over all the criteria to get the scores
-        good_scores_df = self.reviewer_solutions[self.reviewer_solutions['good_or_bad'].apply(lambda x: 'good_1' in x)]
-        good_scores_ids_as_index = good_scores_df.groupby('pdf_name')['id'].apply(list)
-        good_scores_ids = good_scores_ids_as_index.values
-
-        bad_scores_ids_dict = {}
-        for criterion in self.numeric_reviewer_ranking_scores:
-            bad_scores_df = self.reviewer_solutions[self.reviewer_solutions['good_or_bad'].apply(lambda x: criterion in x)]
-            bad_scores_ids_as_index = bad_scores_df.groupby('pdf_name')['id'].apply(list)
-            bad_scores_ids_as_index = bad_scores_ids_as_index[good_scores_ids_as_index.index]
-            bad_scores_ids = bad_scores_ids_as_index.values
-
-            bad_scores_ids_dict[criterion] = bad_scores_ids
-
-        # ============== NUMERIC REVIEWER RANKING SCORES ==============
-        # Calculate ranking score of: RESPONSIILITY, SOUNDNESS, CONTRIBUTION, CLARITY
-        # loop over each set of papers
-        self.pairs_of_good_and_bad_scores = {criterion: [] for criterion in self.numeric_reviewer_ranking_scores}
-        average_ranking_score_across_all_sets = []
-        for set_i in range(len(good_scores_ids)):
-            average_ranking_score_each_set = []
-            # loop over each criterion
-            for criterion in self.numeric_reviewer_ranking_scores:
-                # loop over each paper in the good set
-                for good_j in range(len(good_scores_ids[set_i])):
-                    good_score = self.reviewer_predictions[good_scores_ids[set_i][good_j]][criterion]["score"]
-                    all_bad_scores = []
-                    # loop over all paper in the bad set for that criterion
-                    for bad_j in range(len(bad_scores_ids_dict[criterion][set_i])):
-                        bad_score = self.reviewer_predictions[bad_scores_ids_dict[criterion][set_i][bad_j]][criterion]["score"]
-                        all_bad_scores.append(bad_score)
-                    
-                    # compute the ranking of the good score among all the bad scores, with 0 being the lowest and 1 being the highest
-                    rank = stats.percentileofscore(all_bad_scores, good_score, kind='strict') / 100
-
-                    self.numeric_reviewer_ranking_scores[criterion].append(rank)
-                    average_ranking_score_each_set.append(rank)
-
-                    # save the good and bad scores for each criterion
-                    for bad_score in all_bad_scores:
-                        self.pairs_of_good_and_bad_scores[criterion].append((good_score, bad_score))
-            
-            average_ranking_score_across_all_sets.append(np.mean(average_ranking_score_each_set))
-            
-        
-        # # Calculate ranking score of: CONFIDENCE
-        
-        # confidence_score_each_set = []
-        # for set_i in range(len(good_scores_ids)):
-        #     confidence_score_each_set.append(self.reviewer_predictions[good_scores_ids[set_i][0]]["confidence"]["score"])
-        
-        # print("Average ranking score across all sets:", average_ranking_score_across_all_sets)
-        # print("Predicted confidence score each set:", confidence_score_each_set)
-
-        # # compute the confidence score evaluation, with 0 being the lowest and 1 being the highest
-        # # the evaluation should penalize the confidence score if the average score is low while the confidence score is high, and vice versa
-        # # one way to do this is to compute the correlation between the average score and the confidence score
-        # self.numeric_reviewer_ranking_scores["confidence"] = []
-        # for set_i in range(len(good_scores_ids)):
-        #     # correlation = cov(x, y) / (std(x) * std(y))
-        #     correlation = stats.pearsonr(average_ranking_score_across_all_sets, confidence_score_each_set)[0]
-        #     # scale the correlation to be between 0 and 1
-        #     correlation = (correlation + 1) / 2
-        #     self.numeric_reviewer_ranking_scores["confidence"].append(0 if np.isnan(correlation) else correlation)
-
-        # print("###-------------------------------------###")
-        # print("### Detailed Numeric Reviewer Ranking Scores")
-        # print(self.numeric_reviewer_ranking_scores)
-
-        # Calculate the overall reviewer scores for each criterion
-        self.overall_numeric_reviewer_scores = {}
-        contrastive_eval_different_than_0 = False
-        for criterion in self.numeric_reviewer_ranking_scores:
-            self.overall_numeric_reviewer_scores[criterion] = np.mean(self.numeric_reviewer_ranking_scores[criterion])
-            if self.overall_numeric_reviewer_scores[criterion] != 0:
-                contrastive_eval_different_than_0 = True
+        batch_session = make_batch_session()
+        if batch_session is None:
+            self.compute_reviewer_scores_once()
+        else:
+            # Plan the judge requests as batches, then score from the collected answers
+            batch_session.run(self.compute_reviewer_scores_once, name="reviewer")
 
-        if self.EVALUATION_MODE == 'full':
+    def compute_reviewer_scores_once(self):
+        """Compute the reviewer scores, calling the LLM for each request.
 
-            # ============== TEXT REVIEWER RANKING SCORES ==============
-
-            # Get the generated scores and comments for each set of papers
-            all_good_scores_and_comments = []
-            for set_i in range(len(good_scores_ids)):
-                all_good_scores_and_comments.append([self.reviewer_predictions[good_scores_ids[set_i][0]]])
-
-            all_bad_scores_and_comments = {}
-            bad_scores_df = self.reviewer_solutions[self.reviewer_solutions['good_or_bad'].apply(lambda x: 'bad' in x)]
-            bad_scores_ids_as_index = bad_scores_df.groupby('pdf_name')['id'].apply(list)
-            bad_scores_ids_as_index = bad_scores_ids_as_index[good_scores_ids_as_index.index]
-            bad_scores_ids = bad_scores_ids_as_index.values
-            for set_i in range(len(good_scores_ids)):
-                all_bad_scores_and_comments[set_i] = []
-                for bad_j in range(len(bad_scores_ids[set_i])):
-                    all_bad_scores_and_comments[set_i].append(self.reviewer_predictions[bad_scores_ids[set_i][bad_j]])
-
-            # Use the meta text reviewer to get the scores of each set of papers, for each criterion
-            # Good paper set
-            print("(LLM Eval) Evaluating good paper set...")
-            all_meta_review_of_good_scores_and_comments = []
-            for set_i in tqdm(range(len(good_scores_ids))):
-                good_scores_and_comments = all_good_scores_and_comments[set_i]
-
-                # Get the meta-review of the good scores and comments
-                # This will return a list of dictionary, each value in the dictionary coresponds with a list of 5 scores for each criterion:
-                # - A - Score: Is the score consistent with the text feed-back?
-                # - B - Precision (clarity): Is the text feed-back precise (does it point to a specific reason of praise of criticism)?
-                # - C - Correctness (soundness): Is the praise or criticism correct and well substantiated?
-                # - D - Recommendation (contribution): Does the text feed-back provide detailed and actionable recommendations for improvement?
-                # - E - Respectfulness (responsibility): Is the language polite and non discriminatory?
-
-                if contrastive_eval_different_than_0:
-                    meta_review_of_good_scores_and_comments = self.meta_text_reviewer.get_meta_review_scores(good_scores_and_comments, self.super_categories_for_text_reviewer)
-                else:
-                    # Return all 0 scores
-                    meta_review_of_good_scores_and_comments = [{criterion: np.zeros(5) for criterion in self.super_categories_for_text_reviewer}]
-                all_meta_review_of_good_scores_and_comments.append(meta_review_of_good_scores_and_comments)
-            # print("all_meta_review_of_good_scores_and_comments:", all_meta_review_of_good_scores_and_comments)
-            # Bad paper set
-            print("(LLM eval) Evaluating bad paper set...")
-            all_meta_review_of_bad_scores_and_comments = []
-            for set_i in tqdm(range(len(good_scores_ids))):
-                bad_scores_and_comments = all_bad_scores_and_comments[set_i]
-
-                # Get the meta-review of the bad scores and comments
-                # This will return a list of 5 scores for each criterion:
-                # - A - Score: Is the score consistent with the text feed-back?
-                # - B - Precision (clarity): Is the text feed-back precise (does it point to a specific reason of praise of criticism)?
-                # - C - Correctness (soundness): Is the praise or criticism correct and well substantiated?
-                # - D - Recommendation (contribution): Does the text feed-back provide detailed and actionable recommendations for improvement?
-                # - E - Respectfulness (responsibility): Is the language polite and non discriminatory?
-
-                if contrastive_eval_different_than_0:
-                    meta_review_of_bad_scores_and_comments = self.meta_text_reviewer.get_meta_review_scores(bad_scores_and_comments, self.super_categories_for_text_reviewer)
-                else:
-                    # Return all 0 scores
-                    meta_review_of_bad_scores_and_comments = [{criterion: np.zeros(5) for criterion in self.super_categories_for_text_reviewer}]
-                all_meta_review_of_bad_scores_and_comments.append(meta_review_of_bad_scores_and_comments)
+        The work is partitioned in three stages, each run once on its own worker: the numeric
+        (contrastive) scores, the meta-reviews of the good paper set and the meta-reviews of the
+        bad paper set. The meta-review stages only need the numeric stage to know whether the
+        contrastive evaluation is all 0 (numeric_scores_ready). The results are merged once
+        every stage is done.
+        """
+        self.prepare_reviewer_sets()
 
-            # Calculate the average score of each meta-criterion
-            three_lowest_scores = [np.inf, np.inf, np.inf]
-            three_highest_scores = [-np.inf, -np.inf, -np.inf]
+        self.overall_numeric_reviewer_scores = None
+        self.numeric_scores_ready = threading.Event()
+        if self.EVALUATION_MODE == 'full':
+            all_good_scores_and_comments = [[self.reviewer_predictions[self.good_scores_ids[set_i][0]]] for set_i in range(len(self.good_scores_ids))]
+            all_bad_scores_and_comments = [[self.reviewer_predictions[bad_id] for bad_id in self.bad_scores_ids[set_i]] for set_i in range(len(self.good_scores_ids))]
 
-            three_lowest_score_ids = [None, None, None]
-            three_highest_score_ids = [None, None, None]
-            
-            self.three_lowest_score_paper_details = [None, None, None]
-            self.three_highest_score_paper_details = [None, None, None]
-            # Good paper set
-            debug_all_text_meta_review_score_of_each_paper = []
-            self.average_score_of_good_papers_text_meta_review = np.zeros((len(self.super_categories_for_text_reviewer),5))
-            for set_i in range(len(good_scores_ids)):
-                meta_review_of_good_scores_and_comments = all_meta_review_of_good_scores_and_comments[set_i]
-                for paper_j, meta_review_of_each_paper in enumerate(meta_review_of_good_scores_and_comments):
-                    text_meta_review_score_of_each_paper = np.zeros((len(self.super_categories_for_text_reviewer),5))
-                    for crit_j, criterion in enumerate(self.super_categories_for_text_reviewer):
-                        text_meta_review_score_of_each_paper[crit_j] += meta_review_of_each_paper[criterion]
-                    self.average_score_of_good_papers_text_meta_review += text_meta_review_score_of_each_paper
-                    debug_all_text_meta_review_score_of_each_paper.append(text_meta_review_score_of_each_paper)
-                    average_text_meta_review_score_of_each_paper = np.mean(text_meta_review_score_of_each_paper)
-
-                    #Update the lowest score and the lowest score paper
-                    if average_text_meta_review_score_of_each_paper < three_lowest_scores[2]:
-                        # Get the paper id of the lowest score
-                        lowest_score_id = good_scores_ids[set_i][paper_j]
-                        # Get the predicted review of the lowest score
-                        lowest_score_review = self.reviewer_predictions[lowest_score_id]
-                        # # Get the meta-review reason of the lowest score
-                        # lowest_score_meta_review_reason = self.meta_text_reviewer.get_meta_review_reasons(lowest_score_review, meta_review_of_each_paper, self.super_categories_for_text_reviewer)
-
-                        current_position = 1
-                        while current_position >= 0 and average_text_meta_review_score_of_each_paper < three_lowest_scores[current_position]:
-                            three_lowest_scores[current_position] = three_lowest_scores[current_position - 1]
-                            self.three_lowest_score_paper_details[current_position] = self.three_lowest_score_paper_details[current_position - 1]
-                            current_position -= 1
-                        three_lowest_scores[current_position + 1] = average_text_meta_review_score_of_each_paper
-                        three_lowest_score_ids[current_position + 1] = lowest_score_id
-                        self.three_lowest_score_paper_details[current_position + 1] = {
-                            "id": lowest_score_id,
-                            "review": lowest_score_review,
-                            "meta_review_score": meta_review_of_each_paper,
-                            # "meta_review_reason": lowest_score_meta_review_reason
-                        }
-                    
-                    # Update the highest score and the highest score paper
-                    if average_text_meta_review_score_of_each_paper > three_highest_scores[2]:
-
-                        # Get the paper id of the highest score
-                        highest_score_id = good_scores_ids[set_i][paper_j]
-                        # Get the predicted review of the highest score
-                        highest_score_review = self.reviewer_predictions[highest_score_id]
-                        # # Get the meta-review reason of the highest score
-                        # highest_score_meta_review_reason = self.meta_text_reviewer.get_meta_review_reasons(highest_score_review, meta_review_of_each_paper, self.super_categories_for_text_reviewer)
-
-                        current_position = 1
-                        while current_position >= 0 and average_text_meta_review_score_of_each_paper > three_highest_scores[current_position]:
-                            three_highest_scores[current_position] = three_highest_scores[current_position - 1]
-                            self.three_highest_score_paper_details[current_position] = self.three_highest_score_paper_details[current_position - 1]
-                            current_position -= 1
-                        three_highest_scores[current_position + 1] = average_text_meta_review_score_of_each_paper
-                        three_highest_score_ids[current_position + 1] = highest_score_id
-                        self.three_highest_score_paper_details[current_position + 1] = {
-                            "id": highest_score_id,
-                            "review": highest_score_review,
-                            "meta_review_score": meta_review_of_each_paper,
-                            # "meta_review_reason": highest_score_meta_review_reason
-                        }
-
-            self.average_score_of_good_papers_text_meta_review = self.average_score_of_good_papers_text_meta_review/(len(good_scores_ids) * len(meta_review_of_good_scores_and_comments))
-
-            # Bad paper set
-            self.average_score_of_bad_papers_text_meta_review = np.zeros((len(self.super_categories_for_text_reviewer),5))
-            for set_i in range(len(good_scores_ids)):
-                meta_review_of_bad_scores_and_comments = all_meta_review_of_bad_scores_and_comments[set_i]
-                for meta_review_of_each_paper in meta_review_of_bad_scores_and_comments:
-                    text_meta_review_score_of_each_paper = np.zeros((len(self.super_categories_for_text_reviewer),5))
-                    for crit_j, criterion in enumerate(self.super_categories_for_text_reviewer):
-                        text_meta_review_score_of_each_paper[crit_j] += meta_review_of_each_paper[criterion]
-                    self.average_score_of_bad_papers_text_meta_review += text_meta_review_score_of_each_paper
-                    debug_all_text_meta_review_score_of_each_paper.append(text_meta_review_score_of_each_paper)
-                    average_text_meta_review_score_of_each_paper = np.mean(text_meta_review_score_of_each_paper)
-
-                    # Update the lowest score and the lowest score paper
-                    if average_text_meta_review_score_of_each_paper < three_lowest_scores[2]:
-                        # Get the paper id of the lowest score
-                        lowest_score_id = bad_scores_ids[set_i][paper_j]
-                        # Get the predicted review of the lowest score
-                        lowest_score_review = self.reviewer_predictions[lowest_score_id]
-                        # # Get the meta-review reason of the lowest score
-                        # lowest_score_meta_review_reason = self.meta_text_reviewer.get_meta_review_reasons(lowest_score_review, meta_review_of_each_paper, self.super_categories_for_text_reviewer)
-
-                        current_position = 1
-                        while current_position >= 0 and average_text_meta_review_score_of_each_paper < three_lowest_scores[current_position]:
-                            three_lowest_scores[current_position] = three_lowest_scores[current_position - 1]
-                            self.three_lowest_score_paper_details[current_position] = self.three_lowest_score_paper_details[current_position - 1]
-                            current_position -= 1
-                        three_lowest_scores[current_position + 1] = average_text_meta_review_score_of_each_paper
-                        three_lowest_score_ids[current_position + 1] = lowest_score_id
-                        self.three_lowest_score_paper_details[current_position + 1] = {
-                            "id": lowest_score_id,
-                            "review": lowest_score_review,
-                            "meta_review_score": meta_review_of_each_paper,
-                            # "meta_review_reason": lowest_score_meta_review_reason
-                        }
-
-
-                    # Update the highest score and the highest score paper
-                    if average_text_meta_review_score_of_each_paper > three_highest_scores[2]:
-                        # Get the paper id of the highest score
-                        highest_score_id = bad_scores_ids[set_i][paper_j]
-                        # Get the predicted review of the highest score
-                        highest_score_review = self.reviewer_predictions[highest_score_id]
-                        # # Get the meta-review reason of the highest score
-                        # highest_score_meta_review_reason = self.meta_text_reviewer.get_meta_review_reasons(highest_score_review, meta_review_of_each_paper, self.super_categories_for_text_reviewer)
-
-                        current_position = 1
-                        while current_position >= 0 and average_text_meta_review_score_of_each_paper > three_highest_scores[current_position]:
-                            three_highest_scores[current_position] = three_highest_scores[current_position - 1]
-                            self.three_highest_score_paper_details[current_position] = self.three_highest_score_paper_details[current_position - 1]
-                            current_position -= 1
-                        three_highest_scores[current_position + 1] = average_text_meta_review_score_of_each_paper
-                        three_highest_score_ids[current_position + 1] = highest_score_id
-                        self.three_highest_score_paper_details[current_position + 1] = {
-                            "id": highest_score_id,
-                            "review": highest_score_review,
-                            "meta_review_score": meta_review_of_each_paper,
-                            # "meta_review_reason": highest_score_meta_review_reason
-                        }
-
-            # Now calculate the details of the three highest and lowest score papers
-            for i in range(3):
-                mean_highest_score = 0
-                mean_lowest_score = 0
-                for criterion in self.super_categories_for_text_reviewer:
-                    mean_highest_score += np.mean(self.three_highest_score_paper_details[i]["meta_review_score"][criterion])
-                    mean_lowest_score += np.mean(self.three_lowest_score_paper_details[i]["meta_review_score"][criterion])
-                if mean_highest_score == 0 and mean_lowest_score == 0:
-                    self.three_highest_score_paper_details[i]["meta_review_reason"] = {criterion: ["No reason"]*5 for criterion in self.super_categories_for_text_reviewer}
-                    self.three_lowest_score_paper_details[i]["meta_review_reason"] = {criterion: ["No reason"]*5 for criterion in self.super_categories_for_text_reviewer}
-                else:
-                    self.three_highest_score_paper_details[i]["meta_review_reason"] = self.meta_text_reviewer.get_meta_review_reasons(self.three_highest_score_paper_details[i]["review"], self.three_highest_score_paper_details[i]["meta_review_score"], self.super_categories_for_text_reviewer)
-                    self.three_lowest_score_paper_details[i]["meta_review_reason"] = self.meta_text_reviewer.get_meta_review_reasons(self.three_lowest_score_paper_details[i]["review"], self.three_lowest_score_paper_details[i]["meta_review_score"], self.super_categories_for_text_reviewer)
-            
-            self.average_score_of_bad_papers_text_meta_review = self.average_score_of_bad_papers_text_meta_review/(len(good_scores_ids) * len(meta_review_of_bad_scores_and_comments))
-            
-            # print("###-------------------------------------###")
-            # print("### Detailed Text Reviewer Ranking Scores")
-            # print("###-------------------------------------###")
-            # print(debug_all_text_meta_review_score_of_each_paper)
+            with ThreadPoolExecutor(max_workers=3) as executor:
+                # Each worker runs in a copy of the current context, so that it sees the batch session of the pass
+                numeric_stage = executor.submit(contextvars.copy_context().run, self.compute_numeric_reviewer_scores)
+                good_stage = executor.submit(contextvars.copy_context().run, self.compute_text_meta_reviews, all_good_scores_and_comments, "good")
+                bad_stage = executor.submit(contextvars.copy_context().run, self.compute_text_meta_reviews, all_bad_scores_and_comments, "bad")
+                numeric_stage.result()
+                all_meta_review_of_good_scores_and_comments = good_stage.result()
+                all_meta_review_of_bad_scores_and_comments = bad_stage.result()
+
+            self.merge_text_reviewer_scores(all_meta_review_of_good_scores_and_comments, all_meta_review_of_bad_scores_and_comments)
 
         elif self.EVALUATION_MODE == 'fast':
+            self.compute_numeric_reviewer_scores()
             # Return 0 scores
             self.average_score_of_good_papers_text_meta_review = np.zeros((len(self.super_categories_for_text_reviewer),5))
             self.average_score_of_bad_papers_text_meta_review = np.zeros((len(self.super_categories_for_text_reviewer),5))
-            self.three_lowest_score_paper_details = [{"id": None, "review": None, "meta_review_score": None, "meta_review_reason": None}]*3
-            self.three_highest_score_paper_details = [{"id": None, "review": None, "meta_review_score": None, "meta_review_reason": None}]*3
+            self.lowest_score_paper_details = [{"id": None, "review": None, "meta_review_score": None, "meta_review_reason": None}]*NUM_BEST_AND_WORST_REVIEWS
+            self.highest_score_paper_details = [{"id": None, "review": None, "meta_review_score": None, "meta_review_reason": None}]*NUM_BEST_AND_WORST_REVIEWS
         else:
             raise NotImplementedError("Evaluation mode not implemented")
 
@@ -522,6 +307,221 @@ class Evaluator:
         for criterion in self.overall_text_reviewer_scores:
             self.overall_reviewer_scores[criterion] = (self.overall_text_reviewer_scores[criterion] + self.overall_numeric_reviewer_scores[criterion])/2
 
+    def prepare_reviewer_sets(self):
+        """Find the criteria to rank and the ids of the good and bad papers of each set"""
+        # criteria of the bad papers, in order of appearance
+        self.numeric_reviewer_ranking_scores = {}
+        for role, criterion in zip(self.reviewer_solutions['role'], self.reviewer_solutions['criterion']):
+            if role == 'bad' and isinstance(criterion, str):
+                self.numeric_reviewer_ranking_scores.setdefault(criterion, [])
+
+        # sets with a first good paper, sorted by pdf_name
+        replicates = dict(zip(self.reviewer_solutions['id'], self.reviewer_solutions['replicate'].fillna(0)))
+        good_ids = {pdf_name: [paper_id for paper_id in roles['good'][None] if replicates[paper_id] == 1] for pdf_name, roles in self.reviewer_sets_index.items() if 'good' in roles}
+        set_names = sorted(pdf_name for pdf_name, ids in good_ids.items() if ids)
+        self.good_scores_ids = [good_ids[pdf_name] for pdf_name in set_names]
+
+        self.bad_scores_ids_dict = {}
+        for criterion in self.numeric_reviewer_ranking_scores:
+            self.bad_scores_ids_dict[criterion] = [self.reviewer_sets_index[pdf_name]['bad'][criterion] for pdf_name in set_names]
+
+        # every bad paper of each set, whatever its criterion
+        self.bad_scores_ids = [self.reviewer_sets_index[pdf_name]['bad'][None] for pdf_name in set_names]
+
+    def compute_numeric_reviewer_scores(self):
+        """Stage computing the numeric (contrastive) reviewer scores. Sets numeric_scores_ready when done, even on failure"""
+        try:
+            print("(Contrastive Eval) Evaluating how well you can differentiate good papers from bad papers...")
+            good_scores_ids = self.good_scores_ids
+            bad_scores_ids_dict = self.bad_scores_ids_dict
+            criteria = list(self.numeric_reviewer_ranking_scores)
+            score_tensor, rows = self.build_score_tensor(criteria)
+            paper_ids = list(rows)
+
+            # ============== NUMERIC REVIEWER RANKING SCORES ==============
+            # Calculate ranking score of: RESPONSIILITY, SOUNDNESS, CONTRIBUTION, CLARITY
+            # The papers of every set are ranked at once, for each criterion
+            num_sets = len(good_scores_ids)
+            good_rows = np.array([rows[paper_id] for set_ids in good_scores_ids for paper_id in set_ids], dtype=int)
+            good_sets = np.repeat(np.arange(num_sets), [len(set_ids) for set_ids in good_scores_ids])
+            numeric_reviewer_ranking_scores = {}
+            pairs_of_good_and_bad_scores = {}
+            for crit_j, criterion in enumerate(criteria):
+                bad_rows = np.array([rows[paper_id] for set_ids in bad_scores_ids_dict[criterion] for paper_id in set_ids], dtype=int)
+                bad_counts = np.array([len(set_ids) for set_ids in bad_scores_ids_dict[criterion]], dtype=int)
+                # Every paper of the sets must be scored on the criterion
+                set_rows = np.concatenate([good_rows, bad_rows])
+                missing = np.isnan(score_tensor[set_rows, crit_j])
+                if missing.any():
+                    raise KeyError(f"The review of paper {paper_ids[set_rows[missing.argmax()]]} has no {criterion} score")
+                # ranking of each good score among the bad scores of its set, with 0 being the lowest and 1 being the highest,
+                # and the (good, bad) scores of every pair of the same set
+                numeric_reviewer_ranking_scores[criterion], pairs_of_good_and_bad_scores[criterion] = self.rank_good_against_bad(
+                    score_tensor[good_rows, crit_j], good_sets, score_tensor[bad_rows, crit_j], bad_counts)
+
+            all_ranks = np.concatenate([numeric_reviewer_ranking_scores[criterion] for criterion in criteria]) if criteria else np.zeros(0)
+            all_ranks_sets = np.tile(good_sets, len(criteria))
+            average_ranking_score_across_all_sets = np.bincount(all_ranks_sets, weights=all_ranks, minlength=num_sets) / np.bincount(all_ranks_sets, minlength=num_sets)
+                
+            
+            # # Calculate ranking score of: CONFIDENCE
+            
+            # confidence_score_each_set = []
+            # for set_i in range(len(good_scores_ids)):
+            #     confidence_score_each_set.append(self.reviewer_predictions[good_scores_ids[set_i][0]]["confidence"]["score"])
+            
+            # print("Average ranking score across all sets:", average_ranking_score_across_all_sets)
+            # print("Predicted confidence score each set:", confidence_score_each_set)
+
+            # # compute the confidence score evaluation, with 0 being the lowest and 1 being the highest
+            # # the evaluation should penalize the confidence score if the average score is low while the confidence score is high, and vice versa
+            # # one way to do this is to compute the correlation between the average score and the confidence score
+            # self.numeric_reviewer_ranking_scores["confidence"] = []
+            # for set_i in range(len(good_scores_ids)):
+            #     # correlation = cov(x, y) / (std(x) * std(y))
+            #     correlation = stats.pearsonr(average_ranking_score_across_all_sets, confidence_score_each_set)[0]
+            #     # scale the correlation to be between 0 and 1
+            #     correlation = (correlation + 1) / 2
+            #     self.numeric_reviewer_ranking_scores["confidence"].append(0 if np.isnan(correlation) else correlation)
+
+            # print("###-------------------------------------###")
+            # print("### Detailed Numeric Reviewer Ranking Scores")
+            # print(self.numeric_reviewer_ranking_scores)
+
+            # Calculate the overall reviewer scores for each criterion
+            overall_numeric_reviewer_scores = {}
+            contrastive_eval_different_than_0 = False
+            for criterion in numeric_reviewer_ranking_scores:
+                overall_numeric_reviewer_scores[criterion] = np.mean(numeric_reviewer_ranking_scores[criterion])
+                if overall_numeric_reviewer_scores[criterion] != 0:
+                    contrastive_eval_different_than_0 = True
+
+            self.numeric_reviewer_ranking_scores = numeric_reviewer_ranking_scores
+            self.pairs_of_good_and_bad_scores = pairs_of_good_and_bad_scores
+            self.overall_numeric_reviewer_scores = overall_numeric_reviewer_scores
+            self.contrastive_eval_different_than_0 = contrastive_eval_different_than_0
+        finally:
+            self.numeric_scores_ready.set()
+
+    def build_score_tensor(self, criteria):
+        """Scores of every prediction as a (paper, criterion) array, NaN where a criterion is missing
+        Returns:
+            (scores, {paper id: row of the paper})
+        """
+        rows = {paper_id: row for row, paper_id in enumerate(self.reviewer_predictions)}
+        scores = np.full((len(rows), len(criteria)), np.nan)
+        for paper_id, row in rows.items():
+            prediction = self.reviewer_predictions[paper_id]
+            for crit_j, criterion in enumerate(criteria):
+                if criterion in prediction:
+                    scores[row, crit_j] = prediction[criterion]["score"]
+        return scores, rows
+
+    def rank_good_against_bad(self, good_scores, good_sets, bad_scores, bad_counts):
+        """Rank each good score among the bad scores of its set
+        Args:
+            good_scores: scores of the good papers, grouped by set (NaN for a missing score)
+            good_sets: set of each good paper
+            bad_scores: scores of the bad papers, grouped by set in the order of the sets (NaN for a missing score)
+            bad_counts: number of bad papers of each set
+        Returns:
+            (ranks, pairs): the fraction of the bad scores of its set strictly below each good score, computed as
+            stats.percentileofscore(bad_scores_of_the_set, good_score, kind='strict') / 100, and the (good score,
+            bad score) rows of every pair of the same set, in the order of the good then the bad papers
+        """
+        num_goods = len(good_scores)
+        bad_sets = np.repeat(np.arange(len(bad_counts)), bad_counts)
+        # Scores replaced by their rank among all the scores, so that (set, score) sorts as a single integer key
+        _, dense_scores = np.unique(np.concatenate([good_scores, bad_scores]), return_inverse=True)
+        dense_scores = dense_scores.reshape(-1)
+        span = dense_scores.max() + 1 if len(dense_scores) else 1
+        bad_keys = np.sort(bad_sets * span + dense_scores[num_goods:])
+        num_below = np.searchsorted(bad_keys, good_sets * span + dense_scores[:num_goods], side='left') - np.searchsorted(bad_keys, good_sets * span, side='left')
+        # Same arithmetic as percentileofscore, NaN for a set without bad papers
+        with np.errstate(divide='ignore', invalid='ignore'):
+            ranks = num_below * (100.0 / bad_counts[good_sets]) / 100
+        # As with percentileofscore, a missing (NaN) score makes the rank NaN: np.unique sorts NaN last,
+        # which would otherwise rank a good paper without a score above every bad paper
+        sets_with_missing_bad_scores = np.bincount(bad_sets[np.isnan(bad_scores)], minlength=len(bad_counts)) > 0
+        ranks[np.isnan(good_scores) | sets_with_missing_bad_scores[good_sets]] = np.nan
+
+        pair_counts = bad_counts[good_sets]
+        bad_starts = np.cumsum(bad_counts) - bad_counts
+        pair_starts = np.cumsum(pair_counts) - pair_counts
+        pair_bad_indices = np.repeat(bad_starts[good_sets] - pair_starts, pair_counts) + np.arange(pair_counts.sum())
+        pairs = np.column_stack([np.repeat(good_scores, pair_counts), bad_scores[pair_bad_indices]])
+        return ranks, pairs
+
+    def compute_text_meta_reviews(self, all_scores_and_comments, paper_set):
+        """Stage computing the meta-reviews of the good or bad paper set
+        Args:
+            all_scores_and_comments: list of the predicted reviews of each set of papers
+            paper_set: "good" or "bad", for the progress messages
+        Returns:
+            list of the meta-reviews of each set of papers
+        """
+        # Use the meta text reviewer to get the scores of each set of papers, for each criterion
+        # This will return a list of dictionary, each value in the dictionary coresponds with a list of 5 scores for each criterion:
+        # - A - Score: Is the score consistent with the text feed-back?
+        # - B - Precision (clarity): Is the text feed-back precise (does it point to a specific reason of praise of criticism)?
+        # - C - Correctness (soundness): Is the praise or criticism correct and well substantiated?
+        # - D - Recommendation (contribution): Does the text feed-back provide detailed and actionable recommendations for improvement?
+        # - E - Respectfulness (responsibility): Is the language polite and non discriminatory?
+
+        # The meta-reviews are all 0 if the contrastive evaluation is all 0: wait for the numeric stage
+        self.numeric_scores_ready.wait()
+        if self.overall_numeric_reviewer_scores is None:
+            raise RuntimeError("The numeric reviewer scores could not be computed")
+
+        print(f"(LLM Eval) Evaluating {paper_set} paper set...")
+        if not self.contrastive_eval_different_than_0:
+            # Return all 0 scores
+            return [[{criterion: np.zeros(5) for criterion in self.super_categories_for_text_reviewer}] for _ in all_scores_and_comments]
+        # The meta-reviews of every set are computed concurrently, and returned in the order of the sets
+        return self.meta_text_reviewer.get_meta_review_scores_of_sets(all_scores_and_comments, self.super_categories_for_text_reviewer)
+
+    def merge_text_reviewer_scores(self, all_meta_review_of_good_scores_and_comments, all_meta_review_of_bad_scores_and_comments):
+        """Merge the meta-reviews of the good and bad paper sets: average scores, and best and worst meta-reviews"""
+        criteria = self.super_categories_for_text_reviewer
+
+        # (id, meta-review) of every paper, good papers first
+        papers = [(self.good_scores_ids[set_i][paper_j], meta_review) for set_i, meta_reviews in enumerate(all_meta_review_of_good_scores_and_comments) for paper_j, meta_review in enumerate(meta_reviews)]
+        num_good_papers = len(papers)
+        papers += [(self.bad_scores_ids[set_i][paper_j], meta_review) for set_i, meta_reviews in enumerate(all_meta_review_of_bad_scores_and_comments) for paper_j, meta_review in enumerate(meta_reviews)]
+
+        # Meta-review scores of each paper: (paper, criterion, meta-criterion)
+        score_matrix = np.zeros((len(papers), len(criteria), 5))
+        for paper_i, (_, meta_review) in enumerate(papers):
+            for crit_j, criterion in enumerate(criteria):
+                score_matrix[paper_i, crit_j] += meta_review[criterion]
+
+        # Average score of each meta-criterion, for the good and bad paper sets
+        num_sets = len(self.good_scores_ids)
+        self.average_score_of_good_papers_text_meta_review = score_matrix[:num_good_papers].sum(axis=0)/(num_sets * len(all_meta_review_of_good_scores_and_comments[-1]))
+        self.average_score_of_bad_papers_text_meta_review = score_matrix[num_good_papers:].sum(axis=0)/(num_sets * len(all_meta_review_of_bad_scores_and_comments[-1]))
+
+        # Best and worst meta-reviews, ties going to the first paper
+        highest_scores = TopK(NUM_BEST_AND_WORST_REVIEWS, largest=True)
+        lowest_scores = TopK(NUM_BEST_AND_WORST_REVIEWS, largest=False)
+        for paper, paper_score in zip(papers, score_matrix.reshape(len(papers), -1).mean(axis=1)):
+            highest_scores.push(paper_score, paper)
+            lowest_scores.push(paper_score, paper)
+        self.highest_score_paper_details = [{"id": paper_id, "review": self.reviewer_predictions[paper_id], "meta_review_score": meta_review} for _, (paper_id, meta_review) in highest_scores.items()]
+        self.lowest_score_paper_details = [{"id": paper_id, "review": self.reviewer_predictions[paper_id], "meta_review_score": meta_review} for _, (paper_id, meta_review) in lowest_scores.items()]
+
+        # Now calculate the details of the highest and lowest score papers
+        for highest_score_paper_details, lowest_score_paper_details in zip(self.highest_score_paper_details, self.lowest_score_paper_details):
+            mean_highest_score = 0
+            mean_lowest_score = 0
+            for criterion in criteria:
+                mean_highest_score += np.mean(highest_score_paper_details["meta_review_score"][criterion])
+                mean_lowest_score += np.mean(lowest_score_paper_details["meta_review_score"][criterion])
+            if mean_highest_score == 0 and mean_lowest_score == 0:
+                highest_score_paper_details["meta_review_reason"] = {criterion: ["No reason"]*5 for criterion in criteria}
+                lowest_score_paper_details["meta_review_reason"] = {criterion: ["No reason"]*5 for criterion in criteria}
+            else:
+                highest_score_paper_details["meta_review_reason"] = self.meta_text_reviewer.get_meta_review_reasons(highest_score_paper_details["review"], highest_score_paper_details["meta_review_score"], criteria)
+                lowest_score_paper_details["meta_review_reason"] = self.meta_text_reviewer.get_meta_review_reasons(lowest_score_paper_details["review"], lowest_score_paper_details["meta_review_score"], criteria)
 
     def get_overall_reviewer_scores(self):
         """Get the overall scores."""
@@ -623,9 +623,9 @@ class Evaluator:
             ax = axes[crit_i]
 
             pairs_of_scores = self.pairs_of_good_and_bad_scores[criterion]
-            good_scores = [pair[0] for pair in pairs_of_scores]
-            bad_scores = [pair[1] for pair in pairs_of_scores]
-            difference_of_scores = np.array(good_scores) - np.array(bad_scores)
+            good_scores = pairs_of_scores[:, 0]
+            bad_scores = pairs_of_scores[:, 1]
+            difference_of_scores = good_scores - bad_scores
 
             # Perform a t-test to see if the difference is significant
             t_statistic, p_value = stats.ttest_rel(good_scores, bad_scores)
@@ -0,0 +1,129 @@
+import os
+import re
+import json
+import time
+import asyncio
+import threading
+
+from rate_limiter import get_rate_limiter
+
+KEY_NAME_PATTERN = re.compile(r"^key\d*$")
+
+
+class APIKeyState:
+    """Load and throttling bookkeeping of one API key."""
+
+    def __init__(self, name, key, rate_limiter):
+        self.name = name
+        # None means the process-wide openai.api_key
+        self.key = key
+        self.rate_limiter = rate_limiter
+        self.in_flight = 0
+        self.requests = 0
+        self.throttled = 0
+        self.cooldown_until = 0.0
+        # Seconds spent resting after rate-limit errors
+        self.cooldown_time = 0.0
+
+    def is_cooling_down(self, now):
+        return now < self.cooldown_until
+
+
+class KeyPool:
+    """Routes each request to the least-loaded API key that still has headroom.
+
+    Keys are attached to the request (api_key=...) rather than to the
+    process, so concurrent threads never overwrite each other's key, and
+    every key added to the JSON file adds its own rate limit budget.
+    """
+
+    def __init__(self, keys, requests_per_minute=None, tokens_per_minute=None):
+        """
+        Args:
+            keys: dict of {name: api key}. Empty keys are skipped; if no key is left,
+                  a single entry using the process-wide openai.api_key is used.
+            requests_per_minute: budget of each key
+            tokens_per_minute: budget of each key
+        """
+        self.states = []
+        seen = set()
+        for name, key in keys.items():
+            if not key or key in seen:
+                continue
+            seen.add(key)
+            self.states.append(APIKeyState(name, key, get_rate_limiter(key, requests_per_minute, tokens_per_minute)))
+        if not self.states:
+            self.states.append(APIKeyState("default", None, get_rate_limiter(None, requests_per_minute, tokens_per_minute)))
+        # Seconds that requests spent waiting for a key with headroom
+        self.wait_time = 0.0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_json_file(cls, path, requests_per_minute=None, tokens_per_minute=None):
+        """Build the pool from every "key", "key1", "key2", ... entry of an API key file."""
+        keys = {}
+        if os.path.isfile(path):
+            with open(path, 'rb') as f:
+                keys = {name: key for name, key in json.load(f).items() if KEY_NAME_PATTERN.match(name)}
+        return cls(keys, requests_per_minute, tokens_per_minute)
+
+    def __len__(self):
+        return len(self.states)
+
+    def try_acquire(self, num_tokens):
+        """Reserve a key for one request.
+        Returns:
+            (state, 0.0) if a key was reserved, otherwise (None, seconds to wait before trying again)
+        """
+        with self._lock:
+            now = time.monotonic()
+            available = [state for state in self.states if not state.is_cooling_down(now)]
+            if not available:
+                return None, min(state.cooldown_until for state in self.states) - now
+            wait = None
+            for state in sorted(available, key=lambda state: (state.in_flight, state.requests)):
+                state_wait = state.rate_limiter.try_acquire(num_tokens)
+                if state_wait == 0:
+                    state.in_flight += 1
+                    state.requests += 1
+                    return state, 0.0
+                wait = state_wait if wait is None else min(wait, state_wait)
+            return None, wait
+
+    async def acquire(self, num_tokens):
+        """Wait until a key has headroom for the request and reserve it."""
+        while True:
+            state, wait = self.try_acquire(num_tokens)
+            if state is not None:
+                return state
+            with self._lock:
+                self.wait_time += wait
+            await asyncio.sleep(wait)
+
+    def release(self, state):
+        with self._lock:
+            state.in_flight -= 1
+
+    def report_throttled(self, state, cooldown):
+        """Record a rate-limit error on a key and stop routing to it for `cooldown` seconds."""
+        with self._lock:
+            state.throttled += 1
+            now = time.monotonic()
+            state.cooldown_time += max(now + cooldown - max(state.cooldown_until, now), 0.0)
+            state.cooldown_until = max(state.cooldown_until, now + cooldown)
+
+    def has_available_key(self):
+        now = time.monotonic()
+        return any(not state.is_cooling_down(now) for state in self.states)
+
+    def stats(self):
+        return {
+            "wait_time": self.wait_time,
+            "keys": {state.name: {"requests": state.requests, "throttled": state.throttled, "cooldown_time": state.cooldown_time, "in_flight": state.in_flight} for state in self.states},
+        }
+
+    def write_stats(self, stats_file):
+        """Write the per-key request and throttling counters as JSON (e.g. next to scores.json)."""
+        with open(stats_file, 'w') as f:
+            f.write(json.dumps(self.stats(), indent=4))
+
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+# Cache modes
+READ_WRITE = "read_write"   # serve hits, store misses
+READ_ONLY = "read_only"     # serve hits, never store
+BYPASS = "bypass"           # behave as if there was no cache
+CACHE_MODES = (READ_WRITE, READ_ONLY, BYPASS)
+
+
+def normalize_messages(messages):
+    """Return the messages with only the fields the API sees, stripped of surrounding whitespace."""
+    normalized = []
+    for message in messages:
+        normalized.append({str(key): str(value).strip() for key, value in message.items()})
+    return normalized
+
+
+def make_cache_key(model, messages, temperature=0, n=1, **params):
+    """Content-addressed key of a ChatCompletion request.
+    Args:
+        model: the model the request is routed to
+        messages: list of {"role": ..., "content": ...}
+        temperature: sampling temperature
+        n: number of choices
+        params: any other request parameter that changes the answer (e.g. presence_penalty)
+    Returns:
+        sha256 hex digest of the canonical JSON form of the request
+    """
+    payload = {
+        "model": str(model).strip().lower(),
+        "messages": normalize_messages(messages),
+        "temperature": round(float(temperature), 4),
+        "n": int(n),
+    }
+    for key, value in params.items():
+        payload[key] = round(float(value), 4) if isinstance(value, (int, float)) else value
+    canonical = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """On-disk cache of ChatCompletion responses, keyed by make_cache_key.
+
+    A single SQLite connection is shared by every thread and guarded by a lock,
+    so the scoring threads can use the same cache object.
+    """
+
+    def __init__(self, path, mode=READ_WRITE, max_size_mb=None, max_age_days=None, evict_every=100):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Unknown cache mode: {mode}. Expected one of {CACHE_MODES}")
+        self.path = path
+        self.mode = mode
+        self.max_size_bytes = None if max_size_mb is None else int(max_size_mb * 1024 * 1024)
+        self.max_age_seconds = None if max_age_days is None else max_age_days * 24 * 3600
+        self.evict_every = evict_every
+
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+        self._lock = threading.Lock()
+        self._connection = None
+        self._writes_since_eviction = 0
+
+    @property
+    def enabled(self):
+        return self.mode != BYPASS
+
+    def _connect(self):
+        if self._connection is None:
+            directory = os.path.dirname(os.path.abspath(self.path))
+            if not os.path.exists(directory):
+                os.makedirs(directory)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                " key TEXT PRIMARY KEY,"
+                " response TEXT NOT NULL,"
+                " size INTEGER NOT NULL,"
+                " created_at REAL NOT NULL,"
+                " accessed_at REAL NOT NULL)"
+            )
+            self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+            self._connection.commit()
+            if self.mode == READ_WRITE:
+                self._evict()
+        return self._connection
+
+    def get(self, key):
+        """Return the cached response for key, or None on a miss."""
+        if not self.enabled:
+            return None
+        with self._lock:
+            connection = self._connect()
+            row = connection.execute("SELECT response, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+            now = time.time()
+            if row is None or (self.max_age_seconds is not None and now - row[1] > self.max_age_seconds):
+                self.misses += 1
+                return None
+            if self.mode == READ_WRITE:
+                connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+                connection.commit()
+            self.hits += 1
+        return json.loads(row[0])
+
+    def put(self, key, response):
+        """Store a response (anything JSON serializable, e.g. an OpenAIObject)."""
+        if self.mode != READ_WRITE:
+            return
+        serialized = json.dumps(response)
+        now = time.time()
+        with self._lock:
+            connection = self._connect()
+            connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) VALUES (?, ?, ?, ?, ?)",
+                (key, serialized, len(serialized), now, now),
+            )
+            connection.commit()
+            self.writes += 1
+            self._writes_since_eviction += 1
+            if self._writes_since_eviction >= self.evict_every:
+                self._evict()
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones until the size limit holds. Caller holds the lock."""
+        self._writes_since_eviction = 0
+        connection = self._connection
+        if self.max_age_seconds is not None:
+            cursor = connection.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age_seconds,))
+            self.evictions += max(cursor.rowcount, 0)
+        if self.max_size_bytes is not None:
+            total_size = connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+            if total_size > self.max_size_bytes:
+                to_free = total_size - self.max_size_bytes
+                keys = []
+                for key, size in connection.execute("SELECT key, size FROM responses ORDER BY accessed_at ASC"):
+                    keys.append((key,))
+                    to_free -= size
+                    if to_free <= 0:
+                        break
+                connection.executemany("DELETE FROM responses WHERE key = ?", keys)
+                self.evictions += len(keys)
+        connection.commit()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "mode": self.mode,
+            "path": self.path,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "writes": self.writes,
+            "evictions": self.evictions,
+        }
+
+    def write_stats(self, stats_file):
+        """Write the hit/miss counters as JSON (e.g. next to scores.json)."""
+        with open(stats_file, 'w') as f:
+            f.write(json.dumps(self.stats(), indent=4))
+
+    def close(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,125 @@
+import asyncio
+import random
+import threading
+
+import openai
+
+from key_pool import KeyPool
+from transport import Transport
+
+# Errors retried with exponential backoff, as in retry_with_exponential_backoff
+RETRY_ERRORS = (openai.error.RateLimitError, asyncio.TimeoutError)
+
+_loop = None
+_loop_thread = None
+_loop_lock = threading.Lock()
+
+
+def get_event_loop():
+    """Returns the background event loop shared by every LLM call of the process, starting it if needed."""
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            _loop = asyncio.new_event_loop()
+            _loop_thread = threading.Thread(target=_loop.run_forever, name="llm-client-loop", daemon=True)
+            _loop_thread.start()
+    return _loop
+
+
+def run_sync(coroutine):
+    """Run a coroutine on the shared event loop and block until it returns.
+    This is the sync shim used by the blocking call sites (e.g. ask_chat_gpt);
+    it can be called from any thread except the event loop thread itself.
+    """
+    loop = get_event_loop()
+    if threading.current_thread() is _loop_thread:
+        coroutine.close()
+        raise RuntimeError("run_sync() cannot be called from the LLM event loop, await the coroutine instead.")
+    return asyncio.run_coroutine_threadsafe(coroutine, loop).result()
+
+
+class AsyncLLMClient:
+    """Asyncio ChatCompletion client with a bounded number of in-flight requests.
+
+    Every request is routed by the key pool to an API key whose
+    requests/tokens-per-minute budget has headroom, then runs under a shared
+    semaphore, is cancelled after `timeout` seconds, and is retried on `errors`
+    with the same exponential backoff as retry_with_exponential_backoff.
+    """
+
+    def __init__(
+        self,
+        max_in_flight: int = 8,
+        timeout: float = 120,
+        initial_delay: float = 1,
+        exponential_base: float = 2,
+        jitter: bool = True,
+        max_retries: int = 10,
+        errors: tuple = RETRY_ERRORS,
+        key_pool: KeyPool = None,
+        token_counter=None,
+        transport: Transport = None,
+    ):
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.initial_delay = initial_delay
+        self.exponential_base = exponential_base
+        self.jitter = jitter
+        self.max_retries = max_retries
+        self.errors = errors
+        # Without a pool, every request uses openai.api_key with no rate limit
+        self.key_pool = key_pool if key_pool is not None else KeyPool({})
+        # Estimates the prompt tokens of a list of messages, e.g. num_tokens_from_messages
+        self.token_counter = token_counter
+        # Sends the requests: to the API, or recorded to / replayed from a trace
+        self.transport = transport if transport is not None else Transport()
+        self._semaphore = None
+
+    def _get_semaphore(self):
+        # Created lazily so that it belongs to the loop running the requests
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+        return self._semaphore
+
+    async def _send(self, request):
+        return await self.transport.send(request)
+
+    async def create(self, **request):
+        """Send one ChatCompletion request (same keyword arguments as openai.ChatCompletion.create)."""
+        estimated_tokens = self.token_counter(request["messages"]) if self.token_counter is not None else 0
+
+        num_retries = 0
+        delay = self.initial_delay
+        while True:
+            key_state = await self.key_pool.acquire(estimated_tokens)
+            try:
+                keyed_request = request if key_state.key is None else dict(request, api_key=key_state.key)
+                async with self._get_semaphore():
+                    response = await asyncio.wait_for(self._send(keyed_request), timeout=self.timeout)
+                # Charge the completion tokens, and correct the prompt estimate
+                usage = response.get("usage")
+                if usage is not None:
+                    key_state.rate_limiter.adjust(usage["total_tokens"] - estimated_tokens)
+                return response
+
+            # Retry on specified errors, sleeping outside of the semaphore
+            except self.errors as e:
+                num_retries += 1
+                if num_retries > self.max_retries:
+                    raise Exception(
+                        f"Maximum number of retries ({self.max_retries}) exceeded."
+                    )
+                delay *= self.exponential_base * (1 + self.jitter * random.random())
+                if isinstance(e, openai.error.RateLimitError):
+                    # Rest the throttled key, and retry at once if another key can take the request
+                    self.key_pool.report_throttled(key_state, delay)
+                    if self.key_pool.has_available_key():
+                        continue
+                await asyncio.sleep(delay)
+
+            finally:
+                self.key_pool.release(key_state)
+
+    async def gather(self, requests):
+        """Send several requests concurrently, returning the responses in the same order."""
+        return await asyncio.gather(*[self.create(**request) for request in requests])
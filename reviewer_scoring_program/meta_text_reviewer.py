@@ -1,4 +1,5 @@
 import openai
+import asyncio
 import json5 as json
 import re
 import os
@@ -16,48 +17,70 @@ from metacriteria.d_recommendation import Recommendation
 from metacriteria.e_respectfulness import Respectfulness
 
 from tqdm.auto import tqdm
+from concurrent.futures import ThreadPoolExecutor
 
-from config import DEBUG
+from config import DEBUG, PERSPECTIVE_MAX_IN_FLIGHT
+
+# Answer of the meta-review reason prompt used while planning batches
+REASON_PLACEHOLDER = '{"rating_reason": "", "precision_reason": "", "correctness_reason": "", "recommendation_reason": "", "respectfulness_reason": ""}'
 
 class MetaTextReviewer:
     def __init__(self):
-        current_real_dir = os.path.dirname(os.path.realpath(__file__))
-        with open(os.path.join(current_real_dir, 'scoring_program_chatgpt_api_key.json'), 'rb') as f:
-            self.api_key = json.load(f)['key1']
-
-        openai.api_key = self.api_key
+        # API keys are attached to each request by the key pool, not to the openai module
+        self.key_pool = get_key_pool()
 
         self.rating_reviewer = Rating()
         self.precision_reviewer = Precision()
         self.correctness_reviewer = Correctness()
         self.recommendation_reviewer = Recommendation()
         self.respectfulness_reviewer = Respectfulness()
+        # Threads running the blocking Perspective API requests of the respectfulness meta-criterion
+        self.perspective_executor = ThreadPoolExecutor(max_workers=PERSPECTIVE_MAX_IN_FLIGHT, thread_name_prefix="perspective")
 
-    def set_api_key(self, name_api_key):
-        current_real_dir = os.path.dirname(os.path.realpath(__file__))
-        with open(os.path.join(current_real_dir, 'scoring_program_chatgpt_api_key.json'), 'rb') as f:
-            self.api_key = json.load(f)[name_api_key]
-        openai.api_key = self.api_key
-        
     def get_meta_review_scores(self, scores_and_comments, criteria_to_review):
-        meta_reviews = []
-        for score_and_comment in tqdm(scores_and_comments):
-            meta_review = {}
-            for criterion in criteria_to_review:
-                # it will return a list of 5 scores:
-                # - A - Score: Is the score consistent with the text feed-back?
-                # - B - Precision (clarity): Is the text feed-back precise (does it point to a specific reason of praise of criticism)?
-                # - C - Correctness (soundness): Is the praise or criticism correct and well substantiated?
-                # - D - Recommendation (contribution): Does the text feed-back provide detailed and actionable recommendations for improvement?
-                # - E - Respectfulness (responsibility): Is the language polite and non discriminatory?
-                meta_review[criterion] = self.get_meta_review_score(score_and_comment[criterion], criterion)
-            meta_reviews.append(meta_review)
-        return meta_reviews
+        return self.get_meta_review_scores_of_sets([scores_and_comments], criteria_to_review)[0]
+
+    def get_meta_review_scores_of_sets(self, all_scores_and_comments, criteria_to_review):
+        """ Get the meta-reviews of several sets of reviews, all computed concurrently
+        Args:
+            all_scores_and_comments: list of sets of reviews, each a list of {criterion: {score: score, comment: comment}}
+            criteria_to_review: the criteria to review
+        Returns:
+            list of the meta-reviews of each set, in the order of the reviews
+        """
+        progress = tqdm(total=sum(len(scores_and_comments) for scores_and_comments in all_scores_and_comments))
+        async def get_all_meta_review_scores():
+            return await asyncio.gather(*[self.aget_meta_review_scores(scores_and_comments, criteria_to_review, progress) for scores_and_comments in all_scores_and_comments])
+        try:
+            return run_sync(get_all_meta_review_scores())
+        finally:
+            progress.close()
+
+    async def aget_meta_review_scores(self, scores_and_comments, criteria_to_review, progress=None):
+        """ Meta-reviews of a set of reviews, as {criterion: list of 5 scores}
+        Every (review, criterion, meta-criterion) call is a job of its own: they all run concurrently,
+        bounded by LLM_MAX_IN_FLIGHT for the LLM, and by PERSPECTIVE_MAX_IN_FLIGHT and PERSPECTIVE_REQUESTS_PER_SECOND
+        for the Perspective API.
+        """
+        async def aget_meta_review(score_and_comment):
+            # - A - Score: Is the score consistent with the text feed-back?
+            # - B - Precision (clarity): Is the text feed-back precise (does it point to a specific reason of praise of criticism)?
+            # - C - Correctness (soundness): Is the praise or criticism correct and well substantiated?
+            # - D - Recommendation (contribution): Does the text feed-back provide detailed and actionable recommendations for improvement?
+            # - E - Respectfulness (responsibility): Is the language polite and non discriminatory?
+            meta_review_scores = await asyncio.gather(*[self.aget_meta_review_score(score_and_comment[criterion], criterion) for criterion in criteria_to_review])
+            if progress is not None:
+                progress.update(1)
+            return dict(zip(criteria_to_review, meta_review_scores))
+        return list(await asyncio.gather(*[aget_meta_review(score_and_comment) for score_and_comment in scores_and_comments]))
 
     def get_meta_review_score(self, score_and_comment, criterion):
+        return run_sync(self.aget_meta_review_score(score_and_comment, criterion))
+
+    async def aget_meta_review_score(self, score_and_comment, criterion):
         if DEBUG:
             return np.array([random.random() for _ in range(5)])
-        else:    
+        else:
             score = score_and_comment['score']
             comment = score_and_comment['comment']
 
@@ -66,41 +89,45 @@ class MetaTextReviewer:
             correctness_prompt = self.correctness_reviewer.get_prompt_for_evaluation(score, comment)
             recommendation_prompt = self.recommendation_reviewer.get_prompt_for_evaluation(score, comment)
 
+            # The Perspective API client is blocking: it runs on the executor while the LLM answers the Likert prompts
+            respectfulness_score = asyncio.get_running_loop().run_in_executor(self.perspective_executor, self.respectfulness_reviewer.evaluate, score, comment)
+            likert_scores = await asyncio.gather(*[self.aget_likert_score(metacriteria_prompt) for metacriteria_prompt in [rating_prompt, precision_prompt, correctness_prompt, recommendation_prompt]])
 
-            scores = []
-            for i, metacriteria_prompt in enumerate([rating_prompt, precision_prompt, correctness_prompt, recommendation_prompt]):
-                success = False
-                num_trials = 0
-                while not success and num_trials < 5:
-                    try:
-                        prompt = [
-                            {"role": "system", "content":"You are a meta-reviewer who will help me evaluate a paper. You have given a score and a comment. Now you need to provide a grading for the score."},
-                            {"role": "user", "content": \
-                                "You are a meta-reviewer who will help me evaluate a paper. You have given a score and a comment. Now you need to provide a single number for your assessment in Likert scale from 1 to 3: [1 for No, 2 for More-or-less, 3 for Yes]}. No explaination needed.\n" + \
-                                metacriteria_prompt}
-                        ]
-                        
-                        answer = ask_chat_gpt(prompt)["choices"][0]["message"]["content"]
-                        try:
-                            score = (float(answer) - 1) / 2
-                        except:
-                            pattern = r"Assessment: (\d+(\.\d+)?)(/(\d+(\.\d+)?))?"
-                            match = re.search(pattern, answer)
-                            matched = match.group(1, 4)
-                            if matched[1] is None:
-                                score = (float(matched[0]) - 1) / 2
-                            else:
-                                score = float(matched[0]) / float(matched[1])
-                        scores.append(score)
-                        success = True
-                    except Exception as e:
-                        print("Error: ", e)
-                        print("Retrying...")
-                        num_trials += 1
-                        success = False
-            scores.append(self.respectfulness_reviewer.evaluate(score, comment))
+            # A meta-criterion whose 5 trials all failed has no score
+            scores = [likert_score for likert_score in likert_scores if likert_score is not None]
+            scores.append(await respectfulness_score)
             return np.array(scores)
 
+    async def aget_likert_score(self, metacriteria_prompt):
+        """ Likert score (1 to 3, rescaled to [0, 1]) of one meta-criterion, retried up to 5 times. None if every trial failed """
+        num_trials = 0
+        while num_trials < 5:
+            try:
+                prompt = [
+                    {"role": "system", "content":"You are a meta-reviewer who will help me evaluate a paper. You have given a score and a comment. Now you need to provide a grading for the score."},
+                    {"role": "user", "content": \
+                        "You are a meta-reviewer who will help me evaluate a paper. You have given a score and a comment. Now you need to provide a single number for your assessment in Likert scale from 1 to 3: [1 for No, 2 for More-or-less, 3 for Yes]}. No explaination needed.\n" + \
+                        metacriteria_prompt}
+                ]
+
+                answer = (await aask_chat_gpt(prompt, placeholder="2"))["choices"][0]["message"]["content"]
+                try:
+                    score = (float(answer) - 1) / 2
+                except:
+                    pattern = r"Assessment: (\d+(\.\d+)?)(/(\d+(\.\d+)?))?"
+                    match = re.search(pattern, answer)
+                    matched = match.group(1, 4)
+                    if matched[1] is None:
+                        score = (float(matched[0]) - 1) / 2
+                    else:
+                        score = float(matched[0]) / float(matched[1])
+                return score
+            except Exception as e:
+                print("Error: ", e)
+                print("Retrying...")
+                num_trials += 1
+        return None
+
     def get_meta_review_reasons(self, scores_and_comments, meta_review_scores, criteria_to_review):
         meta_review_reasons = {}
         # print("Getting meta-review reasons...")
@@ -149,7 +176,7 @@ class MetaTextReviewer:
             num_trials = 0
             while not success and num_trials < 5:
                 try:
-                    answer = ask_chat_gpt(prompt, temperature=0.2*num_trials)["choices"][0]["message"]["content"]
+                    answer = ask_chat_gpt(prompt, temperature=0.2*num_trials, placeholder=REASON_PLACEHOLDER, batch_stage=1)["choices"][0]["message"]["content"]
                     answer = custom_json_loads(answer)
                     success = True
                 except Exception as e:
@@ -167,7 +194,7 @@ class MetaTextReviewer:
                                     "\"respectfulness_reason\" : ..." + \
                                 "\n\}\nPreliminary results: " + str(answer)}
                         ]
-                        answer = ask_chat_gpt(reformat_prompt)["choices"][0]["message"]["content"]
+                        answer = ask_chat_gpt(reformat_prompt, placeholder=REASON_PLACEHOLDER, batch_stage=2)["choices"][0]["message"]["content"]
                         answer = custom_json_loads(answer)
                         success = True
                     except:
@@ -1,9 +1,19 @@
 import openai
 import tiktoken
+import functools
 import time 
+import asyncio
 import random
 import json
 import json5
+import os
+
+from config import LLM_CACHE_MODE, LLM_CACHE_PATH, LLM_CACHE_MAX_SIZE_MB, LLM_CACHE_MAX_AGE_DAYS, LLM_MAX_IN_FLIGHT, LLM_REQUEST_TIMEOUT, LLM_MAX_ATTEMPTS, RATE_LIMIT_RPM, RATE_LIMIT_TPM, BATCH_MODE, BATCH_DIR, LLM_TRANSPORT_MODE, LLM_TRACE_FILE, LLM_REPLAY_LATENCY, OPENAI_API_BASE
+from llm_cache import LLMCache, make_cache_key
+from llm_client import AsyncLLMClient, run_sync
+from key_pool import KeyPool
+from transport import Transport, ReplayMissError
+from batch import BatchSession, LocalFileBackend, InteractiveBackend, get_batch_session, LOCAL, INTERACTIVE
 
 def retry_with_exponential_backoff(
 func,
@@ -49,14 +59,26 @@ func,
     return wrapper
 
 
-def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
-    """Returns the number of tokens used by a list of messages."""
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """Returns the tiktoken encoding of a model, built once per process."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+# Only the last few strings are kept: a prompt is counted for the model routing of aask_chat_gpt and again
+# by the LLM client for its rate limit
+@functools.lru_cache(maxsize=32)
+def num_tokens_from_string(text, encoding_name="cl100k_base"):
+    """Returns the number of tokens of a string."""
+    return len(tiktoken.get_encoding(encoding_name).encode(text))
+
+
+def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
+    """Returns the number of tokens used by a list of messages."""
     if model == "gpt-3.5-turbo":
         print("Warning: gpt-3.5-turbo may change over time. Returning num tokens assuming gpt-3.5-turbo-0301.")
         return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301")
@@ -71,37 +93,96 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
         tokens_per_name = 1
     else:
         raise NotImplementedError(f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
+    encoding_name = get_encoding(model).name
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += num_tokens_from_string(value, encoding_name)
         if key == "name":
             num_tokens += tokens_per_name
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
-@retry_with_exponential_backoff
-def ask_chat_gpt(prompt, model="gpt-3.5-turbo-16k", temperature=0, n=1, frequency_penalty=0, presence_penalty=0):
+_llm_cache = LLMCache(LLM_CACHE_PATH, mode=LLM_CACHE_MODE, max_size_mb=LLM_CACHE_MAX_SIZE_MB, max_age_days=LLM_CACHE_MAX_AGE_DAYS)
+
+def get_llm_cache():
+    """Returns the process-wide LLM response cache used by ask_chat_gpt."""
+    return _llm_cache
+
+if OPENAI_API_BASE is not None:
+    openai.api_base = OPENAI_API_BASE
+
+# Every key of the API key file is used, each with its own rate limit budget
+_key_pool = KeyPool.from_json_file(os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), 'scoring_program_chatgpt_api_key.json'), requests_per_minute=RATE_LIMIT_RPM, tokens_per_minute=RATE_LIMIT_TPM)
+_transport = Transport(LLM_TRANSPORT_MODE, LLM_TRACE_FILE, replay_latency=LLM_REPLAY_LATENCY)
+_llm_client = AsyncLLMClient(max_in_flight=LLM_MAX_IN_FLIGHT, timeout=LLM_REQUEST_TIMEOUT, key_pool=_key_pool, token_counter=num_tokens_from_messages, transport=_transport)
+
+def get_key_pool():
+    """Returns the pool of API keys that ask_chat_gpt routes requests to."""
+    return _key_pool
+
+def get_llm_client():
+    """Returns the process-wide asyncio client used by ask_chat_gpt."""
+    return _llm_client
+
+def make_batch_session():
+    """Returns a batch session for BATCH_MODE, or None when judge requests are sent one by one."""
+    if BATCH_MODE is None:
+        return None
+    elif BATCH_MODE == LOCAL:
+        backend = LocalFileBackend()
+    elif BATCH_MODE == INTERACTIVE:
+        backend = InteractiveBackend(_llm_client, run_sync)
+    else:
+        raise ValueError(f"Unknown batch mode: {BATCH_MODE}")
+    return BatchSession(BATCH_DIR, backend, _llm_cache)
+
+async def aask_chat_gpt(prompt, model="gpt-3.5-turbo-16k", temperature=0, n=1, frequency_penalty=0, presence_penalty=0, placeholder="", batch_stage=0):
+    """ Ask ChatGPT, going through the response cache.
+    In batch mode, a cache miss is recorded in the batch and `placeholder` is returned as the answer content;
+    `batch_stage` orders requests whose prompt depends on the answers of earlier ones (see BatchSession).
+    """
     model = "gpt-3.5-turbo" if num_tokens_from_messages(prompt)<=4_000 else "gpt-3.5-turbo-16k"
-    try:
-        response = openai.ChatCompletion.create(
-        model=model,
-        messages=prompt,
-        temperature=temperature,
-        n=n,
-        presence_penalty=presence_penalty,
-        frequency_penalty=frequency_penalty
-      )
-    except Exception as e:
-        print("An unexpected error occurred:", e)
-        time.sleep(10)
-        if model == "gpt-3.5-turbo":
-            return ask_chat_gpt(prompt, model="gpt-3.5-turbo-0301")
-        else:
-            return ask_chat_gpt(prompt, model)
+
+    cache_key = make_cache_key(model, prompt, temperature, n, frequency_penalty=frequency_penalty, presence_penalty=presence_penalty)
+    cached_response = _llm_cache.get(cache_key)
+    if cached_response is not None:
+        return cached_response
+
+    batch_session = get_batch_session()
+    if batch_session is not None:
+        request = dict(model=model, messages=prompt, temperature=temperature, n=n, presence_penalty=presence_penalty, frequency_penalty=frequency_penalty)
+        return batch_session.defer(cache_key, request, placeholder, batch_stage)
+
+    # Rate limits and timeouts are retried by the client; any other error is retried a few times, then raised
+    num_attempts = 0
+    while True:
+        try:
+            response = await _llm_client.create(
+                model=model,
+                messages=prompt,
+                temperature=temperature,
+                n=n,
+                presence_penalty=presence_penalty,
+                frequency_penalty=frequency_penalty
+            )
+            break
+        except ReplayMissError:
+            raise
+        except Exception as e:
+            num_attempts += 1
+            print("An unexpected error occurred:", e)
+            if num_attempts >= LLM_MAX_ATTEMPTS:
+                raise
+            await asyncio.sleep(10)
+    _llm_cache.put(cache_key, response)
     return response
 
+def ask_chat_gpt(prompt, model="gpt-3.5-turbo-16k", temperature=0, n=1, frequency_penalty=0, presence_penalty=0, placeholder="", batch_stage=0):
+    """Blocking version of aask_chat_gpt, kept for the sequential call sites."""
+    return run_sync(aask_chat_gpt(prompt, model=model, temperature=temperature, n=n, frequency_penalty=frequency_penalty, presence_penalty=presence_penalty, placeholder=placeholder, batch_stage=batch_stage))
+
 def custom_json_loads(s: str, strict=False) -> dict:  # type: ignore
     # TODO: one thing this doesn't handle, is if the unescaped text includes valid JSON - then you're just out of luck
     try:
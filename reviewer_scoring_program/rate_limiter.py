@@ -0,0 +1,75 @@
+import time
+import threading
+
+
+class TokenBucket:
+    """Classic token bucket: holds at most `capacity` units and refills continuously."""
+
+    def __init__(self, capacity, refill_per_second):
+        self.capacity = float(capacity)
+        self.refill_per_second = float(refill_per_second)
+        self.level = float(capacity)
+        self.updated_at = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.refill_per_second)
+        self.updated_at = now
+
+    def wait_time(self, amount):
+        """Seconds until `amount` units are available (0 if they already are)."""
+        missing = min(amount, self.capacity) - self.level
+        return 0.0 if missing <= 0 else missing / self.refill_per_second
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute budget of one API key.
+
+    A request is only let through when both buckets can pay for it, so the
+    limiter throttles before the API answers with a 429. The object is
+    thread-safe; waiting for the budget is left to the caller (see KeyPool).
+    """
+
+    def __init__(self, requests_per_minute=None, tokens_per_minute=None):
+        self.requests = None if requests_per_minute is None else TokenBucket(requests_per_minute, requests_per_minute / 60)
+        self.tokens = None if tokens_per_minute is None else TokenBucket(tokens_per_minute, tokens_per_minute / 60)
+        self._lock = threading.Lock()
+
+    def try_acquire(self, num_tokens):
+        """Take one request and num_tokens tokens if both are available.
+        Returns:
+            0.0 if the budget was charged, otherwise the number of seconds to wait before trying again
+        """
+        with self._lock:
+            now = time.monotonic()
+            wait = 0.0
+            for bucket, amount in ((self.requests, 1), (self.tokens, num_tokens)):
+                if bucket is not None:
+                    bucket.refill(now)
+                    wait = max(wait, bucket.wait_time(amount))
+            if wait > 0:
+                return wait
+            if self.requests is not None:
+                self.requests.level -= 1
+            if self.tokens is not None:
+                self.tokens.level -= min(num_tokens, self.tokens.capacity)
+            return 0.0
+
+    def adjust(self, num_tokens):
+        """Charge (or refund if negative) tokens once the real usage of a request is known."""
+        if self.tokens is None or num_tokens == 0:
+            return
+        with self._lock:
+            self.tokens.refill(time.monotonic())
+            self.tokens.level -= num_tokens
+
+
+_rate_limiters = {}
+_rate_limiters_lock = threading.Lock()
+
+
+def get_rate_limiter(api_key, requests_per_minute=None, tokens_per_minute=None):
+    """Returns the RateLimiter of an API key, shared by every thread of the process."""
+    with _rate_limiters_lock:
+        if api_key not in _rate_limiters:
+            _rate_limiters[api_key] = RateLimiter(requests_per_minute, tokens_per_minute)
+        return _rate_limiters[api_key]
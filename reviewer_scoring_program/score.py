@@ -6,15 +6,10 @@ import os
 import json
 import time
 from sys import argv
-from metacriteria.utils import custom_json_loads
+from metacriteria.utils import custom_json_loads, get_llm_cache, get_key_pool
 import libscores
 from evaluator import Evaluator
 from config import SEPARATE_HTML_EACH_PAPER
-import threading
-
-numeric_reviewer_scores = None
-good_paper_text_reviewer_scores = None
-bad_paper_text_reviewer_scores = None
 
 # Set up default directories and file names:
 ROOT_DIR = "../"
@@ -49,47 +44,25 @@ def create_score_directory(score_dir):
         os.makedirs(score_dir)
 
 
-def get_numeric_reviewer_scores(evaluator):
-    global numeric_reviewer_scores
-    numeric_reviewer_scores = evaluator.get_generic_reviewer_scores("key1")
-
-def get_good_paper_text_reviewer_scores(evaluator):
-    global good_paper_text_reviewer_scores
-    good_paper_text_reviewer_scores = evaluator.get_generic_reviewer_scores("key2")
-
-def get_bad_paper_text_reviewer_scores(evaluator):
-    global bad_paper_text_reviewer_scores
-    bad_paper_text_reviewer_scores = evaluator.get_generic_reviewer_scores("key3")
-
-
 def compute_scores(evaluator, solution_dir, prediction_dir, data_name):
     """ Compute reviewer and generator scores """
     # try:
     reviewer_predict_file = os.path.join(prediction_dir, f'{data_name}_reviewer.predict')
     evaluator.read_reviewer_solutions_and_predictions(solution_dir, reviewer_predict_file)
 
-    thread_numeric_scores = threading.Thread(target=get_numeric_reviewer_scores, args=(evaluator,))
-    thread_good_scores = threading.Thread(target=get_good_paper_text_reviewer_scores, args=(evaluator,))
-    thread_bad_scores = threading.Thread(target=get_bad_paper_text_reviewer_scores, args=(evaluator,))
-
-    thread_numeric_scores.start()
-    thread_good_scores.start()
-    thread_bad_scores.start()
-
-    thread_numeric_scores.join()
-    thread_good_scores.join()
-    thread_bad_scores.join()
+    # The numeric, good set and bad set stages each run once, on their own worker (see compute_reviewer_scores_once)
+    evaluator.compute_reviewer_scores()
 
-    # numeric_reviewer_scores = evaluator.get_numeric_reviewer_scores()
-    # good_paper_text_reviewer_scores = evaluator.get_good_paper_text_reviewer_scores()
-    # bad_paper_text_reviewer_scores = evaluator.get_bad_paper_text_reviewer_scores()
+    numeric_reviewer_scores = evaluator.get_numeric_reviewer_scores()
+    good_paper_text_reviewer_scores = evaluator.get_good_paper_text_reviewer_scores()
+    bad_paper_text_reviewer_scores = evaluator.get_bad_paper_text_reviewer_scores()
 
-    three_highest_score_paper_details = evaluator.get_three_highest_score_paper_details()
-    three_lowest_score_paper_details = evaluator.get_three_lowest_score_paper_details()
-    return numeric_reviewer_scores, good_paper_text_reviewer_scores, bad_paper_text_reviewer_scores, three_highest_score_paper_details, three_lowest_score_paper_details
+    highest_score_paper_details = evaluator.get_highest_score_paper_details()
+    lowest_score_paper_details = evaluator.get_lowest_score_paper_details()
+    return numeric_reviewer_scores, good_paper_text_reviewer_scores, bad_paper_text_reviewer_scores, highest_score_paper_details, lowest_score_paper_details
 
 
-def write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_text_reviewer_scores_output, bad_paper_text_reviewer_scores_output, three_highest_score_paper_details, three_lowest_score_paper_details, evaluator, duration):
+def write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_text_reviewer_scores_output, bad_paper_text_reviewer_scores_output, highest_score_paper_details, lowest_score_paper_details, evaluator, duration):
     """ Write output results to JSON and HTML files """
     with open(os.path.join(score_dir, 'scores.json'), 'w') as score_file, \
          open(os.path.join(score_dir, 'scores_ai_reviewer.html'), 'w') as html_file:
@@ -103,7 +76,7 @@ def write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_
 
         html_file.write("<p>")
 
-        print_numeric_scores("Average meta-reviewer evaluation of your reviewer's NUMERICAL scores", numeric_reviewer_scores, evaluator, html_file)
+        print_numeric_scores("Average meta-reviewer evaluation of your reviewer's NUMERICAL scores", numeric_reviewer_scores_output, evaluator, html_file)
 
         if evaluator.EVALUATION_MODE == 'full':
             
@@ -113,18 +86,18 @@ def write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_
             # a small note The numbers below are the accuracy of rating good papers better than bad papers
             # html_file.write("<small>The numbers below are the accuracy of rating good papers better than bad papers</small><br>")
 
-            html_file.write("Three best meta-reviews:<br>\n")
+            html_file.write(f"{len(highest_score_paper_details)} best meta-reviews:<br>\n")
             html_file.write("<ol>")
-            for i in range(3):
+            for i in range(len(highest_score_paper_details)):
                 if SEPARATE_HTML_EACH_PAPER:
                     html_file.write(f"<li><a href='ai_reviewer_full_papers/best_reviews_paper_{i+1}.html'>Paper {i+1}</a></li>")
                 else:
                     html_file.write(f"<li><a href='#best_reviews_paper_{i+1}'>Paper {i+1}</a></li>")
             html_file.write("</ol>")
 
-            html_file.write("Three worst meta-reviews:<br>\n")
+            html_file.write(f"{len(lowest_score_paper_details)} worst meta-reviews:<br>\n")
             html_file.write("<ol>")
-            for i in range(3):
+            for i in range(len(lowest_score_paper_details)):
                 if SEPARATE_HTML_EACH_PAPER:
                     html_file.write(f"<li><a href='ai_reviewer_full_papers/worst_reviews_paper_{i+1}.html'>Paper {i+1}</a></li>")
                 else:
@@ -133,19 +106,19 @@ def write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_
             html_file.write("<br>")
             
             html_file.write("Average evaluation of GOOD papers:<br><br>")
-            evaluator.plot_reviewer_scores_to_html(good_paper_text_reviewer_scores, html_file)
+            evaluator.plot_reviewer_scores_to_html(good_paper_text_reviewer_scores_output, html_file)
             html_file.write("<br>\n")
             html_file.write("Average evaluation of BAD papers:<br><br>")
-            evaluator.plot_reviewer_scores_to_html(bad_paper_text_reviewer_scores, html_file)
+            evaluator.plot_reviewer_scores_to_html(bad_paper_text_reviewer_scores_output, html_file)
 
 
             if not SEPARATE_HTML_EACH_PAPER:
-                for i in range(3):
+                for i in range(len(highest_score_paper_details)):
                     html_file.write(f"<h2 id='best_reviews_paper_{i+1}'>Best meta-reviews {i+1}</h2>")
-                    evaluator.write_paper_details_to_html_file(three_highest_score_paper_details[i], html_file, anchor_name=f'best_reviews_paper_{i+1}')
-                for i in range(3):
+                    evaluator.write_paper_details_to_html_file(highest_score_paper_details[i], html_file, anchor_name=f'best_reviews_paper_{i+1}')
+                for i in range(len(lowest_score_paper_details)):
                     html_file.write(f"<h2 id='worst_reviews_paper_{i+1}'>Worst meta-reviews {i+1}</h2>")
-                    evaluator.write_paper_details_to_html_file(three_lowest_score_paper_details[i], html_file, anchor_name=f'worst_reviews_paper_{i+1}')
+                    evaluator.write_paper_details_to_html_file(lowest_score_paper_details[i], html_file, anchor_name=f'worst_reviews_paper_{i+1}')
 
 
 
@@ -163,13 +136,13 @@ def write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_
         if not os.path.exists(paper_details_dir):
             os.makedirs(paper_details_dir)
 
-        for i in range(3):
+        for i in range(len(highest_score_paper_details)):
             with open(os.path.join(score_dir, 'ai_reviewer_full_papers', f'best_reviews_paper_{i+1}.html'), 'w') as html_file:
-                evaluator.write_paper_details_to_html_file(three_highest_score_paper_details[i], html_file)
+                evaluator.write_paper_details_to_html_file(highest_score_paper_details[i], html_file)
 
-        for i in range(3):
+        for i in range(len(lowest_score_paper_details)):
             with open(os.path.join(score_dir, 'ai_reviewer_full_papers', f'worst_reviews_paper_{i+1}.html'), 'w') as html_file:
-                evaluator.write_paper_details_to_html_file(three_lowest_score_paper_details[i], html_file)
+                evaluator.write_paper_details_to_html_file(lowest_score_paper_details[i], html_file)
 
 
 def print_numeric_scores(score_title, score, evaluator, html_file):
@@ -203,8 +176,10 @@ def main():
     create_score_directory(score_dir)
     evaluator = Evaluator()
 
-    numeric_reviewer_scores_output, good_paper_text_reviewer_scores_output, bad_paper_text_reviewer_scores_output, three_highest_score_paper_details, three_lowest_score_paper_details = compute_scores(evaluator, solution_dir, prediction_dir, data_name)
-    write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_text_reviewer_scores_output, bad_paper_text_reviewer_scores_output, three_highest_score_paper_details, three_lowest_score_paper_details, evaluator, duration=time.time() - start)
+    numeric_reviewer_scores_output, good_paper_text_reviewer_scores_output, bad_paper_text_reviewer_scores_output, highest_score_paper_details, lowest_score_paper_details = compute_scores(evaluator, solution_dir, prediction_dir, data_name)
+    write_to_output_files(score_dir, numeric_reviewer_scores_output, good_paper_text_reviewer_scores_output, bad_paper_text_reviewer_scores_output, highest_score_paper_details, lowest_score_paper_details, evaluator, duration=time.time() - start)
+    get_llm_cache().write_stats(os.path.join(score_dir, 'llm_cache_stats.json'))
+    get_key_pool().write_stats(os.path.join(score_dir, 'key_pool_stats.json'))
 
     if DEBUG_MODE > 1:
         libscores.show_platform()
@@ -0,0 +1,18 @@
+# Tests of the reviewer scoring program. The modules of the program import each other as top-level
+# modules (as when score.py is run), and some share their name with the generator scoring program:
+# run the tests of each program on their own, e.g. python -m pytest reviewer_scoring_program/tests
+
+import os
+import sys
+
+import pytest
+
+PROGRAM_DIR = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+SAMPLE_DATA_DIR = os.path.join(os.path.dirname(PROGRAM_DIR), "sample_data")
+sys.path.insert(0, PROGRAM_DIR)
+
+
+@pytest.fixture
+def evaluator():
+    from evaluator import Evaluator
+    return Evaluator()
@@ -0,0 +1,94 @@
+import os
+import random
+
+import pandas as pd
+import pytest
+
+from conftest import SAMPLE_DATA_DIR
+
+SUPER_CATEGORIES = ['relevance', 'clarity', 'contribution', 'soundness', 'responsibility', 'overall']
+
+
+def legacy_reviewer_sets(reviewer_solutions, super_categories):
+    """ Criteria and ids of the sets, as built by the substring matching that the label index replaces """
+    criteria = {}
+    for solution_type in reviewer_solutions['good_or_bad'].unique():
+        if 'good' in solution_type or 'human' in solution_type:
+            continue
+        criterion = solution_type.split("_")[1]
+        for super_category in super_categories:
+            if criterion.startswith(super_category):
+                criteria[super_category] = []
+                break
+
+    good_scores_df = reviewer_solutions[reviewer_solutions['good_or_bad'].apply(lambda x: 'good_1' in x)]
+    good_scores_ids_as_index = good_scores_df.groupby('pdf_name')['id'].apply(list)
+    good_scores_ids = good_scores_ids_as_index.values
+
+    bad_scores_ids_dict = {}
+    for criterion in criteria:
+        bad_scores_df = reviewer_solutions[reviewer_solutions['good_or_bad'].apply(lambda x: criterion in x)]
+        bad_scores_ids_as_index = bad_scores_df.groupby('pdf_name')['id'].apply(list)
+        bad_scores_ids_dict[criterion] = bad_scores_ids_as_index[good_scores_ids_as_index.index].values
+
+    bad_scores_df = reviewer_solutions[reviewer_solutions['good_or_bad'].apply(lambda x: 'bad' in x)]
+    bad_scores_ids_as_index = bad_scores_df.groupby('pdf_name')['id'].apply(list)
+    bad_scores_ids = bad_scores_ids_as_index[good_scores_ids_as_index.index].values
+    return criteria, good_scores_ids, bad_scores_ids_dict, bad_scores_ids
+
+
+def as_lists(sets_ids):
+    return [[int(paper_id) for paper_id in set_ids] for set_ids in sets_ids]
+
+
+def assert_same_sets(evaluator, reviewer_solutions):
+    evaluator.reviewer_solutions = reviewer_solutions.copy()
+    evaluator.index_reviewer_solutions()
+    evaluator.prepare_reviewer_sets()
+    criteria, good_scores_ids, bad_scores_ids_dict, bad_scores_ids = legacy_reviewer_sets(reviewer_solutions, SUPER_CATEGORIES)
+
+    assert list(evaluator.numeric_reviewer_ranking_scores) == list(criteria)
+    assert as_lists(evaluator.good_scores_ids) == as_lists(good_scores_ids)
+    assert list(evaluator.bad_scores_ids_dict) == list(bad_scores_ids_dict)
+    for criterion, sets_ids in bad_scores_ids_dict.items():
+        assert as_lists(evaluator.bad_scores_ids_dict[criterion]) == as_lists(sets_ids)
+    assert as_lists(evaluator.bad_scores_ids) == as_lists(bad_scores_ids)
+
+
+@pytest.fixture
+def sample_solutions():
+    return pd.read_csv(os.path.join(SAMPLE_DATA_DIR, "reviewer", "metadata.csv"))[['id', 'pdf_name', 'good_or_bad']]
+
+
+@pytest.mark.parametrize("label, parsed", [
+    ("good_1", ("good", None, None, 1)),
+    ("good_2", ("good", None, None, 2)),
+    ("human", ("human", None, None, None)),
+    ("bad_relevance1", ("bad", "relevance", "", 1)),
+    ("bad_soundness_2", ("bad", "soundness", "", 2)),
+    ("bad_contributionabstract_2", ("bad", "contribution", "abstract", 2)),
+    ("bad_claritycorrectlanguage_1", ("bad", "clarity", "correctlanguage", 1)),
+    ("bad_unknown_1", ("bad", None, None, 1)),
+])
+def test_parse_good_or_bad(label, parsed):
+    from evaluator import parse_good_or_bad
+    assert parse_good_or_bad(label, SUPER_CATEGORIES) == parsed
+
+
+def test_sample_sets_match_legacy(evaluator, sample_solutions):
+    assert_same_sets(evaluator, sample_solutions)
+
+
+@pytest.mark.parametrize("seed", range(5))
+def test_shuffled_sets_match_legacy(evaluator, sample_solutions, seed):
+    rng = random.Random(seed)
+    labels = sorted(set(sample_solutions['good_or_bad']))
+    rows = []
+    for set_i in range(200):
+        # Sets may miss their second papers and human paper, and come in no particular order
+        set_labels = [label for label in labels if not (label == "human" or label.endswith("_2")) or rng.random() < 0.5]
+        rng.shuffle(set_labels)
+        pdf_name = f"paper_{rng.randint(0, 10**6)}_{set_i}"
+        rows += [{'id': len(rows) + i, 'pdf_name': pdf_name, 'good_or_bad': label} for i, label in enumerate(set_labels)]
+    reviewer_solutions = pd.DataFrame(rows).sample(frac=1, random_state=seed).reset_index(drop=True)
+    assert_same_sets(evaluator, reviewer_solutions)
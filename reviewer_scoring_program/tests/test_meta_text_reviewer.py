@@ -0,0 +1,77 @@
+import asyncio
+import random
+import re
+
+import numpy as np
+import pytest
+
+import meta_text_reviewer
+from meta_text_reviewer import MetaTextReviewer
+
+CRITERIA = ['relevance', 'clarity']
+
+
+class StubbedRespectfulness:
+    """ Respectfulness of the k-th review: k / 100 """
+
+    def evaluate(self, score, comment):
+        return int(re.search(r"comment (\d+)", comment).group(1)) / 100
+
+
+@pytest.fixture
+def reviewer(monkeypatch):
+    """ MetaTextReviewer whose LLM answers the Likert prompts of the k-th review with 1 + k % 3, after a random
+    delay so that the answers come back in any order. Failures can be added by prompt (reviewer.failures) """
+    reviewer = MetaTextReviewer()
+    reviewer.respectfulness_reviewer = StubbedRespectfulness()
+    reviewer.failures = {}
+    reviewer.calls = []
+    rng = random.Random(0)
+
+    async def aask_chat_gpt(prompt, **kwargs):
+        content = prompt[-1]["content"]
+        reviewer.calls.append(content)
+        await asyncio.sleep(rng.random() / 100)
+        for marker, answers in reviewer.failures.items():
+            if marker in content and answers:
+                return {"choices": [{"message": {"role": "assistant", "content": answers.pop(0)}}]}
+        k = int(re.search(r"comment (\d+)", content).group(1))
+        return {"choices": [{"message": {"role": "assistant", "content": str(1 + k % 3)}}]}
+    monkeypatch.setattr(meta_text_reviewer, "aask_chat_gpt", aask_chat_gpt)
+    return reviewer
+
+
+def make_reviews(first, num_reviews):
+    return [{criterion: {"score": 3, "comment": f"{criterion} comment {k}"} for criterion in CRITERIA} for k in range(first, first + num_reviews)]
+
+
+def expected_meta_review(k):
+    return np.array([(k % 3) / 2] * 4 + [k / 100])
+
+
+def test_meta_reviews_keep_the_order_of_the_sets_and_reviews(reviewer):
+    sets = [make_reviews(0, 4), make_reviews(4, 1), make_reviews(5, 6)]
+    all_meta_reviews = reviewer.get_meta_review_scores_of_sets(sets, CRITERIA)
+    assert [len(meta_reviews) for meta_reviews in all_meta_reviews] == [4, 1, 6]
+    for meta_reviews, reviews in zip(all_meta_reviews, sets):
+        for meta_review, review in zip(meta_reviews, reviews):
+            k = int(review["clarity"]["comment"].split()[-1])
+            assert list(meta_review) == CRITERIA
+            for criterion in CRITERIA:
+                np.testing.assert_array_equal(meta_review[criterion], expected_meta_review(k))
+    # Four Likert prompts per review and criterion
+    assert len(reviewer.calls) == 11 * len(CRITERIA) * 4
+
+
+def test_likert_scores_are_retried(reviewer):
+    # Unparsable answers are asked again, "Assessment: x/y" answers are read as x/y
+    reviewer.failures = {"comment 7": ["maybe", "no idea"], "comment 8": ["Assessment: 2/4"]}
+    assert asyncio.run(reviewer.aget_likert_score("relevance comment 7")) == 0.5
+    assert len(reviewer.calls) == 3
+    assert asyncio.run(reviewer.aget_likert_score("relevance comment 8")) == 0.5
+
+
+def test_likert_score_is_none_after_five_failures(reviewer):
+    reviewer.failures = {"comment 1": ["maybe"] * 5}
+    assert asyncio.run(reviewer.aget_likert_score("relevance comment 1")) is None
+    assert len(reviewer.calls) == 5
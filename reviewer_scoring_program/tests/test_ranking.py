@@ -0,0 +1,59 @@
+import threading
+
+import numpy as np
+import pytest
+from scipy import stats
+
+
+def legacy_ranks_and_pairs(good_scores, good_sets, bad_scores, bad_counts):
+    """ Ranks and pairs of the loop over the sets that rank_good_against_bad replaces """
+    bad_starts = np.cumsum(bad_counts) - bad_counts
+    ranks, pairs = [], []
+    for good_score, set_i in zip(good_scores, good_sets):
+        all_bad_scores = list(bad_scores[bad_starts[set_i]:bad_starts[set_i] + bad_counts[set_i]])
+        ranks.append(stats.percentileofscore(all_bad_scores, good_score, kind='strict') / 100)
+        pairs += [(good_score, bad_score) for bad_score in all_bad_scores]
+    return np.array(ranks), np.array(pairs).reshape(-1, 2)
+
+
+@pytest.mark.parametrize("seed", range(20))
+def test_rank_good_against_bad_matches_percentileofscore(evaluator, seed):
+    rng = np.random.default_rng(seed)
+    num_sets = int(rng.integers(1, 30))
+    goods_per_set = rng.integers(1, 3, num_sets)
+    bad_counts = rng.integers(1, 8, num_sets)
+    # Few distinct scores, so that ties between good and bad scores are frequent
+    good_scores = rng.integers(0, 6, goods_per_set.sum()).astype(float) / 2
+    good_sets = np.repeat(np.arange(num_sets), goods_per_set)
+    bad_scores = rng.integers(0, 6, bad_counts.sum()).astype(float) / 2
+
+    ranks, pairs = evaluator.rank_good_against_bad(good_scores, good_sets, bad_scores, bad_counts)
+    legacy_ranks, legacy_pairs = legacy_ranks_and_pairs(good_scores, good_sets, bad_scores, bad_counts)
+    np.testing.assert_array_equal(ranks, legacy_ranks)
+    np.testing.assert_array_equal(pairs, legacy_pairs)
+
+
+def test_missing_good_score_is_not_ranked_first(evaluator):
+    ranks, _ = evaluator.rank_good_against_bad(np.array([np.nan]), np.array([0]), np.array([3., 4., 5.]), np.array([3]))
+    assert np.isnan(ranks).all()
+
+
+def test_missing_bad_score_makes_the_ranks_of_its_set_nan(evaluator):
+    ranks, _ = evaluator.rank_good_against_bad(np.array([4., 4.]), np.array([0, 1]), np.array([3., np.nan, 3., 5.]), np.array([2, 2]))
+    assert np.isnan(ranks[0])
+    assert ranks[1] == 0.5
+
+
+def test_numeric_scores_raise_on_a_missing_criterion(evaluator):
+    evaluator.reviewer_predictions = {
+        1: {"clarity": {"score": 4}, "soundness": {"score": 3}},
+        2: {"clarity": {"score": 2}, "soundness": {"score": 1}},
+        3: {"clarity": {"score": 5}},
+    }
+    evaluator.numeric_reviewer_ranking_scores = {"clarity": [], "soundness": []}
+    evaluator.good_scores_ids = [[3]]
+    evaluator.bad_scores_ids_dict = {"clarity": [[1]], "soundness": [[2]]}
+    evaluator.numeric_scores_ready = threading.Event()
+    with pytest.raises(KeyError, match="paper 3 has no soundness score"):
+        evaluator.compute_numeric_reviewer_scores()
+    assert evaluator.numeric_scores_ready.is_set()
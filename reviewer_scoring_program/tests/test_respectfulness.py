@@ -0,0 +1,69 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+from metacriteria import e_respectfulness
+from metacriteria.e_respectfulness import Respectfulness
+from rate_limiter import TokenBucket
+
+REQUESTS_PER_SECOND = 20
+
+
+@pytest.fixture
+def respectfulness(monkeypatch):
+    """ Respectfulness whose Perspective API gives each comment a toxicity of len(comment) / 100, and keeps the time
+    and comment of the requests it gets (respectfulness.requests_sent). Comments in respectfulness.quota_errors are
+    first answered with a 429 """
+    respectfulness = Respectfulness()
+    respectfulness.requests = TokenBucket(1, REQUESTS_PER_SECOND)
+    respectfulness.requests_sent = []
+    respectfulness.quota_errors = set()
+    lock = threading.Lock()
+
+    class Request:
+        def __init__(self, body):
+            self.comment = body["comment"]["text"]
+
+        def execute(self):
+            with lock:
+                respectfulness.requests_sent.append((time.monotonic(), self.comment))
+                if self.comment in respectfulness.quota_errors:
+                    respectfulness.quota_errors.remove(self.comment)
+                    raise HttpError(httplib2.Response({"status": 429}), b"Quota exceeded")
+            return {"attributeScores": {"TOXICITY": {"summaryScore": {"value": len(self.comment) / 100}}}}
+
+    class Client:
+        def comments(self):
+            return self
+
+        def analyze(self, body):
+            return Request(body)
+    monkeypatch.setattr(e_respectfulness.discovery, "build", lambda *args, **kwargs: Client())
+    monkeypatch.setattr(e_respectfulness, "ERROR_TIMEOUT", 0)
+    return respectfulness
+
+
+def test_requests_stay_within_the_quota(respectfulness):
+    comments = ["x" * length for length in range(1, 9)]
+    respectfulness.quota_errors = {comments[3]}
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        scores = list(executor.map(respectfulness.evaluate, [3] * len(comments), comments))
+    assert scores == pytest.approx([1 - len(comment) / 100 for comment in comments])
+
+    # The retry after a 429 is throttled too
+    times = [request_time for request_time, _ in respectfulness.requests_sent]
+    assert len(times) == len(comments) + 1
+    assert min(later - earlier for earlier, later in zip(times, times[1:])) >= 0.9 / REQUESTS_PER_SECOND
+
+
+def test_toxicity_is_requested_once_per_comment(respectfulness):
+    comments = [f"comment {i}" for i in range(6)]
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        first_scores = list(executor.map(respectfulness.evaluate, [3] * len(comments), comments))
+        second_scores = list(executor.map(respectfulness.evaluate, [3] * len(comments), comments))
+    assert second_scores == first_scores
+    assert sorted(comment for _, comment in respectfulness.requests_sent) == comments
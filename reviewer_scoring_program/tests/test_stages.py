@@ -0,0 +1,106 @@
+import json
+import threading
+
+import numpy as np
+import pandas as pd
+import pytest
+
+CRITERIA = ['relevance', 'clarity', 'contribution', 'soundness', 'responsibility']
+LABELS = ["good_1"] + [f"bad_{criterion}_1" for criterion in CRITERIA]
+
+
+class StubbedMetaTextReviewer:
+    """ Meta-reviews every review with 0.5 for each meta-criterion, and keeps the reviews it got """
+
+    def __init__(self):
+        self.reviews = []
+        self.lock = threading.Lock()
+
+    def get_meta_review_scores(self, scores_and_comments, criteria):
+        with self.lock:
+            self.reviews += scores_and_comments
+        return [{criterion: np.full(5, 0.5) for criterion in criteria} for _ in scores_and_comments]
+
+    def get_meta_review_scores_of_sets(self, all_scores_and_comments, criteria):
+        return [self.get_meta_review_scores(scores_and_comments, criteria) for scores_and_comments in all_scores_and_comments]
+
+    def get_meta_review_reasons(self, review, meta_review_score, criteria):
+        return {criterion: ["reason"] * 5 for criterion in criteria}
+
+
+@pytest.fixture
+def staged_evaluator(evaluator, tmp_path):
+    """ Evaluator of two paper sets (a good paper and a bad paper of each criterion), whose stages are counted
+    (evaluator.stages) and whose meta-reviews are stubbed """
+    (tmp_path / "reviewer").mkdir()
+    pd.DataFrame({"id": range(12), "pdf_name": [pdf_name for pdf_name in ("set_a", "set_b") for _ in LABELS], "good_or_bad": LABELS * 2}).to_csv(tmp_path / "reviewer" / "metadata.csv", index=False)
+    predictions = []
+    for paper_id in range(12):
+        score = 5 if LABELS[paper_id % len(LABELS)] == "good_1" else 1
+        review = {criterion.title(): {"score": score, "comment": f"{criterion} of paper {paper_id}"} for criterion in CRITERIA + ["overall"]}
+        predictions.append(f"ID: {paper_id}\n" + json.dumps(review))
+    (tmp_path / "predictions.txt").write_text("\n\n\n\n".join(predictions + ["EVALUATION_MODE: full"]))
+    evaluator.read_reviewer_solutions_and_predictions(str(tmp_path), str(tmp_path / "predictions.txt"))
+    evaluator.meta_text_reviewer = StubbedMetaTextReviewer()
+
+    evaluator.stages = []
+    evaluator.stage_errors = []
+    compute_numeric_reviewer_scores, compute_text_meta_reviews = evaluator.compute_numeric_reviewer_scores, evaluator.compute_text_meta_reviews
+
+    def numeric_stage():
+        evaluator.stages.append("numeric")
+        try:
+            compute_numeric_reviewer_scores()
+        except Exception as e:
+            evaluator.stage_errors.append(("numeric", e))
+            raise
+
+    def text_stage(all_scores_and_comments, paper_set):
+        evaluator.stages.append(paper_set)
+        try:
+            return compute_text_meta_reviews(all_scores_and_comments, paper_set)
+        except Exception as e:
+            evaluator.stage_errors.append((paper_set, e))
+            raise
+    evaluator.compute_numeric_reviewer_scores = numeric_stage
+    evaluator.compute_text_meta_reviews = text_stage
+    return evaluator
+
+
+def test_each_stage_runs_once(staged_evaluator):
+    evaluator = staged_evaluator
+    numeric_scores = evaluator.get_numeric_reviewer_scores()
+    evaluator.get_good_paper_text_reviewer_scores()
+    evaluator.get_bad_paper_text_reviewer_scores()
+    evaluator.get_overall_reviewer_scores()
+
+    assert sorted(evaluator.stages) == ["bad", "good", "numeric"]
+    assert numeric_scores == {criterion: 1.0 for criterion in CRITERIA}
+    # Every review is meta-reviewed once
+    assert sorted(review["clarity"]["comment"] for review in evaluator.meta_text_reviewer.reviews) == sorted(f"clarity of paper {paper_id}" for paper_id in range(12))
+    np.testing.assert_array_equal(evaluator.average_score_of_good_papers_text_meta_review, np.full((5, 5), 0.5))
+    np.testing.assert_array_equal(evaluator.average_score_of_bad_papers_text_meta_review, np.full((5, 5), 0.5))
+
+
+def test_meta_review_stages_raise_when_the_numeric_stage_fails(staged_evaluator):
+    evaluator = staged_evaluator
+    # A score the numeric stage cannot rank
+    evaluator.reviewer_predictions[6]["clarity"]["score"] = "five"
+    errors = []
+
+    def compute():
+        try:
+            evaluator.compute_reviewer_scores_once()
+        except Exception as e:
+            errors.append(e)
+    # Run aside, so that stages waiting forever fail the test instead of hanging it
+    thread = threading.Thread(target=compute, daemon=True)
+    thread.start()
+    thread.join(timeout=60)
+    assert not thread.is_alive()
+
+    stage_errors = dict(evaluator.stage_errors)
+    assert sorted(stage_errors) == ["bad", "good", "numeric"]
+    assert errors == [stage_errors["numeric"]]
+    assert isinstance(stage_errors["good"], RuntimeError) and isinstance(stage_errors["bad"], RuntimeError)
+    assert evaluator.meta_text_reviewer.reviews == []
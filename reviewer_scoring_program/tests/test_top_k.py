@@ -0,0 +1,78 @@
+import random
+
+import numpy as np
+import pytest
+
+from config import NUM_BEST_AND_WORST_REVIEWS
+from top_k import TopK
+
+CRITERIA = ['relevance', 'clarity', 'contribution', 'soundness', 'responsibility']
+
+
+def stable_top_k(scores, k, largest):
+    """ The k best or worst (score, index), ties going to the first index """
+    return sorted(((score, i) for i, score in enumerate(scores)), key=lambda pair: -pair[0] if largest else pair[0])[:k]
+
+
+@pytest.mark.parametrize("largest", [True, False])
+@pytest.mark.parametrize("seed", range(10))
+def test_top_k_matches_stable_sort(largest, seed):
+    rng = random.Random(seed)
+    for _ in range(200):
+        k = rng.randint(0, 6)
+        # Few distinct scores, so that ties are frequent
+        scores = [rng.randint(0, 5) / 2 for _ in range(rng.randint(0, 20))]
+        top_k = TopK(k, largest=largest)
+        for i, score in enumerate(scores):
+            top_k.push(score, i)
+        assert top_k.items() == stable_top_k(scores, k, largest)
+        assert len(top_k) == min(k, len(scores))
+
+
+def test_top_k_of_zero_keeps_nothing():
+    top_k = TopK(0)
+    assert not top_k.push(1.0, "paper")
+    assert top_k.items() == []
+
+
+class ReasonsStub:
+    def get_meta_review_reasons(self, review, meta_review_score, criteria):
+        return {"review": review}
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_merge_text_reviewer_scores(evaluator, seed):
+    rng = random.Random(seed)
+    num_sets, num_bad = rng.randint(2, 6), rng.randint(1, 4)
+    meta_review = lambda: {criterion: np.array([rng.choice([0, 0.5, 1]) for _ in range(5)]) for criterion in CRITERIA}
+    good_meta_reviews = [[meta_review()] for _ in range(num_sets)]
+    bad_meta_reviews = [[meta_review() for _ in range(num_bad)] for _ in range(num_sets)]
+    ids = iter(rng.sample(range(10000), num_sets * (num_bad + 1)))
+    evaluator.good_scores_ids = [[next(ids)] for _ in range(num_sets)]
+    evaluator.bad_scores_ids = [[next(ids) for _ in range(num_bad)] for _ in range(num_sets)]
+    evaluator.reviewer_predictions = {paper_id: f"review {paper_id}" for paper_id in range(10000)}
+    evaluator.meta_text_reviewer = ReasonsStub()
+    evaluator.merge_text_reviewer_scores(good_meta_reviews, bad_meta_reviews)
+
+    # Averages of the good and bad sets, summed paper by paper as the scores were before
+    for meta_reviews, average in [(good_meta_reviews, evaluator.average_score_of_good_papers_text_meta_review),
+                                  (bad_meta_reviews, evaluator.average_score_of_bad_papers_text_meta_review)]:
+        expected = np.zeros((len(CRITERIA), 5))
+        for set_meta_reviews in meta_reviews:
+            for paper_meta_review in set_meta_reviews:
+                for crit_j, criterion in enumerate(CRITERIA):
+                    expected[crit_j] += paper_meta_review[criterion]
+        np.testing.assert_allclose(average, expected / (num_sets * len(meta_reviews[-1])))
+
+    # Best and worst meta-reviews, with the id of the paper they belong to
+    papers = [(paper_id, paper_meta_review)
+              for meta_reviews, sets_ids in [(good_meta_reviews, evaluator.good_scores_ids), (bad_meta_reviews, evaluator.bad_scores_ids)]
+              for set_meta_reviews, set_ids in zip(meta_reviews, sets_ids)
+              for paper_id, paper_meta_review in zip(set_ids, set_meta_reviews)]
+    means = [np.mean([paper_meta_review[criterion] for criterion in CRITERIA]) for _, paper_meta_review in papers]
+    for details, largest in [(evaluator.highest_score_paper_details, True), (evaluator.lowest_score_paper_details, False)]:
+        expected = [papers[paper_i] for _, paper_i in stable_top_k(means, NUM_BEST_AND_WORST_REVIEWS, largest)]
+        assert [paper["id"] for paper in details] == [paper_id for paper_id, _ in expected]
+        for paper, (_, paper_meta_review) in zip(details, expected):
+            assert paper["meta_review_score"] is paper_meta_review
+            assert paper["review"] == f"review {paper['id']}"
@@ -0,0 +1,40 @@
+import heapq
+import itertools
+
+
+class TopK:
+    """Streaming k best (largest=True) or k worst (largest=False) items by score, built on heapq.
+
+    The heap holds the current k items with the one to evict first at its
+    root, so each push costs O(log k). Ties keep the item pushed first: a
+    later item with the same score as the k-th one is not kept, and equal
+    scores are returned in the order they were pushed.
+    """
+
+    def __init__(self, k, largest=True):
+        self.k = k
+        self.largest = largest
+        self._heap = []
+        self._counter = itertools.count()
+
+    def push(self, score, item):
+        """Offer an item with its score. Returns True if it is kept (for now) in the k best or worst"""
+        if self.k <= 0:
+            return False
+        # (key, -order): the root is the worst score kept, and among equal scores the last pushed
+        entry = (score if self.largest else -score, -next(self._counter), item)
+        if len(self._heap) < self.k:
+            heapq.heappush(self._heap, entry)
+            return True
+        if entry[:2] > self._heap[0][:2]:
+            heapq.heapreplace(self._heap, entry)
+            return True
+        return False
+
+    def __len__(self):
+        return len(self._heap)
+
+    def items(self):
+        """[(score, item)] from the best to the worst (largest=True), or from the worst to the best (largest=False)"""
+        entries = sorted(self._heap, key=lambda entry: entry[:2], reverse=True)
+        return [(key if self.largest else -key, item) for key, _, item in entries]
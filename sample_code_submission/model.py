@@ -12,6 +12,7 @@ import json
 from os.path import isfile
 import openai
 import tiktoken
+import functools
 import random
 
 # decorator to retry the function if it fails
@@ -61,14 +62,23 @@ def retry_with_exponential_backoff(
     return wrapper
  
 # count the number of tokens in a message 
-def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
-    """Returns the number of tokens used by a list of messages."""
-    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo")
+@functools.lru_cache(maxsize=None)
+def get_encoding(model):
+    """Returns the tiktoken encoding of a model, built once per process."""
     try:
-        encoding = tiktoken.encoding_for_model(model)
+        return tiktoken.encoding_for_model(model)
     except KeyError:
         print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def num_tokens_from_string(text, encoding_name="cl100k_base"):
+    """Returns the number of tokens of a string."""
+    return len(tiktoken.get_encoding(encoding_name).encode(text))
+
+
+def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
+    """Returns the number of tokens used by a list of messages."""
     if model == "gpt-3.5-turbo":
         print("Warning: gpt-3.5-turbo may change over time. Returning num tokens assuming gpt-3.5-turbo-0301.")
         return num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301")
@@ -83,11 +93,12 @@ def num_tokens_from_messages(messages, model="gpt-3.5-turbo-0301"):
         tokens_per_name = 1
     else:
         raise NotImplementedError(f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens.""")
+    encoding_name = get_encoding(model).name
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
         for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
+            num_tokens += num_tokens_from_string(value, encoding_name)
         if key == "name":
             num_tokens += tokens_per_name
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
@@ -130,10 +141,13 @@ class model():
 
     @retry_with_exponential_backoff
     def ask_chat_gpt(self, conversation, model="gpt-3.5-turbo-16k", temperature=0.0):
-        if num_tokens_from_messages(conversation, model="gpt-3.5-turbo-0301") > 8_000:
+        num_tokens = num_tokens_from_messages(conversation, model="gpt-3.5-turbo-0301")
+        if num_tokens > 8_000:
             #num_tokens_from_messages() is greater than 8_000. Truncating conversation to 8_000 tokens
-            while num_tokens_from_messages(conversation, model="gpt-3.5-turbo-0301") > 8_000:
-                conversation[-1]["content"] = conversation[-1]["content"][:-1000]
+            # The last message is encoded once and cut on a token boundary, to what the other messages leave of the budget
+            encoding = get_encoding("gpt-3.5-turbo-0301")
+            tokens = encoding.encode(conversation[-1]["content"])
+            conversation[-1]["content"] = encoding.decode(tokens[:max(len(tokens) - (num_tokens - 8_000), 0)])
         response = openai.ChatCompletion.create(
                     model=model,
                     temperature=temperature,